@@ -0,0 +1,234 @@
+"""
+Audio helpers for segmented voice transcription.
+
+Long recordings are decoded once with ffmpeg to 16kHz mono PCM, split on silence
+into overlapping segments that can be transcribed concurrently, and the segment
+transcripts are stitched back together with the overlap removed.
+
+Like imaging.py, this module stays free of app startup side effects (no database
+clients, env lookups or FastAPI objects); callers pass in their settings.
+"""
+import asyncio
+import io
+import re
+import shutil
+import tempfile
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # What Whisper resamples to internally
+FRAME_SECONDS = 0.03
+MIN_SILENCE_SECONDS = 0.3
+
+# Containers ffmpeg cannot reliably read from a pipe (the index may sit at the end of the file)
+UNSEEKABLE_PIPE_FORMATS = {"mp4", "m4a"}
+
+STITCH_MAX_OVERLAP_WORDS = 40
+STITCH_MAX_EDGE_WORDS = 2  # Words that may be clipped mid-way at a segment edge
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class AudioTooLong(Exception):
+    pass
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+async def decode_to_pcm(audio_file, audio_format: str, max_seconds: float) -> np.ndarray:
+    """
+    Decode audio_file to 16kHz mono int16 samples with ffmpeg.
+    Input is piped from the file object; containers that need seeking go through a temp file.
+    Raises AudioTooLong once the decoded audio passes max_seconds.
+    """
+    audio_file.seek(0)
+    spill = None
+    if audio_format in UNSEEKABLE_PIPE_FORMATS:
+        spill = tempfile.NamedTemporaryFile(suffix=f".{audio_format}")
+        await asyncio.to_thread(shutil.copyfileobj, audio_file, spill)  # Uploads can be tens of MB
+        spill.flush()
+        source = spill.name
+    else:
+        source = "pipe:0"
+
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", source, "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1",
+        stdin=asyncio.subprocess.DEVNULL if spill else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            while True:
+                chunk = audio_file.read(256 * 1024)
+                if not chunk:
+                    break
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg stopped reading; its exit status tells us why
+        finally:
+            proc.stdin.close()
+
+    max_bytes = int(max_seconds * SAMPLE_RATE) * 2
+    pcm = bytearray()
+    feeder = asyncio.ensure_future(feed()) if not spill else None
+    try:
+        while True:
+            chunk = await proc.stdout.read(1024 * 1024)
+            if not chunk:
+                break
+            pcm += chunk
+            if len(pcm) > max_bytes:
+                raise AudioTooLong()
+        if feeder:
+            await feeder
+        stderr = await proc.stderr.read()
+        if await proc.wait() != 0:
+            raise AudioDecodeError(stderr.decode(errors="replace").strip()[-300:])
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if feeder and not feeder.done():
+            feeder.cancel()
+        if spill:
+            spill.close()
+
+    return np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2)  # A view, not a copy
+
+
+def find_silences(samples: np.ndarray) -> list:
+    """
+    Return (start, end) seconds of pauses. The threshold adapts to the recording's
+    noise floor so kitchen background noise still counts as silence.
+    """
+    frame = int(SAMPLE_RATE * FRAME_SECONDS)
+    count = len(samples) // frame
+    if count == 0:
+        return []
+    frames = samples[: count * frame].astype(np.float32).reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1)) + 1e-9
+    db = 20 * np.log10(rms / 32768.0)
+    threshold = min(-30.0, float(np.percentile(db, 15)) + 8.0)
+
+    silent = np.concatenate(([False], db < threshold, [False]))
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    min_frames = int(MIN_SILENCE_SECONDS / FRAME_SECONDS)
+    return [
+        (float(start * FRAME_SECONDS), float(end * FRAME_SECONDS))
+        for start, end in zip(edges[::2], edges[1::2])
+        if end - start >= min_frames
+    ]
+
+
+def plan_segments(duration: float, silences: list, segment_seconds: float, overlap_seconds: float) -> list:
+    """
+    Choose cut points near every segment_seconds, moved to the middle of a nearby pause
+    when there is one, and return (start, end) seconds for each segment including overlap.
+    """
+    if duration <= segment_seconds * 1.25:
+        return [(0.0, duration)]
+
+    window = segment_seconds * 0.25
+    cuts = []
+    position = 0.0
+    while duration - position > segment_seconds * 1.25:
+        target = position + segment_seconds
+        best = None
+        for start, end in silences:
+            center = (start + end) / 2
+            if abs(center - target) > window or center <= position + overlap_seconds:
+                continue
+            # Prefer longer pauses (sentence breaks) over the closest one
+            score = abs(center - target) - 10 * (end - start)
+            if best is None or score < best[0]:
+                best = (score, center)
+        cut = best[1] if best else target
+        cuts.append(cut)
+        position = cut
+
+    bounds = [0.0] + cuts + [duration]
+    return [
+        (max(0.0, start - overlap_seconds), min(duration, end + overlap_seconds))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def encode_wav(samples: np.ndarray) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return out.getvalue()
+
+
+def segment_audio(samples: np.ndarray, segment_seconds: float, overlap_seconds: float) -> list:
+    """
+    Split PCM samples on silence; returns a list of (start_seconds, end_seconds).
+    Encode each with segment_wav when it is sent, so only the segments in flight are held as WAV.
+    """
+    duration = len(samples) / SAMPLE_RATE
+    return plan_segments(duration, find_silences(samples), segment_seconds, overlap_seconds)
+
+
+def segment_wav(samples: np.ndarray, start: float, end: float) -> bytes:
+    return encode_wav(samples[int(start * SAMPLE_RATE): int(end * SAMPLE_RATE)])
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def _overlap(left: list, right: list):
+    """
+    Find where right's opening repeats left's ending. Returns (left_trim, right_skip)
+    word counts, or None when the transcripts do not share an overlap.
+    """
+    left_norm = [_normalize_word(w) for w in left[-(STITCH_MAX_OVERLAP_WORDS + STITCH_MAX_EDGE_WORDS):]]
+    right_norm = [_normalize_word(w) for w in right[: STITCH_MAX_OVERLAP_WORDS + STITCH_MAX_EDGE_WORDS]]
+
+    best = None
+    for left_edge in range(STITCH_MAX_EDGE_WORDS + 1):
+        tail = left_norm[: len(left_norm) - left_edge]
+        for right_edge in range(STITCH_MAX_EDGE_WORDS + 1):
+            head = right_norm[right_edge:]
+            for size in range(min(len(tail), len(head), STITCH_MAX_OVERLAP_WORDS), 1, -1):
+                if best and size <= best[0]:
+                    break
+                if tail[-size:] == head[:size]:
+                    best = (size, left_edge, right_edge)
+                    break
+    if not best:
+        return None
+    size, left_edge, right_edge = best
+    return left_edge, right_edge + size
+
+
+def stitch_transcripts(texts: list) -> str:
+    """Join segment transcripts in order, dropping the words repeated across each overlap."""
+    words = []
+    for text in texts:
+        segment_words = (text or "").split()
+        if not segment_words:
+            continue
+        match = _overlap(words, segment_words) if words else None
+        if match:
+            left_trim, right_skip = match
+            # Keep the left segment's copy of the shared words, minus any clipped edge word
+            if left_trim:
+                del words[-left_trim:]
+            segment_words = segment_words[right_skip:]
+            words.extend(segment_words)
+        else:
+            words.extend(segment_words)
+    return " ".join(words)
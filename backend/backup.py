@@ -0,0 +1,210 @@
+"""
+Readers for Legacy Table export files, used to restore a backup or merge another
+family's collection.
+
+All three export formats are accepted: NDJSON (optionally gzipped), ZIP with photo
+files, and the original single-document JSON. Entries are read one at a time from a
+seekable file object, so memory use does not grow with the size of the export.
+Reading is synchronous, so callers run it in a thread. Like the other helper modules,
+this one stays free of app startup side effects.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import posixpath
+import re
+import zipfile
+
+SUPPORTED_FORMAT_VERSIONS = ("1.", "2.")
+# The original JSON export is one document and is parsed whole; it carries no photos
+MAX_LEGACY_JSON_BYTES = 200 * 1024 * 1024
+MAX_ZIP_ENTRY_BYTES = 64 * 1024 * 1024
+
+PHOTO_MEDIA_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp",
+                     "gif": "image/gif", "heic": "image/heic"}
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+class ExportFormatError(Exception):
+    pass
+
+
+def detect_format(fileobj) -> str:
+    """"zip", "gzip", "ndjson" or "json" from the first bytes of the file (which is rewound)."""
+    head = fileobj.read(64 * 1024)
+    fileobj.seek(0)
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    first_line = head.lstrip().split(b"\n", 1)[0]
+    if first_line.startswith(b"{"):
+        try:
+            if json.loads(first_line).get("type") == "manifest":
+                return "ndjson"
+        except ValueError:
+            pass  # A pretty-printed or long JSON document
+        return "json"
+    raise ExportFormatError("This file is not a Legacy Table export")
+
+
+def _check_version(manifest: dict):
+    version = str(manifest.get("format_version") or "")
+    if not version.startswith(SUPPORTED_FORMAT_VERSIONS):
+        raise ExportFormatError(f"Unsupported export format version: {version or 'missing'}")
+
+
+def _position(raw, size: int) -> float:
+    return min(1.0, raw.tell() / size) if size else 1.0
+
+
+def _ndjson_entries(stream, raw, size: int):
+    seen_manifest = False
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield {"error": f"Line {number} is not valid JSON"}, _position(raw, size)
+            continue
+        kind = item.get("type") if isinstance(item, dict) else None
+        if kind == "manifest":
+            _check_version(item)
+            seen_manifest = True
+        elif kind == "recipe":
+            if not seen_manifest:
+                raise ExportFormatError("The export is missing its manifest line")
+            yield item, _position(raw, size)
+
+
+def _zip_entries(archive: zipfile.ZipFile):
+    try:
+        _check_version(json.loads(archive.read("manifest.json")))
+    except KeyError:
+        raise ExportFormatError("The ZIP has no manifest.json; it was not made by Legacy Table")
+    names = [n for n in archive.namelist() if re.fullmatch(r"recipes/[^/]+/recipe\.json", n)]
+    for number, name in enumerate(names, 1):
+        info = archive.getinfo(name)
+        if info.file_size > MAX_ZIP_ENTRY_BYTES:
+            yield {"error": f"{name} is too large"}, number / len(names)
+            continue
+        try:
+            item = json.loads(archive.read(info))
+        except ValueError:
+            yield {"error": f"{name} is not valid JSON"}, number / len(names)
+            continue
+        recipe = item.get("recipe") if isinstance(item, dict) else None
+        if isinstance(recipe, dict):
+            recipe["photos"] = _zip_photos(archive, posixpath.dirname(name), recipe.get("photos") or [])
+        yield item, number / len(names)
+
+
+def _zip_photos(archive: zipfile.ZipFile, folder: str, paths: list) -> list:
+    """Photos listed by path in recipe.json, as data URLs. Paths outside the recipe's folder are ignored."""
+    photos = []
+    for path in paths:
+        if not isinstance(path, str) or posixpath.dirname(posixpath.normpath(path)) != folder:
+            continue
+        try:
+            info = archive.getinfo(path)
+        except KeyError:
+            continue
+        if info.file_size > MAX_ZIP_ENTRY_BYTES:
+            continue
+        media_type = PHOTO_MEDIA_TYPES.get(path.rsplit(".", 1)[-1].lower(), "image/jpeg")
+        photos.append(f"data:{media_type};base64," + base64.b64encode(archive.read(info)).decode("ascii"))
+    return photos
+
+
+def _legacy_json_entries(stream):
+    data = stream.read(MAX_LEGACY_JSON_BYTES + 1)
+    if len(data) > MAX_LEGACY_JSON_BYTES:
+        raise ExportFormatError("JSON exports this large must be made as NDJSON or ZIP")
+    try:
+        document = json.loads(data)
+    except ValueError:
+        raise ExportFormatError("The file is not valid JSON")
+    if not isinstance(document, dict) or not isinstance(document.get("recipes"), list):
+        raise ExportFormatError("This file is not a Legacy Table export")
+    _check_version(document)
+    recipes = document["recipes"]
+    del document, data
+    for number, recipe in enumerate(recipes, 1):
+        yield {"recipe": recipe, "comments": []}, number / len(recipes)
+
+
+def iter_export_entries(fileobj, size: int):
+    """
+    Yield ({"recipe", "comments"} or {"error"}, fraction of the file read) for every
+    recipe in an export. Raises ExportFormatError for files that are not exports.
+    """
+    fmt = detect_format(fileobj)
+    if fmt == "zip":
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ExportFormatError("The ZIP file is damaged")
+        with archive:
+            yield from _zip_entries(archive)
+        return
+
+    stream = fileobj
+    if fmt == "gzip":
+        stream = gzip.GzipFile(fileobj=fileobj, mode="rb")
+        head = stream.peek(64 * 1024)[:64 * 1024].lstrip()
+        fmt = "ndjson" if head.startswith(b'{"type"') else "json"
+    try:
+        if fmt == "ndjson":
+            yield from _ndjson_entries(stream, fileobj, size)
+        else:
+            yield from _legacy_json_entries(stream)
+    except (OSError, EOFError) as e:  # Truncated or corrupt gzip data
+        raise ExportFormatError(f"The file could not be read: {e}")
+
+
+def _as_int(value, default: int) -> int:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_export_recipe(recipe) -> dict:
+    """The restorable fields of an exported recipe. Raises ValueError if it is not usable."""
+    if not isinstance(recipe, dict):
+        raise ValueError("not an object")
+    title = recipe.get("title")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("missing title")
+    ingredients = recipe.get("ingredients")
+    if not isinstance(ingredients, list) or not all(isinstance(i, str) for i in ingredients):
+        raise ValueError("ingredients must be a list of strings")
+    instructions = recipe.get("instructions")
+    if not isinstance(instructions, str):
+        raise ValueError("instructions must be a string")
+    story = recipe.get("story")
+    difficulty = str(recipe.get("difficulty") or "").lower()
+    return {
+        "title": title.strip()[:300],
+        "ingredients": ingredients,
+        "instructions": instructions,
+        "story": story if isinstance(story, str) else None,
+        "photos": [p for p in recipe.get("photos") or [] if isinstance(p, str) and p],
+        "cooking_time": _as_int(recipe.get("cooking_time"), 30),
+        "servings": _as_int(recipe.get("servings"), 4),
+        "category": str(recipe.get("category") or "Main Course"),
+        "difficulty": difficulty if difficulty in DIFFICULTIES else "easy",
+        "holiday_tags": [t for t in recipe.get("holiday_tags") or [] if isinstance(t, str)],
+    }
+
+
+def recipe_content_hash(recipe: dict) -> str:
+    """Identifies the same recipe across exports, ignoring case and whitespace."""
+    def norm(text) -> str:
+        return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+    parts = [norm(recipe.get("title")), *(norm(i) for i in recipe.get("ingredients") or []),
+             norm(recipe.get("instructions"))]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
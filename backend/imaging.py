@@ -0,0 +1,249 @@
+"""
+CPU-bound image helpers for the AI recipe scanner.
+
+These functions run inside a process pool, so this module must stay free of
+app startup side effects (no database clients, env lookups or FastAPI objects).
+"""
+import io
+import math
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Preprocessing profiles for vision calls.
+# "standard" is the first pass: the card cropped and scaled to fit two 512px
+# vision tiles, in grayscale with normalized contrast (faded ink and pencil read
+# better). "detail" is the retry after a low-confidence parse: colour kept, at the
+# largest size the model uses for detail="high".
+SCAN_PREPROCESS_PROFILES = {
+    "standard": {
+        "max_long_side": 1024, "max_short_side": 768, "max_tiles": 2,
+        "grayscale": True, "quality": 80, "detail": "high",
+    },
+    "detail": {
+        "max_long_side": 2048, "max_short_side": 768, "max_tiles": None,
+        "grayscale": False, "quality": 88, "detail": "high",
+    },
+}
+
+VISION_TILE_SIZE = 512
+
+# Content smaller than this fraction of the frame is assumed to be a bad crop
+MIN_CROP_AREA_RATIO = 0.2
+CROP_MARGIN_RATIO = 0.02
+BACKGROUND_DIFF_THRESHOLD = 40
+
+# Pre-scan quality check, measured on a grayscale copy of the content scaled to
+# QUALITY_CHECK_LONG_SIDE. Values under a "reject" threshold turn the photo away
+# before it is charged; "warn" values let it through with a warning.
+QUALITY_CHECK_LONG_SIDE = 1024
+SCAN_QUALITY_THRESHOLDS = {
+    "dark_reject": 35.0,       # Mean brightness, 0-255
+    "dark_warn": 70.0,
+    "bright_reject": 250.0,
+    "clipped_warn": 0.2,       # Share of pixels crushed to black or blown to white
+    "contrast_reject": 12.0,   # Brightness range once speckle noise is filtered out
+    "blur_reject": 25.0,       # Variance of the Laplacian
+    "blur_warn": 80.0,
+    "text_reject": 0.002,      # Share of pixels on strong edges (pen and print strokes)
+    "text_warn": 0.01,
+}
+EDGE_THRESHOLD = 40
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Estimate GPT-4o image input tokens using OpenAI's published tiling rules."""
+    if detail == "low":
+        return 85
+    # Fit within 2048x2048, then scale so the shortest side is at most 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _fit_scale(width: int, height: int, settings: dict) -> float:
+    """Largest scale (at most 1.0) that respects the profile's side limits and tile budget."""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = min(1.0, settings["max_long_side"] / long_side, settings["max_short_side"] / short_side)
+
+    max_tiles = settings.get("max_tiles")
+    if max_tiles:
+        # Try every tile grid within the budget and keep the one allowing the largest image
+        best = 0.0
+        for cols in range(1, max_tiles + 1):
+            rows = max_tiles // cols
+            best = max(best, min(cols * VISION_TILE_SIZE / width, rows * VISION_TILE_SIZE / height))
+        scale = min(scale, best)
+    return scale
+
+
+def _content_bbox(gray: Image.Image):
+    """
+    Return the bounding box of the recipe content in gray, or None when it cannot be told
+    apart from the background. Works on a small thumbnail, so it costs a few milliseconds.
+    """
+    thumb = gray.copy()
+    thumb.thumbnail((256, 256))
+    w, h = thumb.size
+    pixels = thumb.load()
+
+    # The frame border is mostly background (table, counter); take its median brightness
+    border = [pixels[x, 0] for x in range(w)] + [pixels[x, h - 1] for x in range(w)]
+    border += [pixels[0, y] for y in range(h)] + [pixels[w - 1, y] for y in range(h)]
+    border.sort()
+    background = border[len(border) // 2]
+
+    mask = thumb.point(lambda p: 255 if abs(p - background) > BACKGROUND_DIFF_THRESHOLD else 0)
+    mask = mask.filter(ImageFilter.MedianFilter(5))  # Drop speckle noise
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) < MIN_CROP_AREA_RATIO * w * h:
+        return None
+
+    sx, sy = gray.width / w, gray.height / h
+    mx, my = CROP_MARGIN_RATIO * gray.width, CROP_MARGIN_RATIO * gray.height
+    return (
+        max(0, int(left * sx - mx)),
+        max(0, int(top * sy - my)),
+        min(gray.width, int(right * sx + mx)),
+        min(gray.height, int(bottom * sy + my)),
+    )
+
+
+def assess_scan_image(image_bytes: bytes, thresholds: dict = None) -> dict:
+    """
+    Cheap checks that a photo is worth a vision call: exposure (brightness histogram),
+    sharpness (variance of the Laplacian) and text density (share of strong edges).
+    Returns {"verdict": "ok" | "warn" | "reject", "rejected", "warnings", "metrics", "timings_ms"}.
+    """
+    limits = {**SCAN_QUALITY_THRESHOLDS, **(thresholds or {})}
+    timings = {}
+
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "JPEG":
+        img.draft("L", (QUALITY_CHECK_LONG_SIDE, QUALITY_CHECK_LONG_SIDE))
+    gray = img.convert("L")
+    gray.thumbnail((QUALITY_CHECK_LONG_SIDE, QUALITY_CHECK_LONG_SIDE))
+    bbox = _content_bbox(gray)
+    if bbox:
+        gray = gray.crop(bbox)
+    pixels = np.asarray(gray, dtype=np.float32)
+    timings["decode"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    mean = float(pixels.mean())
+    # Min to max rather than a percentile spread: sparse ink (a card with three lines)
+    # is far under 5% of the pixels and would not move the percentiles at all
+    despeckled = np.asarray(gray.filter(ImageFilter.MedianFilter(3)), dtype=np.float32)
+    low, high = float(despeckled.min()), float(despeckled.max())
+    clipped = float(np.mean((pixels < 8) | (pixels > 247)))
+    timings["exposure"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    laplacian = (
+        pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:] - 4 * pixels[1:-1, 1:-1]
+    )
+    sharpness = float(laplacian.var()) if laplacian.size else 0.0
+    timings["blur"] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    gradient = np.abs(np.diff(pixels, axis=1))[:-1, :] + np.abs(np.diff(pixels, axis=0))[:, :-1]
+    text_density = float(np.mean(gradient > EDGE_THRESHOLD)) if gradient.size else 0.0
+    timings["text"] = (time.perf_counter() - started) * 1000
+
+    rejected, warnings = [], []
+    if mean < limits["dark_reject"]:
+        rejected.append("too_dark")
+    elif mean > limits["bright_reject"]:
+        rejected.append("overexposed")
+    elif high - low < limits["contrast_reject"] and text_density < limits["text_reject"]:
+        rejected.append("no_content")
+    else:
+        if sharpness < limits["blur_reject"]:
+            rejected.append("too_blurry")
+        elif sharpness < limits["blur_warn"]:
+            warnings.append("blurry")
+        if text_density < limits["text_reject"] and not rejected:
+            rejected.append("no_text")
+        elif text_density < limits["text_warn"] and not rejected:
+            warnings.append("little_text")
+        if mean < limits["dark_warn"]:
+            warnings.append("dark")
+        if clipped > limits["clipped_warn"]:
+            warnings.append("clipped")
+
+    return {
+        "verdict": "reject" if rejected else "warn" if warnings else "ok",
+        "rejected": rejected,
+        "warnings": warnings,
+        "metrics": {
+            "brightness": round(mean, 1),
+            "contrast": round(high - low, 1),
+            "clipped": round(clipped, 4),
+            "sharpness": round(sharpness, 1),
+            "text_density": round(text_density, 4),
+            "size": f"{gray.width}x{gray.height}",
+        },
+        "timings_ms": {name: round(value, 1) for name, value in timings.items()},
+    }
+
+
+def preprocess_scan_image(image_bytes: bytes, profile: str = "standard") -> dict:
+    """
+    Prepare an uploaded photo for a vision call: apply EXIF rotation, crop to the
+    content, downscale to the model's useful resolution, optionally convert to
+    grayscale with contrast normalization, and recompress as JPEG.
+    """
+    started = time.perf_counter()
+    settings = SCAN_PREPROCESS_PROFILES[profile]
+
+    img = Image.open(io.BytesIO(image_bytes))
+    original_size = img.size
+    if img.format == "JPEG":
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while still leaving headroom for the crop
+        target = settings["max_long_side"] * 1.5
+        ratio = target / max(img.size)
+        if ratio < 1:
+            img.draft("RGB", (int(img.width * ratio), int(img.height * ratio)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    gray = ImageOps.grayscale(img)
+    bbox = _content_bbox(gray)
+    if bbox:
+        img, gray = img.crop(bbox), gray.crop(bbox)
+
+    if settings["grayscale"]:
+        img = ImageOps.autocontrast(gray, cutoff=1)
+
+    scale = _fit_scale(img.width, img.height, settings)
+    if scale < 1.0:
+        # Floor so rounding never spills into an extra vision tile
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=settings["quality"], optimize=True)
+    data = out.getvalue()
+
+    return {
+        "data": data,
+        "media_type": "image/jpeg",
+        "detail": settings["detail"],
+        "width": img.width,
+        "height": img.height,
+        "original_width": original_size[0],
+        "original_height": original_size[1],
+        "original_bytes": len(image_bytes),
+        "bytes": len(data),
+        "cropped": bbox is not None,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,104 @@
+"""
+CPU-bound PDF helpers for cookbook imports.
+
+These functions run inside a process pool, so this module must stay free of
+app startup side effects (no database clients, env lookups or FastAPI objects).
+Workers open the PDF by path so the file is not pickled into every call.
+"""
+import io
+import re
+
+import pypdfium2 as pdfium
+
+# A page with less extractable text than this is treated as a scan and rasterized
+MIN_TEXT_CHARS = 40
+
+# Headings that mark the start of a recipe in a text layer
+RECIPE_START_RE = re.compile(r"^\s*(ingredients|you will need|what you need)\s*:?\s*$", re.IGNORECASE | re.MULTILINE)
+
+# Continuation pages are folded into the current recipe up to this much text
+MAX_UNIT_CHARS = 12000
+# Without any recipe headings, text pages are grouped this many at a time
+FALLBACK_PAGES_PER_UNIT = 2
+
+RENDER_MAX_LONG_SIDE = 2048
+RENDER_MAX_DPI = 200
+
+
+def read_text_layer(path: str) -> list:
+    """Return [{"index", "text", "has_text"}] for every page of the PDF at path."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        pages = []
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_bounded().replace("\r\n", "\n").strip()
+            textpage.close()
+            page.close()
+            pages.append({"index": index, "text": text, "has_text": len(text) >= MIN_TEXT_CHARS})
+        return pages
+    finally:
+        pdf.close()
+
+
+def render_pages(path: str, indexes: list, quality: int = 90) -> list:
+    """Rasterize the given pages to JPEG. Returns [(index, jpeg bytes)]."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        rendered = []
+        for index in indexes:
+            page = pdf[index]
+            width, height = page.get_size()  # PDF points, 72 per inch
+            scale = min(RENDER_MAX_DPI / 72, RENDER_MAX_LONG_SIDE / max(width, height))
+            image = page.render(scale=scale).to_pil().convert("RGB")
+            page.close()
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+            rendered.append((index, out.getvalue()))
+        return rendered
+    finally:
+        pdf.close()
+
+
+def segment_pages(pages: list) -> list:
+    """
+    Group pages into extraction units, each holding one recipe (occasionally a few):
+    - a text page with an "Ingredients" heading starts a new unit; following text pages
+      without one (more instructions, the story) are folded into it
+    - text before the first recipe (cover, table of contents) is skipped
+    - pages without a text layer become single-page "scan" units for the vision model
+    Without any headings in the whole document, text pages are grouped in small runs
+    and the extractor decides what they contain.
+    """
+    has_headings = any(p["has_text"] and RECIPE_START_RE.search(p["text"]) for p in pages)
+    units = []
+    current = None
+
+    for page in pages:
+        if not page["has_text"]:
+            units.append({"kind": "scan", "pages": [page["index"]]})
+            current = None
+            continue
+
+        if has_headings:
+            starts_recipe = RECIPE_START_RE.search(page["text"]) is not None
+            if not starts_recipe and current is None:
+                continue  # Front matter
+            if starts_recipe or len(current["text"]) + len(page["text"]) > MAX_UNIT_CHARS:
+                current = {"kind": "text", "pages": [page["index"]], "text": page["text"]}
+                units.append(current)
+            else:
+                current["pages"].append(page["index"])
+                current["text"] += "\n\n" + page["text"]
+        else:
+            if current is None or len(current["pages"]) >= FALLBACK_PAGES_PER_UNIT:
+                current = {"kind": "text", "pages": [page["index"]], "text": page["text"]}
+                units.append(current)
+            else:
+                current["pages"].append(page["index"])
+                current["text"] += "\n\n" + page["text"]
+
+    for number, unit in enumerate(units):
+        unit["unit"] = number
+    return units
@@ -0,0 +1,304 @@
+"""
+Local recipe extraction for link imports.
+
+Most recipe sites publish their recipes as schema.org markup (JSON-LD or
+microdata), and many video captions spell out the full ingredient list. These
+helpers turn either into the app's recipe schema without an LLM call. Like the
+other helper modules, this one stays free of app startup side effects.
+"""
+import html
+import json
+import re
+from html.parser import HTMLParser
+from typing import Optional
+
+# schema.org recipeCategory / keywords -> app category
+CATEGORY_KEYWORDS = [
+    ("Dessert", ("dessert", "cake", "cookie", "pie", "pudding", "sweet", "baking", "brownie")),
+    ("Breakfast", ("breakfast", "brunch", "pancake", "waffle")),
+    ("Soup", ("soup", "stew", "chowder", "chili")),
+    ("Salad", ("salad",)),
+    ("Appetizer", ("appetizer", "starter", "side", "dip", "hors d")),
+    ("Snack", ("snack",)),
+    ("Beverage", ("beverage", "drink", "cocktail", "smoothie", "juice")),
+    ("Main Course", ("main", "dinner", "lunch", "entree", "entrée", "pot pie", "shepherd's pie", "cottage pie", "meat pie")),
+]
+# Whole words with an optional plural ("cookies"), so "side" does not match "inside"
+CATEGORY_PATTERNS = [
+    (category, keyword, re.compile(rf"\b{re.escape(keyword)}(?:e?s)?\b"))
+    for category, keywords in CATEGORY_KEYWORDS
+    for keyword in keywords
+]
+
+JSON_LD_RE = re.compile(
+    r"<script[^>]*type\s*=\s*[\"']application/ld\+json[\"'][^>]*>(.*?)</script>",
+    re.IGNORECASE | re.DOTALL,
+)
+ISO_DURATION_RE = re.compile(
+    r"^P(?:(?P<days>\d+(?:\.\d+)?)D)?(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?(?:\d+(?:\.\d+)?S)?)?$",
+    re.IGNORECASE,
+)
+
+CAPTION_INGREDIENTS_RE = re.compile(r"^\W*(ingredients?|you(?:'|’)ll need|what you need)\W*$", re.IGNORECASE)
+CAPTION_INSTRUCTIONS_RE = re.compile(
+    r"^\W*(instructions?|directions?|method|steps|preparation|how to make( it)?)\W*$", re.IGNORECASE
+)
+LIST_MARKER_RE = re.compile(r"^(?:[-*•·▪▫◦‣⁃✅✔️☑️🔸🔹]+|\d+[.)]|step \d+[:.)]?)\s*", re.IGNORECASE)
+
+
+def _text(value) -> str:
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("text") or ""
+    return re.sub(r"\s+", " ", html.unescape(str(value or ""))).strip()
+
+
+def parse_duration_minutes(value) -> Optional[int]:
+    """Minutes in an ISO 8601 duration such as PT1H30M, or None."""
+    match = ISO_DURATION_RE.match(_text(value))
+    if not match or not any(match.groupdict().values()):
+        return None
+    parts = {k: float(v) for k, v in match.groupdict().items() if v}
+    minutes = parts.get("days", 0) * 1440 + parts.get("hours", 0) * 60 + parts.get("minutes", 0)
+    return int(round(minutes)) or None
+
+
+def parse_servings(value) -> Optional[int]:
+    values = value if isinstance(value, list) else [value]
+    for item in values:
+        match = re.search(r"\d+", _text(item))
+        if match:
+            return int(match.group())
+    return None
+
+
+def normalize_category(*values) -> str:
+    """
+    App category for the first value that names one, so pass the most telling
+    value first (recipeCategory, then the title, then keywords). Within a value
+    the longest matching keyword wins: "Chicken Pot Pie" is a main, not a pie.
+    """
+    for value in values:
+        text = (" ".join(_text(i) for i in value) if isinstance(value, list) else _text(value)).lower()
+        matches = [(len(keyword), category) for category, keyword, pattern in CATEGORY_PATTERNS if pattern.search(text)]
+        if matches:
+            return max(matches, key=lambda match: match[0])[1]
+    return "Main Course"
+
+
+def estimate_difficulty(cooking_time: Optional[int], ingredient_count: int) -> str:
+    if (cooking_time or 0) > 90 or ingredient_count > 15:
+        return "hard"
+    if (cooking_time or 0) <= 30 and ingredient_count <= 8:
+        return "easy"
+    return "medium"
+
+
+def _instruction_steps(value) -> list:
+    """Flatten recipeInstructions (text, HowToStep, HowToSection or lists of them) into steps."""
+    if isinstance(value, str):
+        return [line.strip() for line in re.split(r"\n+", html.unescape(value)) if line.strip()]
+    if isinstance(value, list):
+        return [step for item in value for step in _instruction_steps(item)]
+    if isinstance(value, dict):
+        if value.get("itemListElement"):
+            return _instruction_steps(value["itemListElement"])
+        text = _text(value.get("text") or value.get("name"))
+        return [text] if text else []
+    return []
+
+
+def is_complete(recipe: Optional[dict]) -> bool:
+    return bool(recipe and recipe.get("title") and recipe.get("ingredients") and recipe.get("instructions"))
+
+
+def build_recipe(title, ingredients, steps, total_time=None, servings=None, category="", author="") -> dict:
+    if isinstance(ingredients, str):
+        ingredients = ingredients.splitlines()  # Some sites give one string, not a list
+    ingredients = [i for i in (_text(item) for item in ingredients or []) if i]
+    return {
+        "title": _text(title),
+        "ingredients": ingredients,
+        "instructions": "\n\n".join(steps),
+        "cooking_time": total_time or 30,
+        "servings": servings or 4,
+        "category": category or "Main Course",
+        "difficulty": estimate_difficulty(total_time, len(ingredients)),
+        "story": None,
+        "source_author": _text(author),
+    }
+
+
+def _find_recipe_nodes(node):
+    if isinstance(node, list):
+        for item in node:
+            yield from _find_recipe_nodes(item)
+    elif isinstance(node, dict):
+        types = node.get("@type")
+        types = types if isinstance(types, list) else [types]
+        if any(isinstance(t, str) and t.lower().endswith("recipe") for t in types):
+            yield node
+        for key in ("@graph", "mainEntity", "itemListElement"):
+            if key in node:
+                yield from _find_recipe_nodes(node[key])
+
+
+def recipe_from_json_ld(page_html: str) -> Optional[dict]:
+    for block in JSON_LD_RE.findall(page_html):
+        block = block.strip().removeprefix("<![CDATA[").removesuffix("]]>").strip()
+        try:
+            data = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        for node in _find_recipe_nodes(data):
+            total = parse_duration_minutes(node.get("totalTime"))
+            if total is None:
+                parts = [parse_duration_minutes(node.get(k)) for k in ("prepTime", "cookTime")]
+                total = sum(p for p in parts if p) or None
+            return build_recipe(
+                node.get("name") or node.get("headline"),
+                node.get("recipeIngredient") or node.get("ingredients"),
+                _instruction_steps(node.get("recipeInstructions")),
+                total_time=total,
+                servings=parse_servings(node.get("recipeYield")),
+                category=normalize_category(node.get("recipeCategory"), node.get("name"), node.get("keywords")),
+                author=node.get("author"),
+            )
+    return None
+
+
+class _MicrodataRecipeParser(HTMLParser):
+    """Collect itemprop values inside the first element with itemtype schema.org/Recipe."""
+
+    PROPS = {
+        "name", "recipeIngredient", "ingredients", "recipeInstructions", "totalTime",
+        "prepTime", "cookTime", "recipeYield", "recipeCategory", "author",
+    }
+    VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.recipe_depth = None
+        self.finished = False
+        self.capture = None  # [prop, depth, text parts]
+        self.props = {}
+
+    def _record(self, prop: str, value: str):
+        value = re.sub(r"[ \t]+", " ", value).strip()
+        if value:
+            self.props.setdefault(prop, []).append(value)
+
+    def handle_starttag(self, tag, attrs):
+        if self.finished:
+            return
+        attrs = dict(attrs)
+        if tag == "br" and self.capture:
+            self.capture[2].append("\n")
+        if tag not in self.VOID:
+            self.depth += 1
+        if self.recipe_depth is None:
+            if "schema.org/recipe" in (attrs.get("itemtype") or "").lower():
+                self.recipe_depth = self.depth
+            return
+        prop = attrs.get("itemprop")
+        if prop not in self.PROPS or self.capture:
+            return
+        value = attrs.get("content") or attrs.get("datetime")
+        if value is not None or tag in self.VOID:
+            self._record(prop, value or "")
+        else:
+            self.capture = [prop, self.depth, []]
+
+    def handle_endtag(self, tag):
+        if self.finished or tag in self.VOID:
+            return
+        if self.capture and self.depth == self.capture[1]:
+            self._record(self.capture[0], "".join(self.capture[2]))
+            self.capture = None
+        if self.recipe_depth is not None and self.depth == self.recipe_depth:
+            self.finished = True
+        self.depth -= 1
+
+    def handle_data(self, data):
+        if self.capture:
+            self.capture[2].append(data)
+
+
+def recipe_from_microdata(page_html: str) -> Optional[dict]:
+    if "schema.org/recipe" not in page_html.lower():
+        return None
+    parser = _MicrodataRecipeParser()
+    try:
+        parser.feed(page_html)
+    except Exception:
+        return None
+    props = parser.props
+    if not props:
+        return None
+
+    def first(name):
+        return props.get(name, [None])[0]
+
+    total = parse_duration_minutes(first("totalTime"))
+    if total is None:
+        total = sum(p for p in (parse_duration_minutes(first(k)) for k in ("prepTime", "cookTime")) if p) or None
+    steps = [step for text in props.get("recipeInstructions", []) for step in _instruction_steps(text)]
+    return build_recipe(
+        first("name"),
+        props.get("recipeIngredient") or props.get("ingredients"),
+        steps,
+        total_time=total,
+        servings=parse_servings(first("recipeYield")),
+        category=normalize_category(first("recipeCategory"), first("name")),
+        author=first("author"),
+    )
+
+
+def extract_markup_recipe(page_html: str) -> Optional[dict]:
+    """The page's schema.org Recipe (JSON-LD first, then microdata), or None."""
+    recipe = recipe_from_json_ld(page_html)
+    if is_complete(recipe):
+        return recipe
+    return recipe_from_microdata(page_html) or recipe
+
+
+def recipe_from_caption(caption: str, title: str = "") -> Optional[dict]:
+    """
+    Parse a video caption that lists ingredients and steps under headings, e.g.
+    "Ingredients:\\n- 2 cups flour\\n...\\nMethod:\\n1. Mix ...". Returns None unless
+    both sections are present.
+    """
+    if not caption:
+        return None
+    lines = [line.strip() for line in html.unescape(caption).splitlines()]
+    section = None
+    before, ingredients, steps = [], [], []
+    for line in lines:
+        if not line:
+            continue
+        if CAPTION_INGREDIENTS_RE.match(line):
+            section = "ingredients"
+            continue
+        if CAPTION_INSTRUCTIONS_RE.match(line):
+            section = "steps"
+            continue
+        if line.startswith("#"):
+            section = "done"  # Hashtags close the recipe
+            continue
+        item = LIST_MARKER_RE.sub("", line).strip()
+        if section is None:
+            before.append(line)
+        elif section == "ingredients" and item:
+            ingredients.append(item)
+        elif section == "steps" and item:
+            steps.append(item)
+
+    if len(ingredients) < 2 or not steps:
+        return None
+    heading = before[0] if before else title
+    heading = re.sub(r"#\S+", "", heading or "").strip(" -–—:|")
+    if len(heading) > 100:
+        heading = re.split(r"(?<=[.!?])\s", heading, 1)[0][:100]
+    return build_recipe(heading or "Untitled Recipe", ingredients, steps, category=normalize_category(heading))
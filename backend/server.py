@@ -4,16 +4,20 @@ from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse, HTMLResponse
+from starlette.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 from starlette.middleware.base import BaseHTTPMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import PyMongoError
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartParser, MultiPartException
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, model_validator
 from typing import List, Optional
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
@@ -22,9 +26,30 @@ import bcrypt
 import json
 import httpx
 import base64
+import io
+import tempfile
+import asyncio
+import re
+import time
+import random
+import contextvars
+from collections import Counter, deque
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode, quote
+import ipaddress
+import codecs
+import zipfile
+import zlib
+import openai
 from openai import AsyncOpenAI
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
 from cryptography.hazmat.backends import default_backend
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from imaging import assess_scan_image, preprocess_scan_image, estimate_vision_tokens
+from pdfimport import read_text_layer, render_pages, segment_pages
+from recipe_markup import extract_markup_recipe, is_complete, recipe_from_caption, recipe_from_json_ld
+from audio import SAMPLE_RATE as AUDIO_SAMPLE_RATE, AudioDecodeError, AudioTooLong, decode_to_pcm, ffmpeg_available, segment_audio, segment_wav, stitch_transcripts
+from backup import ExportFormatError, detect_format, iter_export_entries, normalize_export_recipe, recipe_content_hash
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -46,7 +71,26 @@ async def lifespan(_app: FastAPI):
         logger.info("Database connection OK")
     except PyMongoError as e:
         logger.error("Database connection failed at startup: type=%s message=%s", type(e).__name__, e)
+    try:
+        await ensure_ai_cache_indexes()
+        await ensure_ai_job_indexes()
+        await ensure_pdf_import_indexes()
+        await ensure_ai_usage_indexes()
+        await ensure_export_job_indexes()
+        await ensure_recipe_import_indexes()
+        await ensure_recipe_indexes()
+        await ensure_sync_indexes()
+        await ensure_sync_mutation_indexes()
+    except PyMongoError as e:
+        logger.error("Index setup failed: type=%s message=%s", type(e).__name__, e)
+    start_ai_job_workers()
+    backfill_task = asyncio.create_task(backfill_sync_fields())
+    registry_task = asyncio.create_task(build_category_registry())
     yield
+    backfill_task.cancel()
+    registry_task.cancel()
+    await stop_ai_job_workers()
+    shutdown_image_pool()
     client.close()
 
 # Create the main app
@@ -65,12 +109,25 @@ logger = logging.getLogger(__name__)
 # Maximum request body size: 50MB (for large base64 image payloads)
 MAX_REQUEST_BODY_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Endpoints that stream uploads of these content types and enforce their own, larger cap while reading
+STREAMED_UPLOAD_PATHS = {
+    "/api/ai/scan-recipes/batch": ("multipart/form-data",),
+    "/api/imports/pdf": ("multipart/form-data", "application/pdf", "application/octet-stream"),
+    "/api/imports/recipes": (
+        "multipart/form-data", "application/x-ndjson", "application/zip", "application/gzip",
+        "application/json", "application/octet-stream",
+    ),
+}
+
 # Middleware to check request body size before processing
 class LargeBodyMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Check Content-Length header for size validation
         content_length = request.headers.get("content-length")
-        if content_length:
+        if content_length and not (
+            request.url.path in STREAMED_UPLOAD_PATHS
+            and request.headers.get("content-type", "").startswith(STREAMED_UPLOAD_PATHS[request.url.path])
+        ):
             try:
                 size = int(content_length)
                 if size > MAX_REQUEST_BODY_SIZE:
@@ -196,7 +253,39 @@ app.add_middleware(
 
 # ===================== OPENAI CLIENT =====================
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Retries are handled by call_ai_model, which knows each request's deadline
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0) if OPENAI_API_KEY else None
+
+# Upstream concurrency caps per model, shared by request handlers and AI job workers
+AI_MODEL_CONCURRENCY = {
+    "gpt-4o": int(os.environ.get("AI_CONCURRENCY_GPT_4O", "8")),
+    "gpt-4o-mini": int(os.environ.get("AI_CONCURRENCY_GPT_4O_MINI", "8")),
+    "whisper-1": int(os.environ.get("AI_CONCURRENCY_WHISPER", "4")),
+}
+AI_DEFAULT_MODEL_CONCURRENCY = 4
+_model_semaphores = {}
+
+# Model routing per AI task. Text-only restructuring starts on the smaller model and
+# escalates to escalate_to when its answer fails JSON or required-field validation.
+# Override with AI_MODEL_<TASK> / AI_ESCALATE_<TASK> (an empty escalation disables it).
+AI_MODEL_ROUTES = {
+    "scan": {"model": "gpt-4o", "escalate_to": "", "max_tokens": 2000},
+    "voice_structure": {"model": "gpt-4o-mini", "escalate_to": "gpt-4o", "max_tokens": 2000},
+    "link_structure": {"model": "gpt-4o-mini", "escalate_to": "gpt-4o", "max_tokens": 1500},
+    "pdf_text": {"model": "gpt-4o", "escalate_to": "", "max_tokens": 4000},
+}
+for _task, _route in AI_MODEL_ROUTES.items():
+    _route["model"] = os.environ.get(f"AI_MODEL_{_task.upper()}", _route["model"])
+    _route["escalate_to"] = os.environ.get(f"AI_ESCALATE_{_task.upper()}", _route["escalate_to"])
+
+
+def model_slot(model: str) -> asyncio.Semaphore:
+    """Return the semaphore bounding concurrent OpenAI calls to a model."""
+    sem = _model_semaphores.get(model)
+    if sem is None:
+        sem = asyncio.Semaphore(AI_MODEL_CONCURRENCY.get(model, AI_DEFAULT_MODEL_CONCURRENCY))
+        _model_semaphores[model] = sem
+    return sem
 
 # ===================== CREDIT SYSTEM =====================
 
@@ -252,6 +341,23 @@ async def refresh_credits_if_needed(user: dict) -> dict:
     return user
 
 
+def insufficient_credits_error(balance: int, cost: int, tier: Optional[str]) -> HTTPException:
+    """Build the 403 returned when a user cannot afford an AI feature."""
+    return HTTPException(
+        status_code=403,
+        detail={
+            "error": "insufficient_credits",
+            "credits_balance": balance,
+            "credits_needed": cost,
+            "message": (
+                f"This feature costs {cost} credit{'s' if cost > 1 else ''}. "
+                f"You have {balance} remaining. "
+                + ("Upgrade your plan for more credits each month." if not tier else "Credits refresh on your billing cycle.")
+            ),
+        }
+    )
+
+
 async def consume_credit(user: dict, feature: str) -> dict:
     """
     Deduct credits for using an AI feature.
@@ -261,31 +367,61 @@ async def consume_credit(user: dict, feature: str) -> dict:
     cost = CREDIT_COSTS.get(feature, 1)
     # Auto-refresh if needed before checking balance
     user = await refresh_credits_if_needed(user)
-    balance = user.get("credits_balance", 0)
 
-    if balance < cost:
-        tier = user.get("subscription_tier")
-        raise HTTPException(
-            status_code=403,
-            detail={
-                "error": "insufficient_credits",
-                "credits_balance": balance,
-                "credits_needed": cost,
-                "message": (
-                    f"This feature costs {cost} credit{'s' if cost > 1 else ''}. "
-                    f"You have {balance} remaining. "
-                    + ("Upgrade your plan for more credits each month." if not tier else "Credits refresh on your billing cycle.")
-                ),
-            }
-        )
+    # Checked and deducted in one update, so concurrent charges, reservations and
+    # refunds all land instead of overwriting each other's balance
+    updated = await db.users.find_one_and_update(
+        {"id": user["id"], "credits_balance": {"$gte": cost}},
+        {"$inc": {"credits_balance": -cost}},
+        projection={"_id": 0, "credits_balance": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not updated:
+        current = await db.users.find_one({"id": user["id"]}, {"_id": 0, "credits_balance": 1}) or {}
+        raise insufficient_credits_error(current.get("credits_balance", 0), cost, user.get("subscription_tier"))
 
-    new_balance = balance - cost
-    await db.users.update_one(
+    user["credits_balance"] = updated["credits_balance"]
+    logger.info("Credit consumed: user=%s feature=%s cost=%d remaining=%d",
+                user["id"], feature, cost, updated["credits_balance"])
+    return user
+
+
+async def reserve_credits(user: dict, feature: str, quantity: int) -> dict:
+    """
+    Deduct the credits for quantity uses of a feature in one atomic update.
+    Raises HTTPException if the balance does not cover all of them.
+    Returns updated user dict.
+    """
+    cost = CREDIT_COSTS.get(feature, 1) * quantity
+    user = await refresh_credits_if_needed(user)
+
+    updated = await db.users.find_one_and_update(
+        {"id": user["id"], "credits_balance": {"$gte": cost}},
+        {"$inc": {"credits_balance": -cost}},
+        projection={"_id": 0, "credits_balance": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not updated:
+        current = await db.users.find_one({"id": user["id"]}, {"_id": 0, "credits_balance": 1}) or {}
+        raise insufficient_credits_error(current.get("credits_balance", 0), cost, user.get("subscription_tier"))
+
+    user["credits_balance"] = updated["credits_balance"]
+    logger.info("Credits reserved: user=%s feature=%s quantity=%d cost=%d remaining=%d",
+                user["id"], feature, quantity, cost, updated["credits_balance"])
+    return user
+
+
+async def refund_credits(user: dict, amount: int, reason: str) -> dict:
+    """Give back credits for work that was paid for but not delivered. Returns updated user dict."""
+    updated = await db.users.find_one_and_update(
         {"id": user["id"]},
-        {"$set": {"credits_balance": new_balance}}
+        {"$inc": {"credits_balance": amount}},
+        projection={"_id": 0, "credits_balance": 1},
+        return_document=ReturnDocument.AFTER,
     )
-    user["credits_balance"] = new_balance
-    logger.info("Credit consumed: user=%s feature=%s cost=%d remaining=%d", user["id"], feature, cost, new_balance)
+    if updated:
+        user["credits_balance"] = updated["credits_balance"]
+    logger.info("Credits refunded: user=%s amount=%d reason=%s", user["id"], amount, reason)
     return user
 
 
@@ -376,6 +512,15 @@ class RecipeUpdate(BaseModel):
     category: Optional[str] = None
     difficulty: Optional[str] = None
 
+def new_photo_ids(count: int) -> List[str]:
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def legacy_photo_ids(recipe_id: str, count: int) -> List[str]:
+    """Positional IDs for photos saved before photos had IDs; LEGACY_PHOTO_IDS_UPDATE stores the same ones."""
+    return [f"{recipe_id}-p{index}" for index in range(count)]
+
+
 class RecipeResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
@@ -393,6 +538,13 @@ class RecipeResponse(BaseModel):
     author_name: str
     created_at: str
     holiday_tags: List[str] = []
+    photo_ids: List[str] = []  # photo_ids[i] identifies photos[i] for the photo endpoints
+
+    @model_validator(mode="after")
+    def _fill_photo_ids(self):
+        if len(self.photo_ids) != len(self.photos):
+            self.photo_ids = legacy_photo_ids(self.id, len(self.photos))
+        return self
 
 # Comment Models
 class CommentCreate(BaseModel):
@@ -534,6 +686,32 @@ async def create_notification_v1(
     if notifications:
         await db.notifications_v1.insert_many(notifications)
 
+# ===================== WRITE HELPERS =====================
+
+# Updates that answer with the changed document go through update_and_fetch: the
+# authorization rules are part of the filter and find_one_and_update returns the
+# document as written, so an update is one round trip instead of a read, a write and
+# a re-read. Only when nothing matched does write_miss read again, to tell a missing
+# document (404) from one the user may not change (403).
+
+def response_projection(model) -> dict:
+    """Projection of the fields a response model reads, leaving out clips and bookkeeping it would drop."""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+
+async def update_and_fetch(collection, query: dict, update, projection: dict) -> Optional[dict]:
+    """Apply update to the document matching query; returns it as updated, or None if nothing matched."""
+    return await collection.find_one_and_update(
+        query, update, projection=projection, return_document=ReturnDocument.AFTER
+    )
+
+
+async def write_miss(collection, doc_id: str, not_found: str, denied: str):
+    """Raise 404 or 403 after an update_and_fetch that matched nothing."""
+    if await collection.find_one({"id": doc_id}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    raise HTTPException(status_code=403, detail=denied)
+
 # ===================== AUTH ROUTES =====================
 
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -903,10 +1081,15 @@ async def update_profile(update_data: UserUpdate, user: dict = Depends(get_curre
     if update_data.avatar is not None:
         update_fields["avatar"] = update_data.avatar if update_data.avatar else None
     
+    updated_user = user
     if update_fields:
-        await db.users.update_one({"id": user["id"]}, {"$set": update_fields})
+        updated_user = await update_and_fetch(
+            db.users, {"id": user["id"]}, {"$set": update_fields}, response_projection(UserResponse)
+        )
+        if updated_user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        await bump_family_revisions(user.get("family_id"), "members_revision")
     
-    updated_user = await db.users.find_one({"id": user["id"]}, {"_id": 0})
     return UserResponse(
         id=updated_user["id"],
         name=updated_user["name"],
@@ -921,6 +1104,43 @@ async def update_profile(update_data: UserUpdate, user: dict = Depends(get_curre
         created_at=updated_user["created_at"]
     )
 
+# ---- Conditional reads ----
+
+# Read endpoints send strong ETags built from revision counters that writes maintain:
+# recipe.revision and recipe.comments_revision per recipe, and revision (the family
+# document), members_revision and recipes_revision on the family. Checking
+# If-None-Match takes one read of a counter, and a 304 skips loading and serializing
+# the documents. Bump ETAG_VERSION when a response's shape changes.
+ETAG_VERSION = 1
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha256(json.dumps([ETAG_VERSION, *parts], default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response when the client's If-None-Match covers etag, else None."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}  # Proxies weaken ETags when compressing
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+async def bump_family_revisions(family_id: Optional[str], *counters: str):
+    """Advance family-level revision counters after a write that changes what they cover."""
+    if family_id:
+        await db.families.update_one({"id": family_id}, {"$inc": {counter: 1 for counter in counters}})
+
+
 # ===================== RECIPE ROUTES =====================
 
 @api_router.post("/recipes", response_model=RecipeResponse)
@@ -938,15 +1158,20 @@ async def create_recipe(recipe_data: RecipeCreate, user: dict = Depends(get_curr
         "instructions": recipe_data.instructions,
         "story": recipe_data.story,
         "photos": recipe_data.photos,
+        "photo_ids": new_photo_ids(len(recipe_data.photos)),
         "cooking_time": recipe_data.cooking_time,
         "servings": recipe_data.servings,
         "category": recipe_data.category,
         "difficulty": recipe_data.difficulty,
         "author_id": user["id"],
         "author_name": display_name,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc),
+        "revision": 1,
     }
     await db.recipes.insert_one(recipe_doc)
+    await bump_family_revisions(user_family_id, "recipes_revision")
+    await count_categories([(user_family_id, recipe_data.category, 1)])
     
     # Create notifications only if user has a family
     if user_family_id:
@@ -989,6 +1214,8 @@ async def create_recipe(recipe_data: RecipeCreate, user: dict = Depends(get_curr
 
 @api_router.get("/recipes", response_model=List[RecipeResponse])
 async def get_recipes(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     author_id: Optional[str] = None,
     user: dict = Depends(get_current_user)
@@ -996,6 +1223,16 @@ async def get_recipes(
     # Backward compatible: Handle both family-scoped and legacy recipes
     user_family_id = user.get("family_id")
     
+    etag = None
+    if user_family_id:
+        family = await db.families.find_one({"id": user_family_id}, {"_id": 0, "recipes_revision": 1})
+        if family is not None:
+            etag = make_etag("recipes", user_family_id, family.get("recipes_revision", 0), category, author_id)
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
+            set_etag(response, etag)
+    
     if user_family_id:
         # User has a family: show family-scoped recipes only
         query = {"family_id": user_family_id}
@@ -1013,8 +1250,8 @@ async def get_recipes(
     return [RecipeResponse(**r) for r in recipes]
 
 @api_router.get("/recipes/{recipe_id}", response_model=RecipeResponse)
-async def get_recipe(recipe_id: str, user: dict = Depends(get_current_user)):
-    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0})
+async def get_recipe(recipe_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
+    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0, "family_id": 1, "revision": 1})
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
     
@@ -1031,41 +1268,100 @@ async def get_recipe(recipe_id: str, user: dict = Depends(get_current_user)):
         # Family-scoped recipe: user must be in the same family
         raise HTTPException(status_code=403, detail="Not authorized to view this recipe")
     
-    return RecipeResponse(**recipe)
-
-@api_router.put("/recipes/{recipe_id}", response_model=RecipeResponse)
-async def update_recipe(recipe_id: str, recipe_data: RecipeUpdate, user: dict = Depends(get_current_user)):
+    etag = make_etag("recipe", recipe_id, recipe.get("revision", 0))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
     recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0})
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
-    
-    # Check authorization: only author can update
+    set_etag(response, etag)
+    return RecipeResponse(**recipe)
+
+def recipe_revision_update(fields: dict, expressions: Optional[dict] = None) -> list:
+    """
+    Update pipeline that sets fields, bumps the recipe's revision and records that
+    revision in field_revisions for each field, in one atomic write without a read.
+    expressions are aggregation expressions over the stored recipe, for edits such as
+    inserting one photo without sending the others. Replacing photos whole gives every
+    photo a new ID.
+    """
+    values = {field: {"$literal": value} for field, value in fields.items()}  # Text may start with "$"
+    if "photos" in fields:
+        values["photo_ids"] = {"$literal": new_photo_ids(len(fields["photos"]))}
+    values.update(expressions or {})
+    return [
+        {"$set": {
+            **values,
+            "updated_at": {"$literal": datetime.now(timezone.utc)},
+            "revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]},
+        }},
+        {"$set": {f"field_revisions.{field}": "$revision" for field in values if field != "photo_ids"}},
+    ]
+
+
+def recipe_update_denied(recipe: dict, user: dict) -> Optional[str]:
+    """Why user may not edit recipe, or None if they may."""
+    # Only the author can update
     if recipe["author_id"] != user["id"]:
-        raise HTTPException(status_code=403, detail="Not authorized to update this recipe")
-    
+        return "Not authorized to update this recipe"
     # Backward compatible: Check family access for family-scoped recipes
-    recipe_family_id = recipe.get("family_id")
-    user_family_id = user.get("family_id")
-    
-    if recipe_family_id is not None and recipe_family_id != user_family_id:
-        raise HTTPException(status_code=403, detail="Not authorized to update this recipe")
-    
-    # Check if photos are being added (for v1 notification)
-    photos_added = False
-    old_photos = recipe.get("photos", [])
-    if recipe_data.photos is not None:
-        new_photos = recipe_data.photos
-        # Check if new photos list is longer than old photos list
-        if len(new_photos) > len(old_photos):
-            photos_added = True
-    
+    if recipe.get("family_id") is not None and recipe["family_id"] != user.get("family_id"):
+        return "Not authorized to update this recipe"
+    return None
+
+
+def recipe_update_filter(recipe_id: str, user: dict) -> dict:
+    """recipe_update_denied as a query, for writes that check access as they apply."""
+    return {"id": recipe_id, "author_id": user["id"], "family_id": {"$in": [None, user.get("family_id")]}}
+
+
+def recipe_delete_denied(recipe: dict, user: dict) -> Optional[str]:
+    """Why user may not delete recipe, or None if they may."""
+    # Backward compatible access control:
+    # 1. Legacy recipes (family_id is None): only author can delete
+    # 2. Family-scoped recipes: author can always delete, keeper can delete any
+    if recipe.get("family_id") is None:
+        if recipe["author_id"] != user["id"]:
+            return "Not authorized to delete this recipe"
+        return None
+    if recipe["family_id"] != user.get("family_id"):
+        return "Not authorized"
+    # Role-based deletion: Keeper can delete any, Member can only delete own
+    if recipe["author_id"] != user["id"] and user.get("role") != "keeper":
+        return "Only keepers can delete others' recipes"
+    return None
+
+@api_router.put("/recipes/{recipe_id}", response_model=RecipeResponse)
+async def update_recipe(recipe_id: str, recipe_data: RecipeUpdate, user: dict = Depends(get_current_user)):
+    # The write returns the recipe as it was, which gives the previous category (for the
+    # category registry) and photo count (for the v1 notification) without a separate
+    # read; the response is that document with the update applied
+    query = recipe_update_filter(recipe_id, user)
+    projection = response_projection(RecipeResponse)
     update_data = {k: v for k, v in recipe_data.model_dump().items() if v is not None}
     if update_data:
-        await db.recipes.update_one({"id": recipe_id}, {"$set": update_data})
-    
-    updated = await db.recipes.find_one({"id": recipe_id}, {"_id": 0})
+        photo_ids = {"photo_ids": new_photo_ids(len(update_data["photos"]))} if "photos" in update_data else {}
+        before = await db.recipes.find_one_and_update(
+            query,
+            recipe_revision_update(update_data, {field: {"$literal": ids} for field, ids in photo_ids.items()}),
+            projection=projection,
+            return_document=ReturnDocument.BEFORE,
+        )
+        updated = {**before, **update_data, **photo_ids} if before else None
+    else:
+        before = updated = await db.recipes.find_one(query, projection)
+    if updated is None:
+        await write_miss(db.recipes, recipe_id, "Recipe not found", "Not authorized to update this recipe")
+    recipe_family_id = updated.get("family_id")
+    if update_data:
+        await bump_family_revisions(recipe_family_id, "recipes_revision")
+    if recipe_data.category is not None and before.get("category") != recipe_data.category:
+        await count_categories([(recipe_family_id, before.get("category"), -1), (recipe_family_id, recipe_data.category, 1)])
     
     # Create v1 notification for photo_added event (silent)
+    photos_added = recipe_data.photos is not None and len(recipe_data.photos) > len(before.get("photos") or [])
     if photos_added and recipe_family_id:
         display_name = user.get("nickname") or user["name"]
         await create_notification_v1(
@@ -1073,7 +1369,7 @@ async def update_recipe(recipe_id: str, recipe_data: RecipeUpdate, user: dict =
             notification_type="photo_added",
             payload={
                 "recipe_id": recipe_id,
-                "recipe_title": recipe.get("title", ""),
+                "recipe_title": updated.get("title", ""),
                 "author_name": display_name,
                 "photo_count": len(updated.get("photos", []))
             },
@@ -1088,34 +1384,525 @@ async def delete_recipe(recipe_id: str, user: dict = Depends(get_current_user)):
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
     
-    recipe_family_id = recipe.get("family_id")
-    user_family_id = user.get("family_id")
-    
-    # Backward compatible access control:
-    # 1. Legacy recipes (family_id is None): only author can delete
-    # 2. Family-scoped recipes: author can always delete, keeper can delete any
-    if recipe_family_id is None:
-        # Legacy recipe: only author can delete
-        if recipe["author_id"] != user["id"]:
-            raise HTTPException(status_code=403, detail="Not authorized to delete this recipe")
-    else:
-        # Family-scoped recipe: check family membership
-        if recipe_family_id != user_family_id:
-            raise HTTPException(status_code=403, detail="Not authorized")
-        
-        # Role-based deletion: Keeper can delete any, Member can only delete own
-        if recipe["author_id"] != user["id"] and user.get("role") != "keeper":
-            raise HTTPException(status_code=403, detail="Only keepers can delete others' recipes")
+    denied = recipe_delete_denied(recipe, user)
+    if denied:
+        raise HTTPException(status_code=403, detail=denied)
     
     await db.recipes.delete_one({"id": recipe_id})
+    await record_tombstones("recipe", [recipe_id], recipe.get("family_id"))
+    await bump_family_revisions(recipe.get("family_id"), "recipes_revision")
+    await count_categories([(recipe.get("family_id"), recipe.get("category"), -1)])
     return {"message": "Recipe deleted successfully"}
 
+# ---- Photos ----
+
+# Photos are added, removed and reordered one at a time by ID, so adding a picture to
+# a recipe uploads that picture only. photo_ids runs parallel to photos and both are
+# rewritten inside the same pipeline update, which also bumps the recipe revision and
+# field_revisions.photos for offline sync. Recipes saved before photos had IDs get
+# positional ones stored on their first photo edit (the IDs RecipeResponse reports).
+PHOTO_COUNT = {"$size": {"$ifNull": ["$photos", []]}}
+LEGACY_PHOTO_IDS_FILTER = {"$expr": {"$ne": [{"$size": {"$ifNull": ["$photo_ids", []]}}, PHOTO_COUNT]}}
+LEGACY_PHOTO_IDS_UPDATE = [{"$set": {"photo_ids": {
+    "$map": {"input": {"$range": [0, PHOTO_COUNT]}, "in": {"$concat": ["$id", "-p", {"$toString": "$$this"}]}}
+}}}]
+PHOTO_RESULT_PROJECTION = {"_id": 0, "id": 1, "photo_ids": 1, "revision": 1}
+
+
+class RecipePhotoAdd(BaseModel):
+    photo: str  # Base64 encoded image
+    position: Optional[int] = Field(default=None, ge=0)  # Index to insert at; appended when omitted
+
+
+class RecipePhotoOrder(BaseModel):
+    photo_ids: List[str]  # Every photo of the recipe, in the new order
+
+
+async def photo_edit_recipe(recipe_id: str, user: dict) -> dict:
+    """The recipe's access fields and photo IDs, without the photos, after checking the user may edit it."""
+    recipe = await db.recipes.find_one(
+        {"id": recipe_id},
+        {"_id": 0, "id": 1, "author_id": 1, "family_id": 1, "title": 1, "photo_ids": 1, "photo_count": PHOTO_COUNT},
+    )
+    if not recipe:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    denied = recipe_update_denied(recipe, user)
+    if denied:
+        raise HTTPException(status_code=403, detail=denied)
+    if len(recipe.get("photo_ids") or []) != recipe["photo_count"]:
+        await db.recipes.update_one({"id": recipe_id, **LEGACY_PHOTO_IDS_FILTER}, LEGACY_PHOTO_IDS_UPDATE)
+        recipe["photo_ids"] = legacy_photo_ids(recipe_id, recipe["photo_count"])
+    return recipe
+
+
+def photo_result(recipe: dict, **extra) -> dict:
+    return {"recipe_id": recipe["id"], "photo_ids": recipe.get("photo_ids") or [], "revision": recipe.get("revision"), **extra}
+
+
+@api_router.post("/recipes/{recipe_id}/photos", status_code=201)
+async def add_recipe_photo(recipe_id: str, body: RecipePhotoAdd, user: dict = Depends(get_current_user)):
+    """Insert one photo. Returns its ID and the recipe's photo IDs in order, not the photos."""
+    recipe = await photo_edit_recipe(recipe_id, user)
+    photo_id = str(uuid.uuid4())
+    position = body.position
+
+    def inserted(field: str, value: str) -> dict:
+        current = {"$ifNull": [f"${field}", []]}
+        if position is None:
+            return {"$concatArrays": [current, [{"$literal": value}]]}
+        return {"$concatArrays": [
+            {"$slice": [current, position]} if position else [],
+            [{"$literal": value}],
+            {"$slice": [current, position, {"$add": [{"$size": current}, 1]}]},
+        ]}
+
+    updated = await db.recipes.find_one_and_update(
+        {"id": recipe_id},
+        recipe_revision_update({}, {"photos": inserted("photos", body.photo), "photo_ids": inserted("photo_ids", photo_id)}),
+        projection=PHOTO_RESULT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    await bump_family_revisions(recipe.get("family_id"), "recipes_revision")
+
+    if recipe.get("family_id"):
+        await create_notification_v1(
+            family_id=recipe["family_id"],
+            notification_type="photo_added",
+            payload={
+                "recipe_id": recipe_id,
+                "recipe_title": recipe.get("title", ""),
+                "author_name": user.get("nickname") or user["name"],
+                "photo_count": len(updated.get("photo_ids") or []),
+            },
+            exclude_user_id=user["id"]
+        )
+    return photo_result(updated, photo_id=photo_id)
+
+
+@api_router.delete("/recipes/{recipe_id}/photos/{photo_id}")
+async def remove_recipe_photo(recipe_id: str, photo_id: str, user: dict = Depends(get_current_user)):
+    recipe = await photo_edit_recipe(recipe_id, user)
+    if photo_id not in recipe["photo_ids"]:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    # Indexes of the photos to keep, found by the photo's position in photo_ids at write time
+    kept = {"$filter": {
+        "input": {"$range": [0, PHOTO_COUNT]},
+        "cond": {"$ne": ["$$this", {"$indexOfArray": ["$photo_ids", photo_id]}]},
+    }}
+    updated = await db.recipes.find_one_and_update(
+        {"id": recipe_id, "photo_ids": photo_id},
+        recipe_revision_update({}, {
+            "photos": {"$map": {"input": kept, "in": {"$arrayElemAt": ["$photos", "$$this"]}}},
+            "photo_ids": {"$filter": {"input": "$photo_ids", "cond": {"$ne": ["$$this", photo_id]}}},
+        }),
+        projection=PHOTO_RESULT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Photo not found")
+    await bump_family_revisions(recipe.get("family_id"), "recipes_revision")
+    return photo_result(updated)
+
+
+@api_router.put("/recipes/{recipe_id}/photos/order")
+async def reorder_recipe_photos(recipe_id: str, body: RecipePhotoOrder, user: dict = Depends(get_current_user)):
+    order = body.photo_ids
+    if len(set(order)) != len(order):
+        raise HTTPException(status_code=400, detail="photo_ids lists a photo more than once")
+    recipe = await photo_edit_recipe(recipe_id, user)
+    if set(order) != set(recipe["photo_ids"]):
+        raise HTTPException(status_code=409, detail="photo_ids must list every photo of the recipe exactly once")
+    if order == recipe["photo_ids"]:
+        return photo_result(recipe)
+
+    # The filter makes the write a no-op if photos were added or removed since the read
+    updated = await db.recipes.find_one_and_update(
+        {"id": recipe_id, "photo_ids": {"$all": order, "$size": len(order)}},
+        recipe_revision_update({}, {
+            "photos": {"$map": {
+                "input": {"$literal": order},
+                "in": {"$arrayElemAt": ["$photos", {"$indexOfArray": ["$photo_ids", "$$this"]}]},
+            }},
+            "photo_ids": {"$literal": order},
+        }),
+        projection=PHOTO_RESULT_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise HTTPException(status_code=409, detail="The recipe's photos changed; reload and try again")
+    await bump_family_revisions(recipe.get("family_id"), "recipes_revision")
+    return photo_result(updated)
+
+# ---- Batch mutations ----
+
+# Offline clients queue edits and flush them in one request. Creates, updates and
+# deletes are authorized against one read of the affected recipes and applied with
+# one ordered bulk_write, so edits to the same recipe land in queue order. Family
+# members get one notification per kind of change instead of one per recipe.
+RECIPE_BATCH_MAX_OPERATIONS = 100
+
+
+class RecipeBatchOperation(BaseModel):
+    op: str  # "create" | "update" | "delete"
+    # Required for update and delete. On create, a client-generated UUID lets later
+    # operations refer to the new recipe and makes a replayed create harmless.
+    id: Optional[str] = None
+    data: Optional[dict] = None  # RecipeCreate fields for create, RecipeUpdate fields for update
+
+
+class RecipeBatchRequest(BaseModel):
+    operations: List[RecipeBatchOperation]
+
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc']) or 'data'}: {e['msg']}" for e in error.errors())
+
+
+async def notify_recipe_batch(user: dict, created: list, photo_updates: list):
+    """One new-recipe and one photo notification per batch, however many recipes it touched."""
+    family_id = user.get("family_id")
+    if not family_id:
+        return
+    display_name = user.get("nickname") or user["name"]
+    created = [doc for doc in created if doc.get("family_id")]
+    photo_updates = [recipe for recipe in photo_updates if recipe.get("family_id")]
+
+    if created:
+        first = created[0]
+        members = await db.users.find(
+            {"family_id": family_id, "id": {"$ne": user["id"]}}, {"_id": 0, "id": 1}
+        ).to_list(100)
+        message = (
+            f"{display_name} shared a new recipe: {first['title']}" if len(created) == 1
+            else f"{display_name} shared {len(created)} new recipes"
+        )
+        now = datetime.now(timezone.utc).isoformat()
+        if members:
+            await db.notifications.insert_many([{
+                "id": str(uuid.uuid4()),
+                "user_id": member["id"],
+                "type": "new_recipe",
+                "message": message,
+                "recipe_id": first["id"] if len(created) == 1 else None,
+                "from_user_name": display_name,
+                "is_read": False,
+                "created_at": now,
+            } for member in members])
+        if len(created) == 1:
+            notification_type = "recipe_added"
+            payload = {"recipe_id": first["id"], "author_name": display_name, "recipe_title": first["title"]}
+        else:
+            notification_type = "recipes_added"
+            payload = {"author_name": display_name, "recipe_count": len(created),
+                       "recipe_ids": [doc["id"] for doc in created[:20]]}
+        await create_notification_v1(family_id, notification_type, payload, exclude_user_id=user["id"])
+
+    if photo_updates:
+        first = photo_updates[0]
+        if len(photo_updates) == 1:
+            notification_type = "photo_added"
+            payload = {"recipe_id": first["id"], "recipe_title": first.get("title", ""),
+                       "author_name": display_name, "photo_count": len(first.get("photos") or [])}
+        else:
+            notification_type = "photos_added"
+            payload = {"author_name": display_name, "recipe_count": len(photo_updates),
+                       "recipe_ids": [recipe["id"] for recipe in photo_updates[:20]]}
+        await create_notification_v1(family_id, notification_type, payload, exclude_user_id=user["id"])
+
+
+@api_router.post("/recipes/batch")
+async def batch_recipes(body: RecipeBatchRequest, user: dict = Depends(get_current_user)):
+    """
+    Apply up to RECIPE_BATCH_MAX_OPERATIONS recipe creates, updates and deletes, in order.
+    Every operation gets a result ({"index", "op", "id", "status", "error" or "recipe"});
+    one that fails validation or authorization does not stop the others.
+    """
+    operations = body.operations
+    if not operations:
+        raise HTTPException(status_code=400, detail="No operations provided")
+    if len(operations) > RECIPE_BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {RECIPE_BATCH_MAX_OPERATIONS} operations")
+
+    # Photos are only read when an update in the batch replaces them
+    projection = {"_id": 0, "id": 1, "author_id": 1, "family_id": 1, "title": 1, "category": 1}
+    if any(op.op == "update" and (op.data or {}).get("photos") is not None for op in operations):
+        projection["photos"] = 1
+    ids = list({op.id for op in operations if op.id})
+    recipes = {r["id"]: r async for r in db.recipes.find({"id": {"$in": ids}}, projection)} if ids else {}
+
+    display_name = user.get("nickname") or user["name"]
+    results = []
+    writes, write_owner = [], []  # bulk_write requests and the operation index behind each
+    created, photo_updates, deleted = {}, {}, {}  # operation index -> recipe
+    category_changes = {}  # operation index -> [(family_id, category, delta)]
+
+    for index, op in enumerate(operations):
+        result = {"index": index, "op": op.op, "id": op.id}
+        results.append(result)
+
+        if op.op == "create":
+            try:
+                data = RecipeCreate(**(op.data or {}))
+            except ValidationError as e:
+                result.update(status=422, error=validation_message(e))
+                continue
+            if op.id:
+                try:
+                    uuid.UUID(op.id)
+                except ValueError:
+                    result.update(status=422, error="id must be a UUID")
+                    continue
+                if op.id in recipes:
+                    if recipes[op.id]["author_id"] == user["id"]:
+                        result.update(status=200, created=False)  # A replayed create
+                    else:
+                        result.update(status=409, error="A recipe with this ID already exists")
+                    continue
+            recipe_doc = {
+                "id": op.id or str(uuid.uuid4()),
+                "family_id": user.get("family_id"),
+                "title": data.title,
+                "ingredients": data.ingredients,
+                "instructions": data.instructions,
+                "story": data.story,
+                "photos": data.photos,
+                "photo_ids": new_photo_ids(len(data.photos)),
+                "cooking_time": data.cooking_time,
+                "servings": data.servings,
+                "category": data.category,
+                "difficulty": data.difficulty,
+                "author_id": user["id"],
+                "author_name": display_name,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc),
+                "revision": 1,
+            }
+            writes.append(InsertOne(dict(recipe_doc)))
+            write_owner.append(index)
+            recipes[recipe_doc["id"]] = recipe_doc  # Later operations may edit or delete it
+            created[index] = recipe_doc
+            category_changes[index] = [(recipe_doc["family_id"], recipe_doc["category"], 1)]
+            result.update(id=recipe_doc["id"], status=201, created=True)
+
+        elif op.op in ("update", "delete"):
+            recipe = recipes.get(op.id) if op.id else None
+            if recipe is None:
+                result.update(status=404, error="Recipe not found")
+                continue
+            denied = recipe_update_denied(recipe, user) if op.op == "update" else recipe_delete_denied(recipe, user)
+            if denied:
+                result.update(status=403, error=denied)
+                continue
+
+            if op.op == "delete":
+                writes.append(DeleteOne({"id": op.id}))
+                write_owner.append(index)
+                deleted[index] = recipe
+                category_changes[index] = [(recipe.get("family_id"), recipe.get("category"), -1)]
+                del recipes[op.id]
+                for changes in (created, photo_updates):
+                    for owner in [i for i, r in changes.items() if r["id"] == op.id]:
+                        del changes[owner]
+                result["status"] = 200
+                continue
+
+            try:
+                data = RecipeUpdate(**(op.data or {}))
+            except ValidationError as e:
+                result.update(status=422, error=validation_message(e))
+                continue
+            update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+            if data.photos is not None and len(data.photos) > len(recipe.get("photos") or []):
+                photo_updates[index] = recipe
+            if data.category is not None and data.category != recipe.get("category"):
+                category_changes[index] = [(recipe.get("family_id"), recipe.get("category"), -1),
+                                           (recipe.get("family_id"), data.category, 1)]
+            recipe.update(update_data)
+            if update_data:
+                writes.append(UpdateOne({"id": op.id}, recipe_revision_update(update_data)))
+                write_owner.append(index)
+            result["status"] = 200
+
+        else:
+            result.update(status=422, error="op must be create, update or delete")
+
+    if writes:
+        try:
+            await db.recipes.bulk_write(writes, ordered=True)
+        except BulkWriteError as e:
+            # Ordered: everything before the failed write was applied, nothing after it
+            error = e.details["writeErrors"][0]
+            failed_op = operations[write_owner[error["index"]]]
+            logger.warning("Recipe batch write failed at operation=%d user=%s: %s",
+                           write_owner[error["index"]], user["id"], error.get("errmsg"))
+            first = {"status": 500, "error": "This change could not be saved"}
+            if error.get("code") == 11000 and failed_op.op == "create":
+                # The unique index caught a create racing a replay of the same batch
+                existing = await db.recipes.find_one({"id": failed_op.id}, {"_id": 0, "author_id": 1}) or {}
+                first = ({"status": 200, "created": False} if existing.get("author_id") == user["id"]
+                         else {"status": 409, "error": "A recipe with this ID already exists"})
+            for position, index in enumerate(write_owner[error["index"]:]):
+                results[index].pop("created", None)
+                results[index].update(first if position == 0 else {
+                    "status": 424, "error": "Not applied because an earlier operation in the batch failed",
+                })
+                created.pop(index, None)
+                photo_updates.pop(index, None)
+                deleted.pop(index, None)
+                category_changes.pop(index, None)
+
+    saved_ids = {r["id"] for r in results if r["op"] in ("create", "update") and r.get("status") in (200, 201)}
+    if saved_ids:
+        saved = {r["id"]: r async for r in db.recipes.find({"id": {"$in": list(saved_ids)}}, {"_id": 0})}
+        for result in results:
+            if result["id"] in saved and result.get("status") in (200, 201) and result["op"] != "delete":
+                result["recipe"] = RecipeResponse(**saved[result["id"]]).model_dump()
+
+    for family_id in {recipe.get("family_id") for recipe in deleted.values()}:
+        await record_tombstones(
+            "recipe", [r["id"] for r in deleted.values() if r.get("family_id") == family_id], family_id
+        )
+    if writes:
+        await bump_family_revisions(user.get("family_id"), "recipes_revision")
+    await count_categories([change for changes in category_changes.values() for change in changes])
+    await notify_recipe_batch(user, list(created.values()), list(photo_updates.values()))
+    logger.info("Recipe batch applied user=%s operations=%d writes=%d", user["id"], len(operations), len(writes))
+    return {"results": results}
+
+# ---- Category registry ----
+
+# The categories in use are kept as recipe counts in recipe_categories: one document
+# per family ("family:<id>") and one across all recipes ("global", which /categories
+# serves). Recipe writes adjust the counts with $inc, so listing categories reads one
+# small document instead of running distinct over every recipe. Names are stored under
+# a hash because they may contain "." or "$". Reads are cached in-process; a worker's
+# own writes drop its cached copy and other workers catch up within
+# CATEGORY_CACHE_SECONDS.
+DEFAULT_CATEGORIES = ["Main Course", "Appetizer", "Dessert", "Soup", "Salad", "Breakfast", "Snack", "Beverage"]
+CATEGORY_CACHE_SECONDS = 60
+CATEGORY_REGISTRY_LEASE_SECONDS = 300
+_category_cache = {}  # scope -> (time.monotonic() when read, sorted categories)
+
+
+def category_key(category: str) -> str:
+    return hashlib.sha1(category.encode("utf-8")).hexdigest()[:16]
+
+
+async def count_categories(changes: list):
+    """Apply [(family_id, category, delta)] recipe changes to the registry."""
+    totals = Counter()
+    for family_id, category, delta in changes:
+        if isinstance(category, str):
+            totals[("global", category)] += delta
+            if family_id:
+                totals[(f"family:{family_id}", category)] += delta
+    updates = {}
+    for (scope, category), delta in totals.items():
+        if delta:
+            update = updates.setdefault(scope, {"$inc": {}, "$set": {}})
+            update["$inc"][f"counts.{category_key(category)}"] = delta
+            update["$set"][f"names.{category_key(category)}"] = category
+    if not updates:
+        return
+    try:
+        await db.recipe_categories.bulk_write(
+            [UpdateOne({"_id": scope}, update, upsert=True) for scope, update in updates.items()], ordered=False
+        )
+    except PyMongoError as e:  # The recipe write already happened; the list catches up on the next change
+        logger.error("Category registry update failed: type=%s message=%s", type(e).__name__, e)
+    for scope in updates:
+        _category_cache.pop(scope, None)
+
+
+async def _count_all_categories():
+    """Recount the registry from the recipes, replacing each scope's counts."""
+    pipeline = [{"$group": {"_id": {"family_id": "$family_id", "category": "$category"}, "count": {"$sum": 1}}}]
+    scopes = {"global": {"counts": {}, "names": {}}}
+    async for row in db.recipes.aggregate(pipeline):
+        category, family_id = row["_id"].get("category"), row["_id"].get("family_id")
+        if not isinstance(category, str):
+            continue
+        key = category_key(category)
+        for scope in ["global"] + ([f"family:{family_id}"] if family_id else []):
+            doc = scopes.setdefault(scope, {"counts": {}, "names": {}})
+            doc["counts"][key] = doc["counts"].get(key, 0) + row["count"]
+            doc["names"][key] = category
+    for start in range(0, len(scopes), 500):
+        await db.recipe_categories.bulk_write(
+            [ReplaceOne({"_id": scope}, doc, upsert=True) for scope, doc in list(scopes.items())[start:start + 500]],
+            ordered=False,
+        )
+    _category_cache.clear()
+    return len(scopes)
+
+
+async def build_category_registry():
+    """
+    Count every recipe into the registry until a build has finished once. A worker
+    builds under a lease on the "build" document and marks it built only after the
+    counts are written, so a build that fails or dies with its worker is retried
+    once the lease runs out. Counts are replaced, not added, so a repeated build or
+    a recipe written during one is not counted twice.
+    """
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            try:
+                await db.recipe_categories.update_one(
+                    {"_id": "build", "built": {"$ne": True},
+                     "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+                    {"$set": {"lease_until": now + timedelta(seconds=CATEGORY_REGISTRY_LEASE_SECONDS)}},
+                    upsert=True,
+                )
+                claimed = True
+            except DuplicateKeyError:
+                claimed = False  # Already built, or another worker holds the lease
+            if claimed:
+                scopes = await _count_all_categories()
+                await db.recipe_categories.update_one(
+                    {"_id": "build"}, {"$set": {"built": True, "built_at": datetime.now(timezone.utc)}, "$unset": {"lease_until": ""}}
+                )
+                logger.info("Category registry built for %d scopes", scopes)
+                return
+            state = await db.recipe_categories.find_one({"_id": "build"}, {"built": 1})
+            if state and state.get("built"):
+                return
+        except PyMongoError as e:
+            logger.error("Category registry build failed: type=%s message=%s", type(e).__name__, e)
+        await asyncio.sleep(CATEGORY_REGISTRY_LEASE_SECONDS)
+
+
+async def registry_categories(scope: str) -> List[str]:
+    cached = _category_cache.get(scope)
+    if cached and time.monotonic() - cached[0] < CATEGORY_CACHE_SECONDS:
+        return cached[1]
+    docs = {doc["_id"]: doc async for doc in db.recipe_categories.find({"_id": {"$in": [scope, "build"]}})}
+    if (docs.get("build") or {}).get("built"):
+        doc = docs.get(scope) or {}
+        names = doc.get("names") or {}
+        in_use = [names[key] for key, count in (doc.get("counts") or {}).items() if count > 0 and key in names]
+    else:  # The counts are incomplete until the first build finishes
+        query = {"family_id": scope.split(":", 1)[1]} if scope.startswith("family:") else {}
+        in_use = [c for c in await db.recipes.distinct("category", query) if isinstance(c, str)]
+    categories = sorted(set(DEFAULT_CATEGORIES + in_use))
+    _category_cache[scope] = (time.monotonic(), categories)
+    return categories
+
+
 @api_router.get("/categories", response_model=List[str])
 async def get_categories():
-    categories = await db.recipes.distinct("category")
-    default_categories = ["Main Course", "Appetizer", "Dessert", "Soup", "Salad", "Breakfast", "Snack", "Beverage"]
-    all_cats = list(set(default_categories + categories))
-    return sorted(all_cats)
+    return await registry_categories("global")
+
+
+@api_router.get("/families/{family_id}/categories", response_model=List[str])
+async def get_family_categories(family_id: str, user: dict = Depends(get_current_user)):
+    """The default categories plus those the family's recipes use."""
+    if user.get("family_id") != family_id:
+        raise HTTPException(status_code=403, detail="Not a member of this family")
+    return await registry_categories(f"family:{family_id}")
 
 # ===================== COMMENT ROUTES =====================
 
@@ -1134,9 +1921,12 @@ async def create_comment(recipe_id: str, comment_data: CommentCreate, user: dict
         "user_id": user["id"],
         "user_name": display_name,
         "text": comment_data.text,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "family_id": recipe.get("family_id"),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc),
     }
     await db.comments.insert_one(comment_doc)
+    await db.recipes.update_one({"id": recipe_id}, {"$inc": {"comments_revision": 1}})
     
     # Create notification for recipe author if they're in a family and it's not their own comment
     if recipe["author_id"] != user["id"]:
@@ -1176,7 +1966,14 @@ async def create_comment(recipe_id: str, comment_data: CommentCreate, user: dict
     return CommentResponse(**{k: v for k, v in comment_doc.items() if k != "_id"})
 
 @api_router.get("/recipes/{recipe_id}/comments", response_model=List[CommentResponse])
-async def get_comments(recipe_id: str):
+async def get_comments(recipe_id: str, request: Request, response: Response):
+    recipe = await db.recipes.find_one({"id": recipe_id}, {"_id": 0, "comments_revision": 1})
+    if recipe is not None:
+        etag = make_etag("comments", recipe_id, recipe.get("comments_revision", 0))
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        set_etag(response, etag)
     comments = await db.comments.find({"recipe_id": recipe_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
     return [CommentResponse(**c) for c in comments]
 
@@ -1189,42 +1986,434 @@ async def delete_comment(comment_id: str, user: dict = Depends(get_current_user)
         raise HTTPException(status_code=403, detail="Not authorized to delete this comment")
     
     await db.comments.delete_one({"id": comment_id})
+    await db.recipes.update_one({"id": comment["recipe_id"]}, {"$inc": {"comments_revision": 1}})
+    if "family_id" in comment:
+        family_id = comment["family_id"]
+    else:  # Written before comments carried their family
+        recipe = await db.recipes.find_one({"id": comment["recipe_id"]}, {"_id": 0, "family_id": 1})
+        family_id = recipe.get("family_id") if recipe else None
+    await record_tombstones("comment", [comment_id], family_id)
     return {"message": "Comment deleted successfully"}
 
-# ===================== NOTIFICATION ROUTES =====================
+# ===================== DELTA SYNC =====================
 
-@api_router.get("/notifications", response_model=List[NotificationResponse])
-async def get_notifications(user: dict = Depends(get_current_user)):
-    notifications = await db.notifications.find(
-        {"user_id": user["id"]}, 
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(50)
-    return [NotificationResponse(**n) for n in notifications]
+# Recipes and comments carry updated_at, set on every write (clip changes touch their
+# recipe). Deletes leave a tombstone in sync_tombstones, kept for the retention window.
+# GET /sync returns what changed after a token, ordered by (updated_at, id) so pages
+# never skip or repeat a document. Changes from the last few seconds are held back,
+# so a write that is stamped but not yet committed cannot fall behind a handed-out token.
+SYNC_TOMBSTONE_RETENTION_SECONDS = int(os.environ.get("SYNC_TOMBSTONE_RETENTION_SECONDS", str(30 * 24 * 3600)))
+SYNC_SETTLE_SECONDS = 2
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 500
+SYNC_TOKEN_VERSION = 1
 
-@api_router.get("/notifications/unread-count")
-async def get_unread_count(user: dict = Depends(get_current_user)):
-    count = await db.notifications.count_documents({"user_id": user["id"], "is_read": False})
-    return {"count": count}
 
-@api_router.put("/notifications/{notification_id}/read")
-async def mark_notification_read(notification_id: str, user: dict = Depends(get_current_user)):
-    result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": user["id"]},
-        {"$set": {"is_read": True}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Notification not found")
-    return {"message": "Notification marked as read"}
+async def ensure_recipe_indexes():
+    """
+    Recipe IDs can come from clients (offline creates and imports), so the database
+    keeps them unique. Duplicates written before the index existed are fixed once:
+    the oldest document keeps the ID and the others get a fresh one.
+    """
+    indexes = await db.recipes.index_information()
+    if any(index["key"] == [("id", 1)] and index.get("unique") for index in indexes.values()):
+        return
+    duplicates = db.recipes.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$id", "docs": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    async for group in duplicates:
+        for doc_id in group["docs"][1:]:
+            new_id = str(uuid.uuid4())
+            await db.recipes.update_one({"_id": doc_id}, {
+                "$set": {"id": new_id, "updated_at": datetime.now(timezone.utc)}, "$inc": {"revision": 1},
+            })
+            logger.warning("Duplicate recipe ID %s: document %s renamed to %s", group["_id"], doc_id, new_id)
+    await db.recipes.create_index("id", unique=True)
 
-@api_router.put("/notifications/read-all")
-async def mark_all_notifications_read(user: dict = Depends(get_current_user)):
-    await db.notifications.update_many(
-        {"user_id": user["id"], "is_read": False},
-        {"$set": {"is_read": True}}
+
+async def ensure_sync_indexes():
+    await db.recipes.create_index([("family_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.comments.create_index([("family_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.sync_tombstones.create_index([("family_id", 1), ("deleted_at", 1), ("id", 1)])
+    await db.sync_tombstones.create_index("deleted_at", expireAfterSeconds=SYNC_TOMBSTONE_RETENTION_SECONDS)
+
+
+async def backfill_sync_fields():
+    """Stamp updated_at (from created_at) and comment family_id on documents written before sync existed."""
+    stamp = [{"$set": {"updated_at": {
+        "$convert": {"input": "$created_at", "to": "date", "onError": "$$NOW", "onNull": "$$NOW"}
+    }}}]
+    try:
+        for collection in (db.recipes, db.comments):
+            result = await collection.update_many({"updated_at": {"$exists": False}}, stamp)
+            if result.modified_count:
+                logger.info("Sync backfill: stamped updated_at on %d %s", result.modified_count, collection.name)
+
+        recipe_ids = await db.comments.distinct("recipe_id", {"family_id": {"$exists": False}})
+        for start in range(0, len(recipe_ids), 500):
+            recipes = db.recipes.find({"id": {"$in": recipe_ids[start:start + 500]}}, {"_id": 0, "id": 1, "family_id": 1})
+            updates = [
+                UpdateMany({"recipe_id": r["id"], "family_id": {"$exists": False}}, {"$set": {"family_id": r.get("family_id")}})
+                async for r in recipes
+            ]
+            if updates:
+                await db.comments.bulk_write(updates, ordered=False)
+    except PyMongoError as e:
+        logger.error("Sync backfill failed: type=%s message=%s", type(e).__name__, e)
+
+
+async def record_tombstones(kind: str, ids: list, family_id: Optional[str]):
+    """Remember deleted recipes or comments so clients can drop them on their next sync."""
+    if not ids:
+        return
+    now = datetime.now(timezone.utc)
+    await db.sync_tombstones.insert_many([
+        {"type": kind, "id": entity_id, "family_id": family_id, "deleted_at": now} for entity_id in ids
+    ])
+
+
+def _sync_ms(value: datetime) -> int:
+    if value.tzinfo is None:  # Motor returns naive UTC datetimes
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _sync_time(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def encode_sync_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if state.get("v") != SYNC_TOKEN_VERSION or not isinstance(state.get("t"), int):
+            raise ValueError("unknown token version")
+        return state
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+async def _sync_page(collection, time_field: str, scope: dict, after, upper: datetime, limit: int, projection: dict):
+    """Documents in scope changed after the (ms, id) position and up to upper, oldest first."""
+    query = {**scope, time_field: {"$lte": upper}}
+    if after:
+        at = _sync_time(after[0])
+        query["$or"] = [{time_field: {"$gt": at}}, {time_field: at, "id": {"$gt": after[1]}}]
+    docs = await collection.find(query, projection).sort([(time_field, 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    return docs[:limit], len(docs) > limit
+
+
+@api_router.get("/sync")
+async def sync_changes(since: Optional[str] = None, limit: int = SYNC_PAGE_SIZE, user: dict = Depends(get_current_user)):
+    """
+    Recipes and comments changed, and IDs deleted, since a sync token. Without a token
+    this is a full sync. Keep calling with the returned "next" token while has_more is
+    true; store the last one for the next app resume. A 410 means the token is too old
+    (or the user changed family) and the client should start over with a full sync.
+    """
+    family_id = user.get("family_id")
+    scope = {"family_id": family_id}  # None selects legacy recipes, as in get_recipes
+    limit = max(1, min(limit, SYNC_MAX_PAGE_SIZE))
+    upper = datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    upper = upper.replace(microsecond=upper.microsecond // 1000 * 1000)  # BSON dates hold milliseconds
+
+    if since:
+        state = decode_sync_token(since)
+        expired = _sync_time(state["t"]) < datetime.now(timezone.utc) - timedelta(seconds=SYNC_TOMBSTONE_RETENTION_SECONDS)
+        if expired or state.get("f") != family_id:
+            raise HTTPException(status_code=410, detail="Sync token expired; start a full sync")
+    else:
+        # A full sync has nothing to delete locally; later syncs need deletes from now on
+        state = {"v": SYNC_TOKEN_VERSION, "f": family_id, "d": [_sync_ms(upper), ""]}
+
+    recipes, more_recipes = await _sync_page(
+        db.recipes, "updated_at", scope, state.get("r"), upper, limit, {"_id": 0, "legacy_clips.video": 0}
+    )
+    comments, more_comments = await _sync_page(db.comments, "updated_at", scope, state.get("c"), upper, limit, {"_id": 0})
+    tombstones, more_deleted = await _sync_page(
+        db.sync_tombstones, "deleted_at", scope, state.get("d"), upper, limit, {"_id": 0, "type": 1, "id": 1, "deleted_at": 1}
     )
-    return {"message": "All notifications marked as read"}
 
-# ===================== FAMILY ROUTES =====================
+    for recipe in recipes:
+        if len(recipe.get("photo_ids") or []) != len(recipe.get("photos") or []):
+            recipe["photo_ids"] = legacy_photo_ids(recipe["id"], len(recipe.get("photos") or []))
+    for key, docs, field in (("r", recipes, "updated_at"), ("c", comments, "updated_at"), ("d", tombstones, "deleted_at")):
+        if docs:
+            state[key] = [_sync_ms(docs[-1][field]), docs[-1]["id"]]
+    state["t"] = _sync_ms(upper)
+
+    return {
+        "recipes": recipes,
+        "comments": comments,
+        "deleted": [{"type": t["type"], "id": t["id"]} for t in tombstones],
+        "next": encode_sync_token(state),
+        "has_more": more_recipes or more_comments or more_deleted,
+        "server_time": upper.isoformat(),
+    }
+
+
+# ---- Offline mutation log ----
+
+# Clients that edit offline upload their queued mutations in order. Each update names
+# the recipe revision the client last saw; a field someone else changed after that
+# revision (to a different value) is returned as a conflict for the client to merge,
+# while the rest of the mutation is applied. Everything applicable is committed with
+# one ordered bulk_write guarded by the expected revision. Applied mutation IDs are
+# remembered for a while, so a log re-sent after a lost response is not applied twice.
+SYNC_UPLOAD_MAX_MUTATIONS = 200
+SYNC_MUTATION_RETENTION_SECONDS = 7 * 24 * 3600
+RECIPE_SYNC_FIELDS = set(RecipeUpdate.model_fields)
+
+
+class SyncMutation(BaseModel):
+    mutation_id: str  # Client-generated, unique per mutation
+    op: str  # "create" | "update" | "delete"
+    recipe_id: str  # Client-generated UUID for creates
+    base_revision: int = 0  # Recipe revision the client's edit was based on
+    fields: dict = {}  # RecipeCreate fields for create, changed RecipeUpdate fields for update
+
+
+class SyncUploadRequest(BaseModel):
+    mutations: List[SyncMutation]
+
+
+async def ensure_sync_mutation_indexes():
+    await db.sync_mutations.create_index([("user_id", 1), ("mutation_id", 1)], unique=True)
+    await db.sync_mutations.create_index("created_at", expireAfterSeconds=SYNC_MUTATION_RETENTION_SECONDS)
+
+
+@api_router.post("/sync/upload")
+async def sync_upload(body: SyncUploadRequest, user: dict = Depends(get_current_user)):
+    """
+    Apply an ordered log of offline recipe mutations. Each result has a status:
+    applied, partial (some fields conflicted), conflict, rejected (invalid or not
+    allowed), not_found, or retry (the recipe changed while saving; send it again).
+    Conflicts list the field with the server's value and revision.
+    """
+    mutations = body.mutations
+    if len(mutations) > SYNC_UPLOAD_MAX_MUTATIONS:
+        raise HTTPException(status_code=400, detail=f"Upload at most {SYNC_UPLOAD_MAX_MUTATIONS} mutations at a time")
+
+    replayed = {
+        m["mutation_id"]: m["result"] async for m in db.sync_mutations.find(
+            {"user_id": user["id"], "mutation_id": {"$in": [m.mutation_id for m in mutations]}}, {"_id": 0}
+        )
+    }
+    projection = {"_id": 0, "id": 1, "author_id": 1, "family_id": 1, "category": 1, "revision": 1, "field_revisions": 1,
+                  **{field: 1 for m in mutations for field in m.fields if field in RECIPE_SYNC_FIELDS}}
+    recipe_ids = list({m.recipe_id for m in mutations})
+    recipes = {r["id"]: r async for r in db.recipes.find({"id": {"$in": recipe_ids}}, projection)}
+    for recipe in recipes.values():
+        recipe["saved_revision"] = recipe.get("revision")  # What the bulk write's filter expects
+        recipe["loaded_revision"] = recipe.get("revision") or 0  # Before this log's own changes
+
+    display_name = user.get("nickname") or user["name"]
+    results = []
+    writes, write_owner = [], []
+    changed_here = set()  # (recipe_id, field) written earlier in this log, not a conflict with itself
+    created, photo_updates, deleted = {}, {}, {}
+    category_changes = {}  # mutation index -> [(family_id, category, delta)]
+
+    for index, mutation in enumerate(mutations):
+        result = {"mutation_id": mutation.mutation_id, "recipe_id": mutation.recipe_id}
+        results.append(result)
+        if mutation.mutation_id in replayed:
+            result.update(replayed[mutation.mutation_id], replayed=True)
+            continue
+        recipe = recipes.get(mutation.recipe_id)
+
+        if mutation.op == "create":
+            try:
+                uuid.UUID(mutation.recipe_id)
+                data = RecipeCreate(**mutation.fields)
+            except ValidationError as e:
+                result.update(status="rejected", error=validation_message(e))
+                continue
+            except ValueError:
+                result.update(status="rejected", error="recipe_id must be a UUID")
+                continue
+            if recipe is not None:
+                if recipe["author_id"] == user["id"]:
+                    result.update(status="applied", revision=recipe.get("revision", 0))
+                else:
+                    result.update(status="rejected", error="A recipe with this ID already exists")
+                continue
+            now = datetime.now(timezone.utc)
+            recipe_doc = {
+                "id": mutation.recipe_id,
+                "family_id": user.get("family_id"),
+                **data.model_dump(),
+                "photo_ids": new_photo_ids(len(data.photos)),
+                "author_id": user["id"],
+                "author_name": display_name,
+                "created_at": now.isoformat(),
+                "updated_at": now,
+                "revision": 1,
+                "field_revisions": {},
+            }
+            writes.append(InsertOne(dict(recipe_doc)))
+            write_owner.append(index)
+            recipes[recipe_doc["id"]] = {**recipe_doc, "saved_revision": 1, "loaded_revision": 0}
+            created[index] = recipe_doc
+            category_changes[index] = [(recipe_doc["family_id"], recipe_doc["category"], 1)]
+            result.update(status="applied", revision=1)
+            continue
+
+        if mutation.op not in ("update", "delete"):
+            result.update(status="rejected", error="op must be create, update or delete")
+            continue
+        if recipe is None:
+            result.update(status="not_found", error="Recipe not found")
+            continue
+        denied = recipe_update_denied(recipe, user) if mutation.op == "update" else recipe_delete_denied(recipe, user)
+        if denied:
+            result.update(status="rejected", error=denied)
+            continue
+        revision = recipe.get("revision") or 0
+
+        if mutation.op == "delete":
+            if recipe["loaded_revision"] > mutation.base_revision:
+                result.update(status="conflict", revision=revision,
+                              error="The recipe changed since this delete was made; confirm with its current revision")
+                continue
+            writes.append(DeleteOne({"id": recipe["id"], "revision": recipe["saved_revision"]}))
+            write_owner.append(index)
+            deleted[index] = recipe
+            category_changes[index] = [(recipe.get("family_id"), recipe.get("category"), -1)]
+            del recipes[recipe["id"]]
+            result.update(status="applied")
+            continue
+
+        unknown = set(mutation.fields) - RECIPE_SYNC_FIELDS
+        try:
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+            data = RecipeUpdate(**mutation.fields)
+        except ValidationError as e:
+            result.update(status="rejected", error=validation_message(e))
+            continue
+        except ValueError as e:
+            result.update(status="rejected", error=str(e))
+            continue
+
+        changes, conflicts = {}, []
+        field_revisions = recipe.get("field_revisions") or {}
+        for field, value in data.model_dump(exclude_unset=True).items():
+            if value is None:
+                continue
+            server_revision = field_revisions.get(field, 0)
+            if (server_revision > mutation.base_revision and (recipe["id"], field) not in changed_here
+                    and recipe.get(field) != value):
+                conflicts.append({"field": field, "server_value": recipe.get(field),
+                                  "client_value": value, "server_revision": server_revision})
+            else:
+                changes[field] = value
+        if changes:
+            if "photos" in changes and len(changes["photos"]) > len(recipe.get("photos") or []):
+                photo_updates[index] = recipe
+            if "category" in changes and changes["category"] != recipe.get("category"):
+                category_changes[index] = [(recipe.get("family_id"), recipe.get("category"), -1),
+                                           (recipe.get("family_id"), changes["category"], 1)]
+            writes.append(UpdateOne(
+                {"id": recipe["id"], "revision": recipe["saved_revision"]}, recipe_revision_update(changes)
+            ))
+            write_owner.append(index)
+            revision += 1
+            recipe.update(changes, revision=revision, saved_revision=revision,
+                          field_revisions={**field_revisions, **{field: revision for field in changes}})
+            changed_here.update((recipe["id"], field) for field in changes)
+        status = "conflict" if conflicts and not changes else "partial" if conflicts else "applied"
+        result.update(status=status, revision=revision)
+        if conflicts:
+            result["conflicts"] = conflicts
+
+    failed = set()
+    if writes:
+        chains = {}  # recipe_id -> [(mutation index, write)] in log order
+        for request, index in zip(writes, write_owner):
+            chains.setdefault(results[index]["recipe_id"], []).append((index, request))
+
+        async def apply_chain(chain: list):
+            # Writes are guarded by the revision they expect, so one that matches nothing lost
+            # a race with another writer; the rest of the recipe's writes would build on it
+            for position, (index, request) in enumerate(chain):
+                try:
+                    outcome = await db.recipes.bulk_write([request])
+                    applied = outcome.inserted_count + outcome.matched_count + outcome.deleted_count
+                except BulkWriteError as e:
+                    logger.warning("Sync upload write failed user=%s: %s",
+                                   user["id"], e.details["writeErrors"][0].get("errmsg"))
+                    applied = 0
+                if not applied:
+                    failed.update(i for i, _ in chain[position:])
+                    return
+
+        await asyncio.gather(*(apply_chain(chain) for chain in chains.values()))
+        for index in failed:
+            results[index] = {"mutation_id": results[index]["mutation_id"], "recipe_id": results[index]["recipe_id"],
+                              "status": "retry", "error": "The recipe changed while saving; sync and send this again"}
+            created.pop(index, None)
+            photo_updates.pop(index, None)
+            deleted.pop(index, None)
+            category_changes.pop(index, None)
+
+    settled = [
+        {"user_id": user["id"], "mutation_id": r["mutation_id"], "result": r, "created_at": datetime.now(timezone.utc)}
+        for r in results if r["status"] != "retry" and not r.get("replayed")
+    ]
+    await insert_unordered(db.sync_mutations, settled)
+
+    for family_id in {recipe.get("family_id") for recipe in deleted.values()}:
+        await record_tombstones(
+            "recipe", [r["id"] for r in deleted.values() if r.get("family_id") == family_id], family_id
+        )
+    if writes:
+        await bump_family_revisions(user.get("family_id"), "recipes_revision")
+    await count_categories([change for changes in category_changes.values() for change in changes])
+    await notify_recipe_batch(user, list(created.values()), list(photo_updates.values()))
+    logger.info("Sync upload user=%s mutations=%d writes=%d retry=%d", user["id"], len(mutations), len(writes), len(failed))
+    return {"results": results}
+
+
+# ===================== NOTIFICATION ROUTES =====================
+
+@api_router.get("/notifications", response_model=List[NotificationResponse])
+async def get_notifications(user: dict = Depends(get_current_user)):
+    notifications = await db.notifications.find(
+        {"user_id": user["id"]}, 
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(50)
+    return [NotificationResponse(**n) for n in notifications]
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_count(user: dict = Depends(get_current_user)):
+    count = await db.notifications.count_documents({"user_id": user["id"], "is_read": False})
+    return {"count": count}
+
+@api_router.put("/notifications/{notification_id}/read")
+async def mark_notification_read(notification_id: str, user: dict = Depends(get_current_user)):
+    result = await db.notifications.update_one(
+        {"id": notification_id, "user_id": user["id"]},
+        {"$set": {"is_read": True}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return {"message": "Notification marked as read"}
+
+@api_router.put("/notifications/read-all")
+async def mark_all_notifications_read(user: dict = Depends(get_current_user)):
+    await db.notifications.update_many(
+        {"user_id": user["id"], "is_read": False},
+        {"$set": {"is_read": True}}
+    )
+    return {"message": "All notifications marked as read"}
+
+# ===================== FAMILY ROUTES =====================
 
 @api_router.post("/families", response_model=FamilyResponse)
 async def create_family(family_data: FamilyCreate, user: dict = Depends(get_current_user)):
@@ -1276,6 +2465,7 @@ async def join_family(join_data: FamilyJoinRequest, user: dict = Depends(get_cur
         {"id": user["id"]},
         {"$set": {"family_id": family["id"], "role": "member"}}
     )
+    await bump_family_revisions(family["id"], "members_revision")
     
     # Create notification for family keeper
     keeper = await db.users.find_one({"id": family["owner_id"]}, {"_id": 0})
@@ -1295,15 +2485,23 @@ async def join_family(join_data: FamilyJoinRequest, user: dict = Depends(get_cur
     return FamilyResponse(**family)
 
 @api_router.get("/families/{family_id}", response_model=FamilyResponse)
-async def get_family(family_id: str, user: dict = Depends(get_current_user)):
+async def get_family(family_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
     # Verify user belongs to this family
     if user.get("family_id") != family_id:
         raise HTTPException(status_code=403, detail="Not a member of this family")
     
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
+    family = await db.families.find_one({"id": family_id}, {"_id": 0, "revision": 1})
     if not family:
         raise HTTPException(status_code=404, detail="Family not found")
+    etag = make_etag("family", family_id, family.get("revision", 0))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
+    family = await db.families.find_one({"id": family_id}, {"_id": 0})
+    if not family:
+        raise HTTPException(status_code=404, detail="Family not found")
+    set_etag(response, etag)
     return FamilyResponse(**family)
 
 @api_router.put("/families/{family_id}", response_model=FamilyResponse)
@@ -1315,14 +2513,10 @@ async def update_family(family_id: str, family_data: FamilyUpdate, user: dict =
     if user.get("role") != "keeper":
         raise HTTPException(status_code=403, detail="Only the family keeper can update the family")
     
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
-    if not family:
-        raise HTTPException(status_code=404, detail="Family not found")
-    
-    # Build update fields
+    # Build update fields (pipeline expressions, so metadata is merged in the write itself)
     update_fields = {}
     if family_data.name is not None:
-        update_fields["name"] = family_data.name
+        update_fields["name"] = {"$literal": family_data.name}
     
     # Handle metadata updates
     metadata_updates = {}
@@ -1333,15 +2527,17 @@ async def update_family(family_id: str, family_data: FamilyUpdate, user: dict =
     
     # Update metadata if needed
     if metadata_updates:
-        current_metadata = family.get("metadata") or {}
-        updated_metadata = {**current_metadata, **metadata_updates}
-        update_fields["metadata"] = updated_metadata
+        update_fields["metadata"] = {"$mergeObjects": [{"$ifNull": ["$metadata", {}]}, {"$literal": metadata_updates}]}
     
     # Apply updates
+    projection = response_projection(FamilyResponse)
     if update_fields:
-        await db.families.update_one({"id": family_id}, {"$set": update_fields})
-    
-    updated_family = await db.families.find_one({"id": family_id}, {"_id": 0})
+        update_fields["revision"] = {"$add": [{"$ifNull": ["$revision", 0]}, 1]}
+        updated_family = await update_and_fetch(db.families, {"id": family_id}, [{"$set": update_fields}], projection)
+    else:
+        updated_family = await db.families.find_one({"id": family_id}, projection)
+    if not updated_family:
+        raise HTTPException(status_code=404, detail="Family not found")
     return FamilyResponse(**updated_family)
 
 @api_router.delete("/families/{family_id}")
@@ -1369,15 +2565,20 @@ async def delete_family(family_id: str, user: dict = Depends(get_current_user)):
     return {"message": "Family deleted successfully. All members have been removed from the family."}
 
 @api_router.get("/families/{family_id}/members", response_model=List[FamilyMemberResponse])
-async def get_family_members(family_id: str, user: dict = Depends(get_current_user)):
+async def get_family_members(family_id: str, request: Request, response: Response, user: dict = Depends(get_current_user)):
     # Verify user belongs to this family
     if user.get("family_id") != family_id:
         raise HTTPException(status_code=403, detail="Not a member of this family")
     
     # Verify family exists
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
+    family = await db.families.find_one({"id": family_id}, {"_id": 0, "members_revision": 1})
     if not family:
         raise HTTPException(status_code=404, detail="Family not found")
+    etag = make_etag("members", family_id, family.get("members_revision", 0))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    set_etag(response, etag)
     
     # Get all family members
     members = await db.users.find(
@@ -1428,6 +2629,7 @@ async def remove_family_member(family_id: str, user_id: str, user: dict = Depend
         {"id": user_id},
         {"$unset": {"family_id": "", "role": ""}}
     )
+    await bump_family_revisions(family_id, "members_revision")
     
     # Create notification for removed member
     display_name = user.get("nickname") or user["name"]
@@ -1481,6 +2683,7 @@ async def leave_family(family_id: str, user: dict = Depends(get_current_user)):
         {"id": user["id"]},
         {"$unset": {"family_id": "", "role": ""}}
     )
+    await bump_family_revisions(family_id, "members_revision")
     
     # If keeper was the only member and left, optionally delete the family
     # Or keep it for potential future members (your choice)
@@ -1549,7 +2752,7 @@ async def transfer_keeper(
     # 1. Update family owner_id to new keeper
     await db.families.update_one(
         {"id": family_id},
-        {"$set": {"owner_id": transfer_data.new_keeper_id}}
+        {"$set": {"owner_id": transfer_data.new_keeper_id}, "$inc": {"revision": 1, "members_revision": 1}}
     )
     
     # 2. Update new keeper's role to "keeper"
@@ -1666,13 +2869,18 @@ ADMIN_EMAILS = {
 }
 
 
+def is_admin_user(user: dict) -> bool:
+    """Return True for owner/admin accounts."""
+    email = (user.get("email") or "").lower()
+    return email in ADMIN_EMAILS or email.endswith("@ubuntu-village.org")
+
+
 @api_router.get("/subscriptions/status", response_model=SubscriptionStatusResponse)
 async def get_subscription_status(user: dict = Depends(get_current_user)):
     """Return the current user's subscription tier and credit info."""
     user = await refresh_credits_if_needed(user)
-    email = (user.get("email") or "").lower()
     # Admin/owner override — always top tier
-    if email in ADMIN_EMAILS or email.endswith("@ubuntu-village.org"):
+    if is_admin_user(user):
         top_tier = "legacy"
         return SubscriptionStatusResponse(
             subscription_tier=top_tier,
@@ -2042,9 +3250,11 @@ async def seed_sample_family(user: dict = Depends(get_current_user)):
             "author_id": user["id"],
             "author_name": user.get("name", "Family Chef"),
             "created_at": (now - timedelta(days=i)).isoformat(),
+            "updated_at": now,
         }
         await db.recipes.insert_one(recipe_doc)
 
+    await count_categories([(family_id, recipe_data["category"], 1) for recipe_data in SAMPLE_RECIPES])
     logger.info("Seeded sample family=%s with %d recipes for user=%s", family_id, len(SAMPLE_RECIPES), user["id"])
 
     return {
@@ -2104,46 +3314,417 @@ async def use_credits(body: UseCreditsRequest, user: dict = Depends(get_current_
 
 # ---- Backup & Export ----
 
-@api_router.get("/export/recipes")
-async def export_recipes(user: dict = Depends(get_current_user)):
-    """
-    Export all of the user's family recipes as a JSON backup.
-    Includes recipe data, comments count, and family info.
-    Strips base64 photo data to keep the export manageable.
-    """
-    family_id = user.get("family_id")
-    if not family_id:
-        raise HTTPException(status_code=400, detail="You need to be in a family to export recipes")
+# Exports are streamed one batch of recipes at a time, so memory use does not grow
+# with the size of the family. NDJSON and ZIP exports carry photos, comments and clip
+# metadata; the original JSON export keeps its format (without photo data).
+EXPORT_FORMAT_VERSION = "2.0"
+EXPORT_BATCH_SIZE = 100
+EXPORT_MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson", "zip": "application/zip"}
+EXPORT_PHOTO_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif", "image/heic": "heic"}
+# Clip videos can be 16MB each; exports carry their metadata only
+EXPORT_RECIPE_PROJECTION = {"_id": 0, "legacy_clips.video": 0}
+
+
+class _ZipStreamSink:
+    """Write-only file object for zipfile that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def export_manifest(user: dict, family: Optional[dict]) -> dict:
+    return {
+        "format_version": EXPORT_FORMAT_VERSION,
+        "app_version": "1.0.4",
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "exported_by": {"id": user["id"], "name": user.get("name"), "email": user.get("email")},
+        "family": {"id": user["family_id"], "name": family.get("name") if family else None},
+    }
+
+
+def decode_export_photo(photo: str):
+    """Return (bytes, file extension) for a stored photo, or None if it is not decodable."""
+    if not isinstance(photo, str) or not photo:
+        return None
+    payload, media_type = split_image_data_url(photo)
+    try:
+        data = base64.b64decode("".join(payload.split()), validate=True)
+    except (ValueError, TypeError):
+        return None
+    return data, EXPORT_PHOTO_EXTENSIONS.get(media_type.lower(), "jpg")
 
-    family = await db.families.find_one({"id": family_id}, {"_id": 0})
-    recipes_cursor = db.recipes.find({"family_id": family_id}, {"_id": 0})
-    recipes = await recipes_cursor.to_list(length=1000)
 
-    # Strip heavy base64 photo data, keep count
-    for r in recipes:
-        photo_count = len(r.get("photos", []))
-        r["photo_count"] = photo_count
-        r["photos"] = []  # Clear base64 data from export
+async def iter_export_recipes(family_id: str):
+    """Yield (recipe, comments) for every recipe in the family, loading comments per batch."""
+    cursor = db.recipes.find({"family_id": family_id}, EXPORT_RECIPE_PROJECTION).sort("_id", 1)
+    cursor.batch_size(EXPORT_BATCH_SIZE)
 
-    export_data = {
+    async def with_comments(batch):
+        comments = {}
+        async for comment in db.comments.find({"recipe_id": {"$in": [r["id"] for r in batch]}}, {"_id": 0}):
+            comments.setdefault(comment["recipe_id"], []).append(comment)
+        return [(r, sorted(comments.get(r["id"], []), key=lambda c: c.get("created_at") or "")) for r in batch]
+
+    batch = []
+    async for recipe in cursor:
+        batch.append(recipe)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            for item in await with_comments(batch):
+                yield item
+            batch = []
+    if batch:
+        for item in await with_comments(batch):
+            yield item
+
+
+async def export_json_chunks(user: dict, family: Optional[dict], progress: dict):
+    """The original single-document JSON export (photos stripped), written incrementally."""
+    family_id = user["family_id"]
+    header = {
         "exported_at": datetime.now(timezone.utc).isoformat(),
-        "exported_by": {
-            "id": user["id"],
-            "name": user.get("name"),
-            "email": user.get("email"),
-        },
-        "family": {
-            "id": family_id,
-            "name": family.get("name") if family else None,
-        },
-        "recipe_count": len(recipes),
-        "recipes": recipes,
+        "exported_by": {"id": user["id"], "name": user.get("name"), "email": user.get("email")},
+        "family": {"id": family_id, "name": family.get("name") if family else None},
+        "recipe_count": await db.recipes.count_documents({"family_id": family_id}),
         "app_version": "1.0.4",
         "format_version": "1.0",
     }
+    yield (json.dumps(header)[:-1] + ', "recipes": [').encode()
+    async for recipe, _comments in iter_export_recipes(family_id):
+        recipe["photo_count"] = len(recipe.get("photos") or [])
+        recipe["photos"] = []
+        yield (", " if progress["recipes"] else "").encode() + json.dumps(recipe, default=str).encode()
+        progress["recipes"] += 1
+    yield b"]}"
+
+
+async def export_ndjson_chunks(user: dict, family: Optional[dict], progress: dict):
+    """
+    One JSON object per line: a manifest, then a "recipe" line per recipe with its photos
+    inline, comments and clip metadata, then an "end" line with the count as a completeness check.
+    """
+    yield (json.dumps({"type": "manifest", **export_manifest(user, family)}) + "\n").encode()
+    async for recipe, comments in iter_export_recipes(user["family_id"]):
+        clips = recipe.pop("legacy_clips", None) or []
+        line = {"type": "recipe", "recipe": recipe, "comments": comments, "clips": clips}
+        yield (json.dumps(line, default=str) + "\n").encode()
+        progress["recipes"] += 1
+    yield (json.dumps({"type": "end", "recipe_count": progress["recipes"]}) + "\n").encode()
+
+
+async def export_zip_chunks(user: dict, family: Optional[dict], progress: dict):
+    """
+    A ZIP with recipes/<id>/recipe.json (recipe, comments, clip metadata) and the recipe's
+    photos as image files beside it; recipe.json lists their paths in "photos". Images are
+    stored rather than deflated since they are already compressed. manifest.json comes last.
+    """
+    sink = _ZipStreamSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+    async for recipe, comments in iter_export_recipes(user["family_id"]):
+        folder = f"recipes/{re.sub(r'[^A-Za-z0-9_-]', '_', recipe['id'])}"
+        photo_paths = []
+        for number, photo in enumerate(recipe.get("photos") or [], 1):
+            decoded = decode_export_photo(photo)
+            if decoded is None:
+                continue
+            data, extension = decoded
+            path = f"{folder}/photo-{number}.{extension}"
+            archive.writestr(path, data, compress_type=zipfile.ZIP_STORED)
+            photo_paths.append(path)
+        recipe["photos"] = photo_paths
+        clips = recipe.pop("legacy_clips", None) or []
+        document = {"recipe": recipe, "comments": comments, "clips": clips}
+        archive.writestr(f"{folder}/recipe.json", json.dumps(document, indent=2, default=str))
+        progress["recipes"] += 1
+        yield sink.drain()
+
+    manifest = {**export_manifest(user, family), "recipe_count": progress["recipes"]}
+    archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    archive.close()
+    yield sink.drain()
+
+
+EXPORT_WRITERS = {"json": export_json_chunks, "ndjson": export_ndjson_chunks, "zip": export_zip_chunks}
+
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_filename(fmt: str, gzipped: bool = False) -> str:
+    name = f"legacy-table-export-{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.{fmt}"
+    return name + ".gz" if gzipped else name
+
+
+async def export_family(user: dict) -> Optional[dict]:
+    if not user.get("family_id"):
+        raise HTTPException(status_code=400, detail="You need to be in a family to export recipes")
+    return await db.families.find_one({"id": user["family_id"]}, {"_id": 0})
+
+
+@api_router.get("/export/recipes")
+async def export_recipes(request: Request, format: str = "json", user: dict = Depends(get_current_user)):
+    """
+    Export all of the user's family recipes as a download, streamed as it is read.
+    format=json is the original backup (photos stripped); ndjson and zip include photos,
+    comments and clip metadata. JSON and NDJSON are gzipped when the client accepts it.
+    For very large families, POST /export/jobs builds the file in the background instead.
+    """
+    if format not in EXPORT_WRITERS:
+        raise HTTPException(status_code=400, detail="format must be one of: json, ndjson, zip")
+    family = await export_family(user)
+
+    progress = {"recipes": 0}
+    chunks = EXPORT_WRITERS[format](user, family, progress)
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(format)}"'}
+    if format != "zip":
+        headers["Vary"] = "Accept-Encoding"
+        if "gzip" in request.headers.get("accept-encoding", "").lower():
+            chunks = gzip_chunks(chunks)
+            headers["Content-Encoding"] = "gzip"
+
+    async def logged(chunks):
+        async for chunk in chunks:
+            yield chunk
+        logger.info("Exported %d recipes as %s for user=%s family=%s",
+                    progress["recipes"], format, user["id"], user["family_id"])
+
+    return StreamingResponse(logged(chunks), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+
+# ---- Export jobs ----
+
+# A background export writes the file to GridFS, where it can be downloaded with
+# Range requests so an interrupted download resumes instead of starting over.
+# Each user keeps only their latest export; expired ones are swept when a new one starts.
+EXPORT_JOB_RETENTION_SECONDS = int(os.environ.get("EXPORT_JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+EXPORT_JOB_STALE_SECONDS = 300  # A running job that has not reported progress for this long has died
+EXPORT_PROGRESS_EVERY = 50  # recipes
+EXPORT_DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+export_files = AsyncIOMotorGridFSBucket(db, bucket_name="export_files")
+_export_tasks = set()
+
+
+class ExportJobRequest(BaseModel):
+    format: str = "zip"
+    gzip: bool = False
+
+
+async def ensure_export_job_indexes():
+    await db.export_jobs.create_index("id", unique=True)
+    await db.export_jobs.create_index([("user_id", 1), ("created_at", -1)])
+    await db.export_jobs.create_index("expires_at")
+
+
+def heartbeat_is_stale(updated_at: Optional[datetime], seconds: int) -> bool:
+    """True when a background task that reports progress in updated_at has gone quiet (it died with its process)."""
+    if updated_at is None:
+        return False
+    if updated_at.tzinfo is None:  # Motor returns naive UTC datetimes
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - updated_at > timedelta(seconds=seconds)
+
+
+def export_job_response(job: dict) -> dict:
+    status, error = job["status"], job.get("error")
+    if status == "running" and heartbeat_is_stale(job.get("updated_at"), EXPORT_JOB_STALE_SECONDS):
+        status, error = "failed", "The export stopped unexpectedly. Please start a new one."
+    return {
+        "job_id": job["id"],
+        "status": status,
+        "format": job["format"],
+        "gzip": job.get("gzip", False),
+        "recipe_total": job.get("recipe_total"),
+        "recipes_exported": job.get("recipes_exported", 0),
+        "size": job.get("size"),
+        "download_url": f"/api/export/jobs/{job['id']}/download" if status == "completed" else None,
+        "error": error,
+        "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+        "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+        "expires_at": job["expires_at"].isoformat() if job.get("expires_at") else None,
+    }
+
+
+async def delete_export_jobs(query: dict, limit: int = 50):
+    for job in await db.export_jobs.find(query, {"_id": 0, "id": 1, "file_id": 1}).to_list(limit):
+        if job.get("file_id"):
+            try:
+                await export_files.delete(job["file_id"])
+            except Exception as e:  # Already gone
+                logger.warning("Could not delete export file job=%s: %s", job["id"], e)
+        await db.export_jobs.delete_one({"id": job["id"]})
+
+
+async def run_export_job(job: dict, user: dict, family: Optional[dict]):
+    progress = {"recipes": 0}
+    chunks = EXPORT_WRITERS[job["format"]](user, family, progress)
+    if job["gzip"]:
+        chunks = gzip_chunks(chunks)
+    upload = export_files.open_upload_stream(
+        job["filename"], metadata={"job_id": job["id"], "user_id": user["id"]}
+    )
+    size = 0
+    reported = 0
+    try:
+        async for chunk in chunks:
+            await upload.write(chunk)
+            size += len(chunk)
+            if progress["recipes"] - reported >= EXPORT_PROGRESS_EVERY:
+                reported = progress["recipes"]
+                await db.export_jobs.update_one({"id": job["id"]}, {"$set": {
+                    "recipes_exported": reported, "updated_at": datetime.now(timezone.utc),
+                }})
+        await upload.close()
+    except asyncio.CancelledError:
+        await upload.abort()
+        raise
+    except Exception:
+        logger.exception("Export job failed job=%s", job["id"])
+        await upload.abort()
+        now = datetime.now(timezone.utc)
+        await db.export_jobs.update_one({"id": job["id"]}, {"$set": {
+            "status": "failed", "error": "The export failed. Please try again.",
+            "updated_at": now, "finished_at": now,
+        }})
+        return
+
+    now = datetime.now(timezone.utc)
+    await db.export_jobs.update_one({"id": job["id"]}, {"$set": {
+        "status": "completed", "file_id": upload._id, "size": size,
+        "recipes_exported": progress["recipes"], "updated_at": now, "finished_at": now,
+        "expires_at": now + timedelta(seconds=EXPORT_JOB_RETENTION_SECONDS),
+    }})
+    logger.info("Export job finished job=%s format=%s recipes=%d bytes=%d",
+                job["id"], job["format"], progress["recipes"], size)
+
+
+@api_router.post("/export/jobs", status_code=202)
+async def create_export_job(body: ExportJobRequest, user: dict = Depends(get_current_user)):
+    """Start building a family export in the background. Poll the job, then download it."""
+    if body.format not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or zip")
+    family = await export_family(user)
+
+    now = datetime.now(timezone.utc)
+    running = await db.export_jobs.find_one({
+        "user_id": user["id"], "status": "running",
+        "updated_at": {"$gt": now - timedelta(seconds=EXPORT_JOB_STALE_SECONDS)},
+    }, {"_id": 0})
+    if running:
+        return export_job_response(running)
+
+    await delete_export_jobs({"user_id": user["id"]})
+    await delete_export_jobs({"expires_at": {"$lt": now}})
+
+    gzipped = body.gzip and body.format == "ndjson"
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "family_id": user["family_id"],
+        "format": body.format,
+        "gzip": gzipped,
+        "filename": export_filename(body.format, gzipped),
+        "status": "running",
+        "recipe_total": await db.recipes.count_documents({"family_id": user["family_id"]}),
+        "recipes_exported": 0,
+        "created_at": now,
+        "updated_at": now,
+        # Replaced with the download's expiry on completion; bounds how long a dead job lingers
+        "expires_at": now + timedelta(seconds=EXPORT_JOB_RETENTION_SECONDS),
+    }
+    await db.export_jobs.insert_one(dict(job))
+    task = asyncio.create_task(run_export_job(job, user, family))
+    _export_tasks.add(task)
+    task.add_done_callback(_export_tasks.discard)
+    return export_job_response(job)
+
+
+async def get_user_export_job(job_id: str, user: dict) -> dict:
+    job = await db.export_jobs.find_one({"id": job_id, "user_id": user["id"]}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+
+@api_router.get("/export/jobs/{job_id}")
+async def get_export_job(job_id: str, user: dict = Depends(get_current_user)):
+    return export_job_response(await get_user_export_job(job_id, user))
+
 
-    logger.info("Exported %d recipes for user=%s family=%s", len(recipes), user["id"], family_id)
-    return export_data
+def parse_byte_range(header: Optional[str], size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, or None to send the whole file
+    (no header, or a multi-range request). Raises 416 when the range is unsatisfiable.
+    """
+    if not header or "," in header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@api_router.get("/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request, user: dict = Depends(get_current_user)):
+    """Download a finished export. Supports single Range requests for resuming."""
+    job = await get_user_export_job(job_id, user)
+    if job["status"] != "completed" or not job.get("file_id"):
+        raise HTTPException(status_code=409, detail="This export is not ready yet")
+
+    grid_out = await export_files.open_download_stream(job["file_id"])
+    size = grid_out.length
+    etag = f'"{job["file_id"]}"'
+    if_range = request.headers.get("if-range")
+    byte_range = parse_byte_range(request.headers.get("range"), size) if if_range in (None, etag) else None
+    start, end = byte_range or (0, size - 1)
+    if size:
+        grid_out.seek(start)
+
+    async def body():
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(EXPORT_DOWNLOAD_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": f'attachment; filename="{job["filename"]}"',
+        "ETag": etag,
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    media_type = "application/gzip" if job.get("gzip") else EXPORT_MEDIA_TYPES[job["format"]]
+    return StreamingResponse(body(), status_code=206 if byte_range else 200, media_type=media_type, headers=headers)
 
 
 # ---- Founder Badge ----
@@ -2213,365 +3794,3186 @@ async def get_badges(user: dict = Depends(get_current_user)):
     return {"badges": badges}
 
 
-# ===================== AI RECIPE SCANNER (Milestone 2.1) =====================
+# ===================== STREAMING UPLOADS =====================
 
-RECIPE_SCAN_PROMPT = """You are a recipe extraction assistant for a family recipe app called Legacy Table.
-Analyze this image of a recipe (handwritten, printed, or from a book/card) and extract the following structured data.
+# Uploads up to this size stay in memory; larger ones roll over to a temp file
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.environ.get("UPLOAD_SPOOL_MEMORY_BYTES", str(16 * 1024 * 1024)))
 
-Return ONLY valid JSON with these exact keys:
-{
-  "title": "Recipe title",
-  "ingredients": ["ingredient 1 with quantity", "ingredient 2 with quantity", ...],
-  "instructions": "Full cooking instructions as a single string with paragraph breaks",
-  "cooking_time": 30,
-  "servings": 4,
-  "category": "Main Course",
-  "difficulty": "easy",
-  "story": "Any personal notes, history, or story visible on the recipe card (or null if none)"
-}
 
-Rules:
-- cooking_time is in minutes (integer). Estimate if not stated.
-- servings is an integer. Estimate if not stated (default 4).
-- category must be one of: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, Beverage
-- difficulty must be one of: easy, medium, hard (estimate based on complexity)
-- Keep ingredients as a clean list with quantities
-- Instructions should be clear, readable paragraphs
-- If you see a story, family note, or dedication on the card, capture it in "story"
-- Return ONLY the JSON object, no markdown, no explanation"""
+async def capped_body_stream(request: Request, max_bytes: int, too_large_detail: str):
+    """
+    Yield the request body chunk by chunk, failing with 413 as soon as it passes max_bytes.
+    Content-Length is checked up front, but chunked uploads are only caught while streaming.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=too_large_detail)
 
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise HTTPException(status_code=413, detail=too_large_detail)
+        yield chunk
 
-@api_router.post("/ai/scan-recipe")
-async def scan_recipe(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Scan a photo of a recipe and extract structured data using GPT-4 Vision."""
-    if not openai_client:
-        raise HTTPException(status_code=503, detail="AI features are not configured")
 
-    user = await get_current_user(credentials)
+async def spool_request_body(request: Request, max_bytes: int, too_large_detail: str):
+    """Stream a raw request body into a spooled file (rewound) without buffering it twice."""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+    try:
+        async for chunk in capped_body_stream(request, max_bytes, too_large_detail):
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    if spool.tell() == 0:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Empty upload")
+    spool.seek(0)
+    return spool
 
-    # Consume credit
-    user = await consume_credit(user, "recipe_scan")
 
-    body = await request.json()
-    image_data = body.get("image")  # Base64 data URL
-    if not image_data:
-        raise HTTPException(status_code=400, detail="No image provided")
+class SpoolingMultiPartParser(MultiPartParser):
+    # Starlette rolls file parts to disk after 1MB; keep typical uploads in memory
+    max_file_size = UPLOAD_SPOOL_MEMORY_BYTES
 
-    # Handle data URL format: strip prefix if present
-    if image_data.startswith("data:"):
-        # e.g., data:image/jpeg;base64,/9j/4AAQ...
-        image_data_b64 = image_data.split(",", 1)[1] if "," in image_data else image_data
-        media_type = image_data.split(";")[0].split(":")[1] if ";" in image_data else "image/jpeg"
-    else:
-        image_data_b64 = image_data
-        media_type = "image/jpeg"
 
+async def parse_capped_multipart(request: Request, max_bytes: int, too_large_detail: str, max_files: int = 1):
+    """
+    Parse a multipart body while enforcing max_bytes on the raw stream.
+    File parts are spooled, so the caller must close the returned form.
+    """
+    parser = SpoolingMultiPartParser(
+        request.headers,
+        capped_body_stream(request, max_bytes, too_large_detail),
+        max_files=max_files,
+        max_fields=10,
+    )
     try:
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": RECIPE_SCAN_PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type};base64,{image_data_b64}",
-                                "detail": "high",
-                            },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=2000,
-            temperature=0.1,
-        )
+        return await parser.parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+# ===================== AI USAGE TELEMETRY =====================
+
+# Every model call made through call_ai_model is measured: model, attempts, latency,
+# tokens, estimated cost and outcome, attributed to the endpoint and user behind it.
+# In-process aggregates (reset on restart) keep recent latency percentiles; a sample
+# of calls, plus every failed call, is stored in ai_usage for longer-range analysis.
+AI_USAGE_COLLECTION = "ai_usage"
+AI_USAGE_SAMPLE_RATE = float(os.environ.get("AI_USAGE_SAMPLE_RATE", "0.1"))
+AI_USAGE_TTL_SECONDS = int(os.environ.get("AI_USAGE_TTL_SECONDS", str(90 * 24 * 3600)))  # 90 days
+AI_USAGE_LATENCY_WINDOW = 1000  # Recent latencies kept per endpoint and model
+
+# USD per million tokens (input, output), for cost estimates
+AI_MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+# USD per minute of audio, for models billed on recording length
+AI_MODEL_AUDIO_PRICES = {
+    "whisper-1": 0.006,
+}
 
-        result_text = response.choices[0].message.content.strip()
+_ai_usage_context = contextvars.ContextVar("ai_usage_context", default=None)
+_ai_call_record = contextvars.ContextVar("ai_call_record", default=None)
+_ai_call_stats = {}  # (endpoint, model) -> counters
+_ai_usage_writes = set()
 
-        # Parse JSON — strip markdown fences if present
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1] if "\n" in result_text else result_text[3:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            result_text = result_text.strip()
 
-        recipe_data = json.loads(result_text)
+async def ensure_ai_usage_indexes():
+    await db[AI_USAGE_COLLECTION].create_index([("endpoint", 1), ("created_at", -1)])
+    await db[AI_USAGE_COLLECTION].create_index("created_at", expireAfterSeconds=AI_USAGE_TTL_SECONDS)
 
-        # Validate required fields
-        required = ["title", "ingredients", "instructions"]
-        for field in required:
-            if field not in recipe_data or not recipe_data[field]:
-                raise ValueError(f"Missing required field: {field}")
 
-        # Set defaults for optional fields
-        recipe_data.setdefault("cooking_time", 30)
-        recipe_data.setdefault("servings", 4)
-        recipe_data.setdefault("category", "Main Course")
-        recipe_data.setdefault("difficulty", "easy")
-        recipe_data.setdefault("story", None)
+@contextmanager
+def ai_usage_scope(endpoint: str, user: Optional[dict] = None):
+    """Attribute the model calls made inside the block to an endpoint and user."""
+    token = _ai_usage_context.set({"endpoint": endpoint, "user_id": (user or {}).get("id")})
+    try:
+        yield
+    finally:
+        _ai_usage_context.reset(token)
 
-        return {
-            "success": True,
-            "recipe": recipe_data,
-            "credits_remaining": user.get("credits_balance", 0),
-        }
 
-    except json.JSONDecodeError as e:
-        logger.error("AI recipe scan JSON parse error: %s", e)
-        raise HTTPException(status_code=422, detail="AI could not parse this image into a recipe. Try a clearer photo.")
-    except Exception as e:
-        logger.error("AI recipe scan error: %s", e)
-        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+def note_ai_tokens(usage):
+    """Add an OpenAI usage object's token counts to the call being measured."""
+    record = _ai_call_record.get()
+    if record is None or usage is None:
+        return
+    record["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+    record["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
 
 
-# ===================== VOICE-TO-RECIPE (Milestone 2.2) =====================
+def note_ai_audio(seconds: Optional[float]):
+    """Add the length of a transcribed recording to the call being measured."""
+    record = _ai_call_record.get()
+    if record is None or not seconds:
+        return
+    record["audio_seconds"] = round(record["audio_seconds"] + seconds, 1)
 
-VOICE_RECIPE_PROMPT = """You are a recipe structuring assistant for a family recipe app called Legacy Table.
-The user dictated a recipe by voice. The transcription is below. Extract and structure it into a clean recipe.
 
-Return ONLY valid JSON with these exact keys:
-{
-  "title": "Recipe title (infer from context if not stated)",
-  "ingredients": ["ingredient 1 with quantity", "ingredient 2 with quantity", ...],
-  "instructions": "Full cooking instructions as a single string with paragraph breaks",
-  "cooking_time": 30,
-  "servings": 4,
-  "category": "Main Course",
-  "difficulty": "easy",
-  "story": "Any personal story or context the speaker mentioned (or null)"
-}
+def estimate_ai_cost(model: str, prompt_tokens: int, completion_tokens: int, audio_seconds: float = 0) -> Optional[float]:
+    if model in AI_MODEL_AUDIO_PRICES:
+        return round(audio_seconds / 60 * AI_MODEL_AUDIO_PRICES[model], 6)
+    prices = AI_MODEL_PRICES.get(model)
+    if not prices:
+        return None
+    return round((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000, 6)
+
+
+def start_ai_call(model: str, streamed: bool) -> dict:
+    context = _ai_usage_context.get() or {}
+    return {
+        "endpoint": context.get("endpoint", "other"),
+        "user_id": context.get("user_id"),
+        "model": model,
+        "model_used": None,
+        "streamed": streamed,
+        "attempts": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "audio_seconds": 0.0,
+        "started": time.perf_counter(),
+    }
+
+
+def finish_ai_call(record: dict, outcome: str):
+    record["outcome"] = outcome
+    record["latency_ms"] = round((time.perf_counter() - record.pop("started")) * 1000, 1)
+    record["cost_usd"] = estimate_ai_cost(
+        record["model_used"] or record["model"], record["prompt_tokens"], record["completion_tokens"],
+        record["audio_seconds"],
+    )
+
+    stats = _ai_call_stats.get((record["endpoint"], record["model"]))
+    if stats is None:
+        stats = _ai_call_stats[(record["endpoint"], record["model"])] = {
+            "calls": 0, "errors": 0, "retries": 0, "fallbacks": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+            "latencies": deque(maxlen=AI_USAGE_LATENCY_WINDOW),
+        }
+    stats["calls"] += 1
+    stats["errors"] += outcome != "ok"
+    stats["retries"] += max(0, record["attempts"] - 1)
+    stats["fallbacks"] += bool(record["model_used"] and record["model_used"] != record["model"])
+    stats["prompt_tokens"] += record["prompt_tokens"]
+    stats["completion_tokens"] += record["completion_tokens"]
+    stats["cost_usd"] += record["cost_usd"] or 0
+    stats["latencies"].append(record["latency_ms"])
+
+    logger.info(
+        "AI call endpoint=%s model=%s used=%s attempts=%d latency_ms=%.0f tokens=%d/%d outcome=%s",
+        record["endpoint"], record["model"], record["model_used"], record["attempts"],
+        record["latency_ms"], record["prompt_tokens"], record["completion_tokens"], outcome,
+    )
+
+    # Stored documents carry the number of calls they stand for, so aggregates can be scaled back up
+    if outcome != "ok":
+        weight = 1.0
+    elif AI_USAGE_SAMPLE_RATE > 0 and random.random() < AI_USAGE_SAMPLE_RATE:
+        weight = 1 / AI_USAGE_SAMPLE_RATE
+    else:
+        return
+    task = asyncio.ensure_future(_store_ai_usage({**record, "weight": weight, "created_at": datetime.now(timezone.utc)}))
+    _ai_usage_writes.add(task)
+    task.add_done_callback(_ai_usage_writes.discard)
+
+
+async def _store_ai_usage(doc: dict):
+    try:
+        await db[AI_USAGE_COLLECTION].insert_one(doc)
+    except PyMongoError as e:
+        logger.warning("AI usage write failed: %s", e)
+
+
+def _percentile(values: list, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+@api_router.get("/ai/usage/stats")
+async def get_ai_usage_stats(days: int = 7, user: dict = Depends(get_current_user)):
+    """
+    Report per-endpoint and per-model AI call aggregates (admin only): live counters
+    with recent latency percentiles from this process, and estimates over the last
+    `days` from the sampled ai_usage collection.
+    """
+    if not is_admin_user(user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    live = []
+    for (endpoint, model), stats in sorted(_ai_call_stats.items()):
+        latencies = list(stats["latencies"])
+        live.append({
+            "endpoint": endpoint,
+            "model": model,
+            "calls": stats["calls"],
+            "errors": stats["errors"],
+            "error_rate": round(stats["errors"] / stats["calls"], 4),
+            "retries": stats["retries"],
+            "fallbacks": stats["fallbacks"],
+            "prompt_tokens": stats["prompt_tokens"],
+            "completion_tokens": stats["completion_tokens"],
+            "cost_usd": round(stats["cost_usd"], 4),
+            "latency_ms": {
+                "p50": _percentile(latencies, 50),
+                "p95": _percentile(latencies, 95),
+                "p99": _percentile(latencies, 99),
+            },
+        })
+
+    since = datetime.now(timezone.utc) - timedelta(days=max(1, min(days, 90)))
+    rows = await db[AI_USAGE_COLLECTION].aggregate([
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$group": {
+            "_id": {"endpoint": "$endpoint", "model": "$model"},
+            "samples": {"$sum": 1},
+            "calls": {"$sum": "$weight"},
+            "errors": {"$sum": {"$cond": [{"$eq": ["$outcome", "ok"]}, 0, "$weight"]}},
+            "latency_total": {"$sum": {"$multiply": ["$latency_ms", "$weight"]}},
+            "max_latency_ms": {"$max": "$latency_ms"},
+            "prompt_tokens": {"$sum": {"$multiply": ["$prompt_tokens", "$weight"]}},
+            "completion_tokens": {"$sum": {"$multiply": ["$completion_tokens", "$weight"]}},
+            "cost_usd": {"$sum": {"$multiply": [{"$ifNull": ["$cost_usd", 0]}, "$weight"]}},
+        }},
+        {"$sort": {"_id.endpoint": 1, "_id.model": 1}},
+    ]).to_list(None)
+
+    sampled = []
+    for row in rows:
+        calls = row["calls"] or 1
+        sampled.append({
+            "endpoint": row["_id"]["endpoint"],
+            "model": row["_id"]["model"],
+            "samples": row["samples"],
+            "calls_estimated": round(row["calls"]),
+            "error_rate": round(row["errors"] / calls, 4),
+            "avg_latency_ms": round(row["latency_total"] / calls, 1),
+            "max_latency_ms": row["max_latency_ms"],
+            "avg_prompt_tokens": round(row["prompt_tokens"] / calls),
+            "avg_completion_tokens": round(row["completion_tokens"] / calls),
+            "avg_cost_usd": round(row["cost_usd"] / calls, 6),
+            "cost_usd_estimated": round(row["cost_usd"], 2),
+        })
+
+    return {"live": live, "sampled": {"since": since.isoformat(), "sample_rate": AI_USAGE_SAMPLE_RATE, "rows": sampled}}
+
+
+# ===================== AI CALL RESILIENCE =====================
+
+# Every OpenAI call goes through call_ai_model. Each attempt holds a model slot and
+# has its own timeout; retryable errors are retried with jittered backoff within the
+# request's deadline; a per-model circuit breaker fails fast while the provider is
+# erroring; and a fallback model takes over when the primary fails or is slow.
+
+# End-to-end budgets for synchronous AI requests, in seconds
+AI_DEADLINE_SECONDS = {
+    "recipe_scan": float(os.environ.get("AI_DEADLINE_SCAN_SECONDS", "60")),
+    "voice_to_recipe": float(os.environ.get("AI_DEADLINE_VOICE_SECONDS", "300")),
+    "save_from_link": float(os.environ.get("AI_DEADLINE_LINK_SECONDS", "45")),
+}
+AI_DEADLINE_DETAIL = "AI processing took too long. Your credit was not used; please try again."
+AI_UNAVAILABLE_DETAIL = "AI processing is temporarily unavailable. Your credit was not used; please try again shortly."
+
+# Per-attempt timeouts; each segment of a long recording is its own Whisper attempt
+AI_ATTEMPT_TIMEOUT_SECONDS = {"gpt-4o": 45.0, "gpt-4o-mini": 30.0, "whisper-1": 90.0}
+AI_DEFAULT_ATTEMPT_TIMEOUT_SECONDS = 45.0
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", "2"))
+AI_RETRY_BASE_SECONDS = 0.5
+AI_RETRY_MAX_SECONDS = 4.0
+
+# Secondary model per primary (empty disables it). Non-streamed calls still running
+# after AI_HEDGE_AFTER_SECONDS are hedged: the secondary is started and the first answer wins.
+AI_FALLBACK_MODELS = {
+    "gpt-4o": os.environ.get("AI_FALLBACK_GPT_4O", "gpt-4o-mini"),
+    "gpt-4o-mini": os.environ.get("AI_FALLBACK_GPT_4O_MINI", "gpt-4o"),
+}
+AI_HEDGE_AFTER_SECONDS = float(os.environ.get("AI_HEDGE_AFTER_SECONDS", "20"))  # 0 disables hedging
+
+# A model's breaker opens when at least AI_BREAKER_MIN_CALLS calls in the window
+# failed at AI_BREAKER_ERROR_RATE or more, and lets one probe through per cooldown
+AI_BREAKER_WINDOW_SECONDS = 60
+AI_BREAKER_MIN_CALLS = 10
+AI_BREAKER_ERROR_RATE = 0.5
+AI_BREAKER_COOLDOWN_SECONDS = 30
+
+# Monotonic deadline of the AI request running in this context, if any
+_ai_deadline = contextvars.ContextVar("ai_deadline", default=None)
+
+
+class AIModelUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, model: str):
+        self.model = model
+        self.outcomes = deque()  # (monotonic time, ok)
+        self.opened_at = None
+        self.probe_started = None
+
+    def allow(self) -> Optional[str]:
+        """Return "closed" or "probe" if a call may proceed, None while the breaker is open."""
+        if self.opened_at is None:
+            return "closed"
+        now = time.monotonic()
+        if now - self.opened_at < AI_BREAKER_COOLDOWN_SECONDS:
+            return None
+        if self.probe_started is not None and now - self.probe_started < AI_BREAKER_COOLDOWN_SECONDS:
+            return None
+        self.probe_started = now
+        return "probe"
+
+    def record(self, ok: bool, mode: str):
+        now = time.monotonic()
+        if mode == "probe":
+            self.probe_started = None
+            if ok:
+                logger.info("AI circuit closed model=%s", self.model)
+                self.opened_at = None
+                self.outcomes.clear()
+            else:
+                self.opened_at = now
+            return
+        if self.opened_at is not None:
+            return  # Started before the breaker opened
+
+        self.outcomes.append((now, ok))
+        while self.outcomes and now - self.outcomes[0][0] > AI_BREAKER_WINDOW_SECONDS:
+            self.outcomes.popleft()
+        failures = sum(1 for _, outcome in self.outcomes if not outcome)
+        if len(self.outcomes) >= AI_BREAKER_MIN_CALLS and failures / len(self.outcomes) >= AI_BREAKER_ERROR_RATE:
+            logger.warning("AI circuit opened model=%s failures=%d/%d", self.model, failures, len(self.outcomes))
+            self.opened_at = now
+
+
+_ai_breakers = {}
+
+
+def ai_breaker(model: str) -> CircuitBreaker:
+    breaker = _ai_breakers.get(model)
+    if breaker is None:
+        breaker = _ai_breakers[model] = CircuitBreaker(model)
+    return breaker
+
+
+def ai_deadline_remaining() -> Optional[float]:
+    deadline = _ai_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_retryable_ai_error(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    delay = random.uniform(0, min(AI_RETRY_MAX_SECONDS, AI_RETRY_BASE_SECONDS * 2 ** attempt))
+    if isinstance(error, openai.RateLimitError):
+        try:
+            delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return delay
+
+
+async def _call_model_with_retries(model: str, request):
+    breaker = ai_breaker(model)
+    error = None
+    record = _ai_call_record.get()
+    for attempt in range(AI_MAX_RETRIES + 1):
+        mode = breaker.allow()
+        if mode is None:
+            raise AIModelUnavailable(f"{model} circuit is open")
+        if record is not None:
+            record["attempts"] += 1
+
+        async with model_slot(model):
+            # Waiting for a slot is not the model's fault, so the attempt timeout starts here
+            timeout = AI_ATTEMPT_TIMEOUT_SECONDS.get(model, AI_DEFAULT_ATTEMPT_TIMEOUT_SECONDS)
+            remaining = ai_deadline_remaining()
+            if remaining is not None:
+                if remaining < 1:
+                    raise HTTPException(status_code=504, detail=AI_DEADLINE_DETAIL)
+                timeout = min(timeout, remaining)
+            try:
+                result = await asyncio.wait_for(request(model, timeout), timeout)
+            except Exception as e:
+                if not is_retryable_ai_error(e):
+                    breaker.record(True, mode)  # The provider answered; the request itself was bad
+                    raise
+                breaker.record(False, mode)
+                error = e
+            else:
+                breaker.record(True, mode)
+                return result
+
+        logger.warning("AI call failed model=%s attempt=%d/%d: %s: %s",
+                       model, attempt + 1, AI_MAX_RETRIES + 1, type(error).__name__, error)
+        if attempt == AI_MAX_RETRIES:
+            break
+        delay = _retry_delay(error, attempt)
+        remaining = ai_deadline_remaining()
+        if remaining is not None and delay >= remaining - 1:
+            break
+        await asyncio.sleep(delay)
+    raise AIModelUnavailable(f"{model}: {type(error).__name__}: {error}")
+
+
+async def call_ai_model(model: str, request, hedge: bool = False, streamed: bool = False):
+    """
+    Run request(model_name, timeout) with retries, the model's circuit breaker and its
+    fallback model. request must be safe to repeat, and with hedge also to run twice
+    at once. Raises HTTPException 503 when no model could answer and 504 past the deadline.
+    """
+    fallback = AI_FALLBACK_MODELS.get(model) or None
+    hedge_after = AI_HEDGE_AFTER_SECONDS if hedge and fallback and AI_HEDGE_AFTER_SECONDS > 0 else None
+    record = start_ai_call(model, streamed)
+    record_token = _ai_call_record.set(record)
+    models = {}
+
+    def start(model_name: str):
+        task = asyncio.ensure_future(_call_model_with_retries(model_name, request))
+        models[task] = model_name
+        pending.add(task)
+
+    pending = set()
+    start(model)
+    error = None
+    outcome = "unavailable"
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info("AI call hedged model=%s fallback=%s after=%.1fs", model, fallback, hedge_after)
+                start(fallback)
+                fallback = hedge_after = None
+                continue
+            for task in done:
+                if task.exception() is None:
+                    record["model_used"] = models[task]
+                    outcome = "ok"
+                    return task.result()
+                error = task.exception()
+            if not isinstance(error, AIModelUnavailable):
+                outcome = "deadline" if getattr(error, "status_code", None) == 504 else "error"
+                raise error
+            if fallback and not pending:
+                logger.warning("AI call falling back model=%s fallback=%s: %s", model, fallback, error)
+                start(fallback)
+                fallback = hedge_after = None
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        for task in pending:
+            task.cancel()
+        _ai_call_record.reset(record_token)
+        finish_ai_call(record, outcome)
+
+    logger.error("AI call unavailable model=%s: %s", model, error)
+    raise HTTPException(status_code=503, detail=AI_UNAVAILABLE_DETAIL)
+
+
+class RefundableCharge:
+    """
+    Credit hook for synchronous AI requests: wraps the request's charge function and
+    keeps count of what it deducted, so refund() can give it back if the request fails.
+    """
+
+    def __init__(self, user: dict, charge):
+        self.user = user
+        self.charge = charge
+        self.charged = 0
+
+    async def __call__(self, feature: str) -> dict:
+        self.user = await self.charge(feature)
+        self.charged += CREDIT_COSTS.get(feature, 1)
+        return self.user
+
+    async def refund(self, reason: str):
+        amount, self.charged = self.charged, 0
+        if not amount:
+            return
+        try:
+            self.user = await refund_credits(self.user, amount, reason)
+        except PyMongoError as e:
+            logger.error("Credit refund failed user=%s amount=%d: %s", self.user["id"], amount, e)
+
+
+def guarded_ai_pipeline(kind: str, pipeline):
+    """
+    Wrap an AI pipeline for a synchronous request: it runs within AI_DEADLINE_SECONDS[kind]
+    and any credits it charged are refunded if it fails or times out. AI jobs use the
+    pipelines directly and refund through their own RefundableCharge.
+    """
+    async def run(user: dict, body: dict, charge, emit=None) -> dict:
+        charge = RefundableCharge(user, charge)
+        budget = AI_DEADLINE_SECONDS[kind]
+        token = _ai_deadline.set(time.monotonic() + budget)
+        try:
+            with ai_usage_scope(kind, user):
+                return await asyncio.wait_for(pipeline(user, body, charge, emit=emit), budget)
+        except asyncio.TimeoutError:
+            await charge.refund(f"{kind} timed out")
+            raise HTTPException(status_code=504, detail=AI_DEADLINE_DETAIL)
+        except Exception as e:
+            await charge.refund(f"{kind} failed: {getattr(e, 'detail', None) or type(e).__name__}")
+            raise
+        finally:
+            _ai_deadline.reset(token)
+
+    return run
+
+
+# ===================== STREAMING AI RESPONSES =====================
+
+# AI endpoints stream when called with ?stream=1 or "Accept: text/event-stream".
+# Events: "field" (a top-level recipe field is complete), "ingredient" (one list
+# item is complete), "reset" (a retry started; clear the form), "done" (the same
+# body the JSON endpoint returns) and "error" ({"status", "detail"}).
+
+class StreamingJSONObject:
+    """
+    Incremental parser for the JSON object in a streamed completion. Calls
+    emit("field", ...) as each top-level field completes and emit(<item_event>, ...)
+    for each element of the item_field array. Text before the opening brace
+    (a markdown fence) is skipped; anything malformed is left to the final json.loads.
+    """
+
+    def __init__(self, emit, item_field: str = "ingredients", item_event: str = "ingredient"):
+        self.emit = emit
+        self.item_field = item_field
+        self.item_event = item_event
+        self.buf = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = True
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, chunk: str):
+        self.buf += chunk
+        while self.pos < len(self.buf) and not self.done:
+            self._step(self.buf[self.pos])
+            self.pos += 1
+
+    def _step(self, ch: str):
+        i = self.pos
+        if not self.started:
+            if ch == "{":
+                self.started, self.depth = True, 1
+            return
+
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.depth == 1 and self.expect_key:
+                    self.key = json.loads(self.buf[self.key_start:i + 1])
+            return
+
+        if ch == '"':
+            self.in_string = True
+            if self.depth == 1 and self.expect_key:
+                self.key_start = i
+            elif self.depth == 1 and self.value_start is None:
+                self.value_start = i
+            return
+
+        if self.depth == 1:
+            if ch == ":" and self.expect_key:
+                self.expect_key, self.value_start = False, None
+            elif ch in ",}":
+                if not self.expect_key and self.value_start is not None:
+                    value = self._loads(self.buf[self.value_start:i])
+                    if value is not self.INVALID:
+                        self.emit("field", {"name": self.key, "value": value})
+                self.expect_key, self.value_start = True, None
+                if ch == "}":
+                    self.depth, self.done = 0, True
+            elif ch in "[{":
+                if self.value_start is None:
+                    self.value_start = i
+                self.depth += 1
+                if ch == "[" and self.key == self.item_field:
+                    self.item_start, self.item_index = i + 1, 0
+            elif not ch.isspace() and not self.expect_key and self.value_start is None:
+                self.value_start = i  # Number, true, false or null
+            return
+
+        if self.depth == 2 and self.item_start is not None and ch in ",]":
+            item = self._loads(self.buf[self.item_start:i])
+            if item is not self.INVALID:
+                self.emit(self.item_event, {"index": self.item_index, "value": item})
+                self.item_index += 1
+            self.item_start = i + 1 if ch == "," else None
+        if ch in "[{":
+            self.depth += 1
+        elif ch in "]}":
+            self.depth -= 1
+
+    INVALID = object()
+
+    def _loads(self, text: str):
+        text = text.strip()
+        if not text:
+            return self.INVALID
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return self.INVALID
+
+
+async def complete_ai_text(model: str, messages: list, max_tokens: int, temperature: float, emit=None) -> str:
+    """
+    Run a chat completion through call_ai_model and return the stripped text. With emit,
+    the completion is streamed and recipe fields are reported as soon as each one is
+    complete; a retried stream first emits "reset" so clients drop the earlier fields.
+    """
+    if emit is None:
+        async def request(model_name: str, timeout: float) -> str:
+            response = await openai_client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout,
+            )
+            note_ai_tokens(response.usage)
+            return response.choices[0].message.content.strip()
+
+        return await call_ai_model(model, request, hedge=True)
+
+    attempts = []
+
+    async def stream_request(model_name: str, timeout: float) -> str:
+        if attempts:
+            emit("reset", {"reason": "Retrying after an upstream error"})
+        attempts.append(model_name)
+        parser = StreamingJSONObject(emit)
+        parts = []
+        stream = await openai_client.chat.completions.create(
+            model=model_name,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+        )
+        async for chunk in stream:
+            note_ai_tokens(getattr(chunk, "usage", None))
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                parser.feed(delta)
+        return "".join(parts).strip()
+
+    return await call_ai_model(model, stream_request, streamed=True)
+
+
+def strip_json_fences(text: str) -> str:
+    """Remove the markdown code fence models sometimes wrap JSON in."""
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+        if text.endswith("```"):
+            text = text[:-3]
+        text = text.strip()
+    return text
+
+
+def routed_models(task: str) -> list:
+    """The models to try for a task, in order: its routed model, then its escalation model."""
+    route = AI_MODEL_ROUTES[task]
+    models = [route["model"]]
+    if route["escalate_to"] and route["escalate_to"] != route["model"]:
+        models.append(route["escalate_to"])
+    return models
+
+
+async def complete_ai_json(task: str, messages: list, temperature: float, validate=None, emit=None):
+    """
+    Run a JSON-producing prompt on the task's routed model and parse the answer.
+    If parsing or validate(data) fails, the prompt is retried once on the escalation
+    model; the last attempt's json.JSONDecodeError or ValueError propagates.
+    """
+    models = routed_models(task)
+    for attempt, model in enumerate(models):
+        if emit and attempt > 0:
+            emit("reset", {"reason": "Retrying with a larger model"})
+        result_text = await complete_ai_text(
+            model, messages, max_tokens=AI_MODEL_ROUTES[task]["max_tokens"], temperature=temperature, emit=emit,
+        )
+        try:
+            data = json.loads(strip_json_fences(result_text))
+            if validate:
+                validate(data)
+            return data
+        except (json.JSONDecodeError, ValueError) as e:
+            if attempt == len(models) - 1:
+                raise
+            logger.info("AI %s answer from %s failed validation, escalating to %s: %s", task, model, models[attempt + 1], e)
+
+
+def require_recipe_fields(data, fields=("title", "ingredients", "instructions")):
+    """Raise ValueError unless data is an object with every field present and non-empty."""
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    for field in fields:
+        if not data.get(field):
+            raise ValueError(f"Missing required field: {field}")
+
+
+def wants_event_stream(request: Request) -> bool:
+    return (
+        request.query_params.get("stream", "").lower() in ("1", "true")
+        or "text/event-stream" in request.headers.get("accept", "")
+    )
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def stream_ai_pipeline(pipeline, user: dict, body: dict, charge) -> StreamingResponse:
+    """
+    Run an AI pipeline in the background and relay its progress as Server-Sent Events.
+    The pipeline keeps running if the client disconnects, since its credit is already spent.
+    """
+    queue = asyncio.Queue()
+
+    def emit(event: str, data):
+        queue.put_nowait((event, data))
+
+    async def run():
+        try:
+            emit("done", await pipeline(user, body, charge, emit=emit))
+        except HTTPException as e:
+            emit("error", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error("Streaming AI pipeline error: %s", e)
+            emit("error", {"status": 500, "detail": "AI processing failed"})
+        finally:
+            queue.put_nowait(None)
+
+    async def event_stream():
+        asyncio.ensure_future(run())
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            yield sse_event(*item)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ===================== AI RESULT CACHE =====================
+
+# Scan results are keyed by a SHA-256 of the decoded image bytes, so the same
+# card rescanned after a failed save (or from a second device) is answered from
+# MongoDB instead of paying for another GPT-4o call and another credit.
+SCAN_CACHE_COLLECTION = "ai_scan_cache"
+SCAN_CACHE_TTL_SECONDS = int(os.environ.get("SCAN_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))  # 30 days
+SCAN_CACHE_MAX_ENTRIES = int(os.environ.get("SCAN_CACHE_MAX_ENTRIES", "50000"))
+# When enabled, a scan by any member of a family is reused by the whole family
+SCAN_CACHE_SHARE_WITH_FAMILY = os.environ.get("SCAN_CACHE_SHARE_WITH_FAMILY", "true").lower() == "true"
+
+# Link imports use two levels: fetched page/oEmbed metadata (short TTL, pages
+# change) and the structured recipe built from it (long TTL). Both are keyed by
+# the canonical URL, so a viral video shared by many families costs one fetch
+# and one model call.
+LINK_META_CACHE_COLLECTION = "ai_link_meta_cache"
+LINK_META_CACHE_TTL_SECONDS = int(os.environ.get("LINK_META_CACHE_TTL_SECONDS", str(3600)))  # 1 hour
+LINK_RECIPE_CACHE_COLLECTION = "ai_link_recipe_cache"
+LINK_RECIPE_CACHE_TTL_SECONDS = int(os.environ.get("LINK_RECIPE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))  # 30 days
+LINK_CACHE_MAX_ENTRIES = int(os.environ.get("LINK_CACHE_MAX_ENTRIES", "20000"))
+
+AI_CACHE_COLLECTIONS = [SCAN_CACHE_COLLECTION, LINK_META_CACHE_COLLECTION, LINK_RECIPE_CACHE_COLLECTION]
+
+# In-process hit/miss counters per cache collection (reset on restart)
+_ai_cache_stats = {}
+
+
+async def ensure_ai_cache_indexes():
+    """Create lookup, LRU and TTL indexes for the AI result caches."""
+    for name in AI_CACHE_COLLECTIONS:
+        await db[name].create_index("key", unique=True)
+        await db[name].create_index("last_used_at")
+        # TTL index: MongoDB removes entries once expires_at (a BSON date) has passed
+        await db[name].create_index("expires_at", expireAfterSeconds=0)
+
+
+def _ai_cache_counters(collection: str) -> dict:
+    return _ai_cache_stats.setdefault(collection, {"hits": 0, "misses": 0})
+
+
+async def ai_cache_get(collection: str, key: str) -> Optional[dict]:
+    """Return the cached value for key (and mark it recently used), or None."""
+    now = datetime.now(timezone.utc)
+    doc = await db[collection].find_one_and_update(
+        {"key": key, "expires_at": {"$gt": now}},
+        {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+        projection={"_id": 0, "value": 1},
+    )
+    counters = _ai_cache_counters(collection)
+    if doc is None:
+        counters["misses"] += 1
+        return None
+    counters["hits"] += 1
+    return doc["value"]
+
+
+async def ai_cache_put(collection: str, key: str, value: dict, ttl_seconds: int, max_entries: int):
+    """Store value under key, then evict least-recently-used entries over max_entries."""
+    now = datetime.now(timezone.utc)
+    await db[collection].update_one(
+        {"key": key},
+        {
+            "$set": {
+                "value": value,
+                "created_at": now,
+                "last_used_at": now,
+                "expires_at": now + timedelta(seconds=ttl_seconds),
+            },
+            "$setOnInsert": {"hits": 0},
+        },
+        upsert=True,
+    )
+
+    # estimated_document_count reads collection metadata, so this stays cheap
+    excess = await db[collection].estimated_document_count() - max_entries
+    if excess > 0:
+        stale = await db[collection].find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess).to_list(excess)
+        if stale:
+            await db[collection].delete_many({"_id": {"$in": [d["_id"] for d in stale]}})
+            logger.info("AI cache eviction: collection=%s evicted=%d", collection, len(stale))
+
+
+def decode_image_b64(image_b64: str) -> bytes:
+    """Decode an uploaded base64 image. Raises HTTPException if it is not valid base64."""
+    try:
+        # Decoding normalizes away line breaks and padding differences
+        return base64.b64decode("".join(image_b64.split()), validate=True)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid image data")
+
+
+def scan_cache_key(user: dict, image_bytes: bytes) -> str:
+    """Build the scan cache key from the decoded image bytes."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+
+    family_id = user.get("family_id")
+    if SCAN_CACHE_SHARE_WITH_FAMILY and family_id:
+        return f"family:{family_id}:{digest}"
+    return f"user:{user['id']}:{digest}"
+
+
+# In-flight work shared by concurrent requests with the same key
+_inflight_tasks = {}
+
+
+async def coalesced(key: str, factory):
+    """
+    Run factory() once per key; concurrent callers with the same key await the same result.
+    The shared task is shielded so one caller disconnecting does not cancel it for the others.
+    """
+    task = _inflight_tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight_tasks[key] = task
+
+        def _done(t, _key=key):
+            _inflight_tasks.pop(_key, None)
+            if not t.cancelled():
+                t.exception()  # Mark retrieved even if every waiter has gone away
+
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
+
+@api_router.get("/ai/cache/stats")
+async def get_ai_cache_stats(user: dict = Depends(get_current_user)):
+    """Report hit/miss counters and entry counts for the AI result caches (admin only)."""
+    if not is_admin_user(user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    caches = {}
+    for name in AI_CACHE_COLLECTIONS:
+        counters = _ai_cache_counters(name)
+        lookups = counters["hits"] + counters["misses"]
+        caches[name] = {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+            "entries": await db[name].estimated_document_count(),
+        }
+    return {"caches": caches}
+
+
+# ===================== SCAN IMAGE PREPROCESSING =====================
+
+# Phone uploads (often 12MP JPEGs) are rotated, cropped, downscaled and
+# recompressed before the vision call. The CPU work runs in a process pool;
+# imaging.py has no side effects, so spawned workers import only that module.
+SCAN_PREPROCESS_ENABLED = os.environ.get("SCAN_PREPROCESS_ENABLED", "true").lower() == "true"
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# Profiles tried in order; the next one is used only after a low-confidence parse
+SCAN_PROFILE_SEQUENCE = ["standard", "detail"]
+# A parse with fewer ingredients than this is treated as low confidence
+SCAN_MIN_CONFIDENT_INGREDIENTS = 2
+
+_image_pool = None
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _image_pool
+
+
+# ---- Quality gate ----
+
+# Dark, blurry or empty photos are turned away before they cost a credit or a model
+# call. Thresholds live in imaging.SCAN_QUALITY_THRESHOLDS and can be overridden
+# with a JSON object in SCAN_QUALITY_THRESHOLDS, e.g. {"blur_reject": 20}.
+SCAN_QUALITY_CHECK_ENABLED = os.environ.get("SCAN_QUALITY_CHECK_ENABLED", "true").lower() == "true"
+SCAN_QUALITY_THRESHOLD_OVERRIDES = json.loads(os.environ.get("SCAN_QUALITY_THRESHOLDS", "{}"))
+
+SCAN_QUALITY_MESSAGES = {
+    "too_dark": "This photo is too dark to read. Add more light or use the flash and try again.",
+    "overexposed": "This photo is washed out. Avoid glare or direct light on the card and try again.",
+    "no_content": "We couldn't find a recipe in this photo. Make sure the card fills most of the frame.",
+    "too_blurry": "This photo is too blurry to read. Hold the phone steady, tap to focus and try again.",
+    "no_text": "We couldn't find any writing in this photo. Make sure the recipe is in the frame.",
+}
+
+
+async def check_scan_quality(image_bytes: bytes) -> Optional[dict]:
+    """
+    Run the quality checks in the image pool. Raises a 422 for a rejected photo;
+    returns the assessment otherwise, or None when the image could not be checked.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        quality = await loop.run_in_executor(
+            get_image_pool(), assess_scan_image, image_bytes, SCAN_QUALITY_THRESHOLD_OVERRIDES,
+        )
+    except Exception as e:
+        # The vision model reads formats PIL cannot, so an unchecked image still goes through
+        logger.warning("Scan quality check failed, skipping: %s", e)
+        return None
+
+    logger.info(
+        "Scan quality verdict=%s issues=%s metrics=%s timings_ms=%s",
+        quality["verdict"], quality["rejected"] + quality["warnings"], quality["metrics"], quality["timings_ms"],
+    )
+    if quality["verdict"] == "reject":
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "error": "image_quality",
+                "issues": quality["rejected"],
+                "message": SCAN_QUALITY_MESSAGES[quality["rejected"][0]],
+                "quality": quality,
+            },
+        )
+    return quality
+
+
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+
+async def prepare_scan_image(image_bytes: bytes, media_type: str, image_b64: Optional[str], profile: Optional[str]) -> dict:
+    """
+    Return {"b64", "media_type", "detail"} for the vision call. Falls back to the
+    original upload when preprocessing is disabled or the image cannot be decoded.
+    """
+    def original() -> dict:
+        b64 = image_b64 if image_b64 is not None else base64.b64encode(image_bytes).decode("ascii")
+        return {"b64": b64, "media_type": media_type, "detail": "high"}
+
+    if not profile:
+        return original()
+
+    loop = asyncio.get_running_loop()
+    try:
+        prepared = await loop.run_in_executor(get_image_pool(), preprocess_scan_image, image_bytes, profile)
+    except Exception as e:
+        logger.warning("Scan preprocessing failed profile=%s, sending original: %s", profile, e)
+        return original()
+
+    logger.info(
+        "Scan preprocessed profile=%s bytes=%d->%d size=%dx%d->%dx%d est_tokens=%d->%d elapsed_ms=%.1f",
+        profile, prepared["original_bytes"], prepared["bytes"],
+        prepared["original_width"], prepared["original_height"], prepared["width"], prepared["height"],
+        estimate_vision_tokens(prepared["original_width"], prepared["original_height"]),
+        estimate_vision_tokens(prepared["width"], prepared["height"], prepared["detail"]),
+        prepared["elapsed_ms"],
+    )
+    return {
+        "b64": base64.b64encode(prepared["data"]).decode("ascii"),
+        "media_type": prepared["media_type"],
+        "detail": prepared["detail"],
+    }
+
+
+# ===================== AI RECIPE SCANNER (Milestone 2.1) =====================
+
+RECIPE_SCAN_PROMPT = """You are a recipe extraction assistant for a family recipe app called Legacy Table.
+Analyze this image of a recipe (handwritten, printed, or from a book/card) and extract the following structured data.
+
+Return ONLY valid JSON with these exact keys:
+{
+  "title": "Recipe title",
+  "ingredients": ["ingredient 1 with quantity", "ingredient 2 with quantity", ...],
+  "instructions": "Full cooking instructions as a single string with paragraph breaks",
+  "cooking_time": 30,
+  "servings": 4,
+  "category": "Main Course",
+  "difficulty": "easy",
+  "story": "Any personal notes, history, or story visible on the recipe card (or null if none)"
+}
+
+Rules:
+- cooking_time is in minutes (integer). Estimate if not stated.
+- servings is an integer. Estimate if not stated (default 4).
+- category must be one of: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, Beverage
+- difficulty must be one of: easy, medium, hard (estimate based on complexity)
+- Keep ingredients as a clean list with quantities
+- Instructions should be clear, readable paragraphs
+- If you see a story, family note, or dedication on the card, capture it in "story"
+- Return ONLY the JSON object, no markdown, no explanation"""
+
+# Appended to the scan prompt for pages of a batch scan
+BATCH_PAGE_SCAN_RULES = """
+
+This image is one page of a multi-page batch (a cookbook or a stack of recipe cards). Also return "continues_previous": true if the page continues a recipe from the previous page instead of starting a new one (for example the back of a card, or a page that starts mid-ingredient-list or mid-instructions without a recipe title), otherwise false. A continuation page may leave "title" empty and only include the ingredients and instructions visible on it."""
+
+
+async def run_recipe_scan(user: dict, body: dict, charge, emit=None) -> dict:
+    """
+    Scan pipeline shared by the endpoint and the AI job queue.
+    charge(feature) is awaited right before paid work and returns the updated user.
+    emit(event, data), when given, streams recipe fields as the model produces them.
+    """
+    image_data = body.get("image")  # Base64 data URL
+    if not image_data:
+        raise HTTPException(status_code=400, detail="No image provided")
+
+    image_data_b64, media_type = split_image_data_url(image_data)
+    image_bytes = decode_image_b64(image_data_b64)
+    return await scan_recipe_image(
+        user, image_bytes, media_type, charge, emit=emit, image_b64=image_data_b64,
+        # Lets the user send a photo the quality gate rejected anyway
+        check_quality=not body.get("skip_quality_check"),
+    )
+
+
+def split_image_data_url(image_data: str):
+    """Return (base64 payload, media type) for a data URL or a bare base64 string."""
+    # Handle data URL format: strip prefix if present
+    if image_data.startswith("data:"):
+        # e.g., data:image/jpeg;base64,/9j/4AAQ...
+        image_data_b64 = image_data.split(",", 1)[1] if "," in image_data else image_data
+        media_type = image_data.split(";")[0].split(":")[1] if ";" in image_data else "image/jpeg"
+    else:
+        image_data_b64 = image_data
+        media_type = "image/jpeg"
+    return image_data_b64, media_type
+
+
+async def scan_recipe_image(
+    user: dict,
+    image_bytes: bytes,
+    media_type: str,
+    charge,
+    emit=None,
+    image_b64: Optional[str] = None,
+    batch_page: bool = False,
+    check_quality: bool = True,
+) -> dict:
+    """
+    Scan one decoded image. With batch_page, the model also reports whether the page
+    continues the previous one, and continuation pages may omit the title.
+    Unless check_quality is off, unreadable photos are rejected before charging.
+    """
+    # Rescans of the same card are served from cache without charging a credit
+    cache_key = scan_cache_key(user, image_bytes) + (":page" if batch_page else "")
+    cached_recipe = await ai_cache_get(SCAN_CACHE_COLLECTION, cache_key)
+    if cached_recipe is not None:
+        user = await refresh_credits_if_needed(user)
+        logger.info("AI recipe scan cache hit: user=%s", user["id"])
+        return {
+            "success": True,
+            "recipe": cached_recipe,
+            "cached": True,
+            "credits_remaining": user.get("credits_balance", 0),
+        }
+
+    quality = await check_scan_quality(image_bytes) if SCAN_QUALITY_CHECK_ENABLED and check_quality else None
+
+    # Consume credit
+    user = await charge("recipe_scan")
+
+    profiles = SCAN_PROFILE_SEQUENCE if SCAN_PREPROCESS_ENABLED else [None]
+    prompt = RECIPE_SCAN_PROMPT + BATCH_PAGE_SCAN_RULES if batch_page else RECIPE_SCAN_PROMPT
+    fallback = None
+    try:
+        for attempt, profile in enumerate(profiles):
+            is_last = attempt == len(profiles) - 1
+            prepared = await prepare_scan_image(image_bytes, media_type, image_b64, profile)
+            if emit and attempt > 0:
+                emit("reset", {"reason": "Retrying at higher detail"})
+
+            # The higher-detail retry also moves to the escalation model, when one is routed
+            scan_models = routed_models("scan")
+            result_text = await complete_ai_text(
+                scan_models[min(attempt, len(scan_models) - 1)],
+                [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{prepared['media_type']};base64,{prepared['b64']}",
+                                    "detail": prepared["detail"],
+                                },
+                            },
+                        ],
+                    }
+                ],
+                max_tokens=AI_MODEL_ROUTES["scan"]["max_tokens"],
+                temperature=0.1,
+                emit=emit,
+            )
+
+            # Parse JSON — strip markdown fences if present
+            result_text = strip_json_fences(result_text)
+
+            # A failed or thin parse is retried once at higher detail before giving up
+            try:
+                recipe_data = json.loads(result_text)
+
+                # Validate required fields
+                continuation = batch_page and recipe_data.get("continues_previous") is True
+                if continuation:
+                    if not recipe_data.get("ingredients") and not recipe_data.get("instructions"):
+                        raise ValueError("Continuation page has no ingredients or instructions")
+                else:
+                    required = ["title", "ingredients", "instructions"]
+                    for field in required:
+                        if field not in recipe_data or not recipe_data[field]:
+                            raise ValueError(f"Missing required field: {field}")
+            except (json.JSONDecodeError, ValueError) as e:
+                if is_last and fallback is None:
+                    raise
+                if is_last:
+                    recipe_data = fallback
+                    break
+                logger.info("AI recipe scan low-confidence parse profile=%s, retrying at higher detail: %s", profile, e)
+                continue
+
+            # A continuation page often carries only instructions
+            if continuation or len(recipe_data["ingredients"]) >= SCAN_MIN_CONFIDENT_INGREDIENTS or is_last:
+                break
+            fallback = recipe_data
+            logger.info("AI recipe scan found %d ingredients profile=%s, retrying at higher detail",
+                        len(recipe_data["ingredients"]), profile)
+
+        # Set defaults for optional fields
+        recipe_data.setdefault("cooking_time", 30)
+        recipe_data.setdefault("servings", 4)
+        recipe_data.setdefault("category", "Main Course")
+        recipe_data.setdefault("difficulty", "easy")
+        recipe_data.setdefault("story", None)
+
+    except json.JSONDecodeError as e:
+        logger.error("AI recipe scan JSON parse error: %s", e)
+        raise HTTPException(status_code=422, detail="AI could not parse this image into a recipe. Try a clearer photo.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("AI recipe scan error: %s", e)
+        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+
+    try:
+        await ai_cache_put(
+            SCAN_CACHE_COLLECTION, cache_key, recipe_data,
+            ttl_seconds=SCAN_CACHE_TTL_SECONDS, max_entries=SCAN_CACHE_MAX_ENTRIES,
+        )
+    except PyMongoError as e:
+        # A cache write failure must not lose a scan the user already paid for
+        logger.warning("AI recipe scan cache write failed: %s", e)
+
+    return {
+        "success": True,
+        "recipe": recipe_data,
+        "cached": False,
+        "quality_warnings": quality["warnings"] if quality else [],
+        "credits_remaining": user.get("credits_balance", 0),
+    }
+
+
+@api_router.post("/ai/scan-recipe")
+async def scan_recipe(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Scan a photo of a recipe and extract structured data using GPT-4 Vision."""
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="AI features are not configured")
+
+    user = await get_current_user(credentials)
+    body = await request.json()
+    charge = partial(consume_credit, user)
+    pipeline = guarded_ai_pipeline("recipe_scan", run_recipe_scan)
+    if wants_event_stream(request):
+        return stream_ai_pipeline(pipeline, user, body, charge)
+    return await pipeline(user, body, charge)
+
+
+# ---- Batch scanning ----
+
+BATCH_SCAN_MAX_PAGES = int(os.environ.get("BATCH_SCAN_MAX_PAGES", "50"))
+BATCH_SCAN_CONCURRENCY = int(os.environ.get("BATCH_SCAN_CONCURRENCY", "4"))
+BATCH_SCAN_MAX_UPLOAD_BYTES = int(os.environ.get("BATCH_SCAN_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+
+async def read_batch_scan_pages(request: Request) -> tuple:
+    """
+    Read batch pages from a multipart upload (repeated "images" files, sent at full
+    resolution without base64) or a JSON body {"pages": [...]} where each page is a
+    data URL or {"image": data URL, "continues_previous": bool}.
+    Returns ([{"image_bytes", "upload", "media_type", "continues_previous"}] in page order,
+    form). Multipart pages stay in their spooled upload ("upload") until they are scanned;
+    the caller closes form (None for JSON).
+    """
+    pages, form = [], None
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await parse_capped_multipart(
+            request,
+            BATCH_SCAN_MAX_UPLOAD_BYTES,
+            f"Batch too large. Maximum upload is {BATCH_SCAN_MAX_UPLOAD_BYTES // (1024 * 1024)}MB.",
+            max_files=BATCH_SCAN_MAX_PAGES,
+        )
+        for upload in form.getlist("images"):
+            if isinstance(upload, StarletteUploadFile):
+                pages.append({
+                    "image_bytes": None,
+                    "upload": upload,
+                    "media_type": upload.content_type or "image/jpeg",
+                    "continues_previous": None,
+                })
+    else:
+        body = await request.json()
+        for page in body.get("pages") or body.get("images") or []:
+            if isinstance(page, str):
+                page = {"image": page}
+            if not isinstance(page, dict) or not page.get("image"):
+                raise HTTPException(status_code=400, detail="Each page needs an image")
+            image_b64, media_type = split_image_data_url(page["image"])
+            pages.append({
+                "image_bytes": decode_image_b64(image_b64),
+                "upload": None,
+                "media_type": media_type,
+                "continues_previous": page.get("continues_previous"),
+            })
+
+    error = ("No images provided" if not pages
+             else f"A batch can have at most {BATCH_SCAN_MAX_PAGES} pages" if len(pages) > BATCH_SCAN_MAX_PAGES
+             else None)
+    if error:
+        if form is not None:
+            await form.close()
+        raise HTTPException(status_code=400, detail=error)
+    return pages, form
+
+
+def merge_batch_pages(results: list) -> list:
+    """
+    Combine per-page results (in page order) into recipes. A page that continues the
+    previous one is folded into that page's recipe; a gap left by a failed page
+    always starts a new recipe.
+    """
+    recipes = []
+    for page in results:
+        if page["status"] != "ok":
+            continue
+        recipe = dict(page["recipe"])
+        previous = recipes[-1] if recipes else None
+
+        if page["continues_previous"] and previous and previous["pages"][-1] == page["index"] - 1:
+            previous["ingredients"] = list(previous.get("ingredients") or []) + [
+                item for item in recipe.get("ingredients") or [] if item not in (previous.get("ingredients") or [])
+            ]
+            previous["instructions"] = "\n\n".join(
+                part for part in (previous.get("instructions"), recipe.get("instructions")) if part
+            )
+            previous["story"] = "\n\n".join(part for part in (previous.get("story"), recipe.get("story")) if part) or None
+            if not previous.get("title"):
+                previous["title"] = recipe.get("title")
+            previous["pages"].append(page["index"])
+            continue
+
+        recipe["pages"] = [page["index"]]
+        recipes.append(recipe)
+
+    for recipe in recipes:
+        if not recipe.get("title"):
+            recipe["title"] = "Untitled Recipe"
+    return recipes
+
+
+async def run_batch_scan(user: dict, pages: list, emit=None) -> dict:
+    """
+    Scan every page concurrently under a per-request semaphore. Credits for all pages
+    are reserved in one atomic update; pages served from cache or that fail are refunded.
+    """
+    cost = CREDIT_COSTS["recipe_scan"]
+    user = await reserve_credits(user, "recipe_scan", len(pages))
+    charged = [False] * len(pages)
+    results = [None] * len(pages)
+    semaphore = asyncio.Semaphore(BATCH_SCAN_CONCURRENCY)
+
+    async def scan_page(index: int):
+        page = pages[index]
+
+        async def charge(feature: str) -> dict:
+            charged[index] = True  # Already paid for by the batch reservation
+            return user
+
+        async with semaphore:
+            try:
+                image_bytes = page["image_bytes"]
+                if page["upload"] is not None:
+                    # Read under the semaphore, so only the pages being scanned are in memory
+                    image_bytes = await page["upload"].read()
+                    await page["upload"].close()
+                result = await scan_recipe_image(user, image_bytes, page["media_type"], charge, batch_page=True)
+                recipe = dict(result["recipe"])
+                detected = bool(recipe.pop("continues_previous", False))
+                continues = page["continues_previous"] if page["continues_previous"] is not None else detected
+                outcome = {
+                    "index": index, "status": "ok", "recipe": recipe,
+                    "continues_previous": bool(continues), "cached": result["cached"],
+                }
+            except HTTPException as e:
+                charged[index] = False
+                outcome = {"index": index, "status": "failed", "error": e.detail}
+            except BaseException:
+                charged[index] = False  # Crashed or cancelled along with the batch
+                raise
+            finally:
+                page["image_bytes"] = None  # Let the upload go as soon as its page is done
+
+        results[index] = outcome
+        if emit:
+            emit("page", outcome)
+
+    tasks = [asyncio.create_task(scan_page(i)) for i in range(len(pages))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Stop the remaining pages before counting, or a page still running could
+        # be refunded here and then mark itself charged when it finishes
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        unused = charged.count(False)
+        if unused:
+            user = await refund_credits(user, unused * cost, "recipe_scan batch: cached or failed pages")
+
+    recipes = merge_batch_pages(results)
+    logger.info("Batch recipe scan: user=%s pages=%d recipes=%d charged=%d",
+                user["id"], len(pages), len(recipes), charged.count(True))
+    return {
+        "success": True,
+        "recipes": recipes,
+        "pages": results,
+        "credits_charged": charged.count(True) * cost,
+        "credits_remaining": user.get("credits_balance", 0),
+    }
+
+
+@api_router.post("/ai/scan-recipes/batch")
+async def scan_recipe_batch(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Scan a stack of recipe cards or cookbook pages in one request, merging continuation pages."""
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="AI features are not configured")
+
+    user = await get_current_user(credentials)
+    pages, form = await read_batch_scan_pages(request)
+
+    async def run_pages(user: dict, body: dict, charge, emit=None) -> dict:
+        try:
+            with ai_usage_scope("batch_scan", user):
+                return await run_batch_scan(user, pages, emit)
+        finally:
+            if form is not None:
+                await form.close()
+
+    if wants_event_stream(request):
+        return stream_ai_pipeline(run_pages, user, {}, None)
+    return await run_pages(user, {}, None)
+
+
+# ===================== VOICE-TO-RECIPE (Milestone 2.2) =====================
+
+VOICE_RECIPE_PROMPT = """You are a recipe structuring assistant for a family recipe app called Legacy Table.
+The user dictated a recipe by voice. The transcription is below. Extract and structure it into a clean recipe.
+
+Return ONLY valid JSON with these exact keys:
+{
+  "title": "Recipe title (infer from context if not stated)",
+  "ingredients": ["ingredient 1 with quantity", "ingredient 2 with quantity", ...],
+  "instructions": "Full cooking instructions as a single string with paragraph breaks",
+  "cooking_time": 30,
+  "servings": 4,
+  "category": "Main Course",
+  "difficulty": "easy",
+  "story": "Any personal story or context the speaker mentioned (or null)"
+}
+
+Rules:
+- Clean up filler words (um, uh, like, you know) from instructions
+- Organize rambling narration into clear step-by-step instructions
+- Extract ingredient quantities even if stated informally ("about two cups of flour" → "2 cups flour")
+- cooking_time in minutes, servings as integer
+- category: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, or Beverage
+- difficulty: easy, medium, or hard
+- If the speaker shares personal stories or memories, capture them in "story"
+- Return ONLY the JSON object"""
+
+# ---- Audio uploads ----
+
+# Whisper's per-file upload limit
+WHISPER_MAX_FILE_BYTES = 25 * 1024 * 1024
+
+# Long recordings are split on silence and the segments transcribed concurrently (needs ffmpeg)
+VOICE_SEGMENTATION_ENABLED = (
+    os.environ.get("VOICE_SEGMENTATION_ENABLED", "true").lower() == "true" and ffmpeg_available()
+)
+VOICE_SEGMENT_SECONDS = float(os.environ.get("VOICE_SEGMENT_SECONDS", "120"))
+VOICE_SEGMENT_OVERLAP_SECONDS = float(os.environ.get("VOICE_SEGMENT_OVERLAP_SECONDS", "2"))
+VOICE_SEGMENT_CONCURRENCY = int(os.environ.get("VOICE_SEGMENT_CONCURRENCY", "4"))
+# Compressed recordings smaller than this (a few minutes of speech) go to Whisper in one call
+VOICE_SEGMENT_MIN_BYTES = int(os.environ.get("VOICE_SEGMENT_MIN_BYTES", str(1024 * 1024)))
+VOICE_MAX_DURATION_SECONDS = int(os.environ.get("VOICE_MAX_DURATION_SECONDS", "3600"))
+
+# With segmentation, uploads are only bounded by the request size limit
+VOICE_MAX_UPLOAD_BYTES = int(os.environ.get(
+    "VOICE_MAX_UPLOAD_BYTES",
+    str(MAX_REQUEST_BODY_SIZE if VOICE_SEGMENTATION_ENABLED else WHISPER_MAX_FILE_BYTES),
+))
+
+# Formats Whisper accepts; anything else falls back to webm (what browsers record)
+WHISPER_AUDIO_FORMATS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+
+AUDIO_CONTENT_TYPE_FORMATS = {
+    "audio/webm": "webm",
+    "video/webm": "webm",
+    "audio/mp4": "mp4",
+    "video/mp4": "mp4",
+    "audio/x-m4a": "m4a",
+    "audio/m4a": "m4a",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/ogg": "ogg",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+}
+
+
+def normalize_audio_format(audio_format: Optional[str]) -> str:
+    audio_format = (audio_format or "").lower().lstrip(".")
+    return audio_format if audio_format in WHISPER_AUDIO_FORMATS else "webm"
+
+
+def voice_too_large_detail() -> str:
+    return f"Recording too large. Maximum size is {VOICE_MAX_UPLOAD_BYTES // (1024 * 1024)}MB."
+
+
+async def read_multipart_audio(request: Request):
+    """
+    Parse a multipart upload with an "audio" file field and optional "format" field.
+    Returns (file object, format); the caller closes the file.
+    """
+    form = await parse_capped_multipart(request, VOICE_MAX_UPLOAD_BYTES, voice_too_large_detail(), max_files=1)
+    upload = form.get("audio")
+    if not isinstance(upload, StarletteUploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail="No audio provided")
+
+    audio_format = form.get("format")
+    if not isinstance(audio_format, str):
+        audio_format = None
+    if not audio_format and upload.filename and "." in upload.filename:
+        audio_format = upload.filename.rsplit(".", 1)[1]
+    if not audio_format and upload.content_type:
+        audio_format = AUDIO_CONTENT_TYPE_FORMATS.get(upload.content_type.split(";")[0].strip().lower())
+    return upload.file, normalize_audio_format(audio_format)
+
+
+# ---- Segmented transcription ----
+
+async def whisper_transcribe(audio_file, filename: str, seconds: Optional[float] = None) -> str:
+    """
+    Transcribe one file. Whisper bills by the minute, so pass the length when it is
+    known from decoding; otherwise it is read from Whisper's verbose response.
+    """
+    async def request(model_name: str, timeout: float) -> str:
+        audio_file.seek(0)  # A retry uploads the recording again from the start
+        # The extension tells Whisper the container format
+        transcript = await openai_client.audio.transcriptions.create(
+            model=model_name,
+            file=(filename, audio_file),
+            language="en",
+            response_format="json" if seconds else "verbose_json",
+            timeout=timeout,
+        )
+        note_ai_audio(seconds or getattr(transcript, "duration", None))
+        return transcript.text or ""
+
+    return await call_ai_model("whisper-1", request)
+
+
+async def transcribe_recording(audio_file, audio_format: str) -> str:
+    """
+    Transcribe a recording. Short ones go to Whisper as-is; long ones are decoded once,
+    split on pauses into overlapping segments, transcribed concurrently and stitched
+    back in order, so wall-clock time tracks segment length rather than total length.
+    """
+    audio_file.seek(0, io.SEEK_END)
+    size = audio_file.tell()
+    audio_file.seek(0)
+
+    if not VOICE_SEGMENTATION_ENABLED or size < VOICE_SEGMENT_MIN_BYTES:
+        if size > WHISPER_MAX_FILE_BYTES:
+            raise HTTPException(status_code=413, detail=voice_too_large_detail())
+        return await whisper_transcribe(audio_file, f"recording.{audio_format}")
+
+    try:
+        samples = await decode_to_pcm(audio_file, audio_format, VOICE_MAX_DURATION_SECONDS)
+    except AudioTooLong:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Recording too long. Maximum length is {VOICE_MAX_DURATION_SECONDS // 60} minutes.",
+        )
+    except (AudioDecodeError, OSError) as e:
+        logger.warning("Voice decode failed format=%s bytes=%d: %s", audio_format, size, e)
+        if size > WHISPER_MAX_FILE_BYTES:
+            raise HTTPException(status_code=422, detail="Could not read this recording. Try a different audio format.")
+        audio_file.seek(0)
+        return await whisper_transcribe(audio_file, f"recording.{audio_format}")
+
+    segments = await asyncio.to_thread(segment_audio, samples, VOICE_SEGMENT_SECONDS, VOICE_SEGMENT_OVERLAP_SECONDS)
+    duration = len(samples) / AUDIO_SAMPLE_RATE
+
+    if len(segments) == 1 and size <= WHISPER_MAX_FILE_BYTES:
+        # Not worth splitting; the original upload is smaller than the decoded WAV
+        del samples
+        audio_file.seek(0)
+        return await whisper_transcribe(audio_file, f"recording.{audio_format}", duration)
+
+    semaphore = asyncio.Semaphore(VOICE_SEGMENT_CONCURRENCY)
+
+    async def transcribe_segment(index: int, start: float, end: float) -> str:
+        async with semaphore:
+            # Encoded here so only the segments being sent are held as WAV
+            wav = await asyncio.to_thread(segment_wav, samples, start, end)
+            return await whisper_transcribe(io.BytesIO(wav), f"segment-{index}.wav", end - start)
+
+    started = datetime.now(timezone.utc)
+    texts = await asyncio.gather(*(transcribe_segment(i, start, end) for i, (start, end) in enumerate(segments)))
+    logger.info(
+        "Voice transcription segmented duration=%.0fs segments=%d elapsed=%.1fs",
+        duration, len(segments), (datetime.now(timezone.utc) - started).total_seconds(),
+    )
+    return stitch_transcripts(texts)
+
+
+async def run_voice_to_recipe(user: dict, body: dict, charge, emit=None) -> dict:
+    """
+    Voice pipeline for base64 JSON uploads, shared by the endpoint and the AI job queue.
+    charge(feature) is awaited right before paid work and returns the updated user.
+    """
+    audio_data = body.get("audio")  # Base64 encoded audio
+    audio_format = normalize_audio_format(body.get("format"))
+
+    if not audio_data:
+        raise HTTPException(status_code=400, detail="No audio provided")
+
+    # Strip data URL prefix if present
+    if audio_data.startswith("data:"):
+        audio_data = audio_data.split(",", 1)[1] if "," in audio_data else audio_data
+
+    try:
+        audio_bytes = base64.b64decode(audio_data)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid audio data")
+    if len(audio_bytes) > VOICE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=voice_too_large_detail())
+
+    # BytesIO shares the decoded buffer, so the upload below streams from this single copy
+    return await transcribe_and_structure_recipe(user, io.BytesIO(audio_bytes), audio_format, charge, emit)
+
+
+async def transcribe_and_structure_recipe(user: dict, audio_file, audio_format: str, charge, emit=None) -> dict:
+    """
+    Transcribe a recording with Whisper and structure it with GPT-4o.
+    audio_file is any readable binary file object; it is streamed to the API as-is.
+    """
+    # Consume credit (voice costs 2)
+    user = await charge("voice_to_recipe")
+
+    try:
+        # Step 1: Transcribe with Whisper
+        transcription_text = await transcribe_recording(audio_file, audio_format)
+        if not transcription_text or len(transcription_text.strip()) < 10:
+            raise HTTPException(status_code=422, detail="Could not transcribe audio. Please speak clearly and try again.")
+
+        if emit:
+            emit("transcription", {"text": transcription_text})
+
+        # Step 2: Structure on the routed model, escalating if required fields are missing
+        recipe_data = await complete_ai_json(
+            "voice_structure",
+            [
+                {"role": "system", "content": VOICE_RECIPE_PROMPT},
+                {"role": "user", "content": f"Here is the transcription of a spoken recipe:\n\n{transcription_text}"},
+            ],
+            temperature=0.1,
+            validate=require_recipe_fields,
+            emit=emit,
+        )
+
+        recipe_data.setdefault("cooking_time", 30)
+        recipe_data.setdefault("servings", 4)
+        recipe_data.setdefault("category", "Main Course")
+        recipe_data.setdefault("difficulty", "easy")
+        recipe_data.setdefault("story", None)
+
+        return {
+            "success": True,
+            "transcription": transcription_text,
+            "recipe": recipe_data,
+            "credits_remaining": user.get("credits_balance", 0),
+        }
+
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error("Voice recipe parse error: %s", e)
+        raise HTTPException(status_code=422, detail="AI could not structure the transcription into a recipe. Try speaking more clearly.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Voice-to-recipe error: %s", e)
+        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+
+
+@api_router.post("/ai/voice-to-recipe")
+async def voice_to_recipe(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Transcribe audio of a spoken recipe and extract structured data."""
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="AI features are not configured")
+
+    user = await get_current_user(credentials)
+    charge = partial(consume_credit, user)
+
+    content_type = request.headers.get("content-type", "").lower()
+    if content_type.startswith("multipart/form-data"):
+        audio_file, audio_format = await read_multipart_audio(request)
+    elif content_type.startswith(("audio/", "video/", "application/octet-stream")):
+        audio_file = await spool_request_body(request, VOICE_MAX_UPLOAD_BYTES, voice_too_large_detail())
+        audio_format = normalize_audio_format(
+            request.query_params.get("format") or AUDIO_CONTENT_TYPE_FORMATS.get(content_type.split(";")[0].strip())
+        )
+    else:
+        body = await request.json()
+        pipeline = guarded_ai_pipeline("voice_to_recipe", run_voice_to_recipe)
+        if wants_event_stream(request):
+            return stream_ai_pipeline(pipeline, user, body, charge)
+        return await pipeline(user, body, charge)
+
+    async def run_upload(user: dict, body: dict, charge, emit=None) -> dict:
+        try:
+            return await transcribe_and_structure_recipe(user, audio_file, audio_format, charge, emit)
+        finally:
+            audio_file.close()
+
+    pipeline = guarded_ai_pipeline("voice_to_recipe", run_upload)
+    if wants_event_stream(request):
+        return stream_ai_pipeline(pipeline, user, {}, charge)
+    return await pipeline(user, {}, charge)
+
+
+# ===================== SAVE FROM SOCIAL MEDIA (Milestone 3.2) =====================
+
+SOCIAL_RECIPE_PROMPT = """You are a recipe extraction assistant for Legacy Table, a family recipe app.
+The user pasted a link to a cooking video or post from social media. Below is the metadata we extracted from the page (title, description, author, thumbnail).
+
+Using this metadata, create a structured recipe. If the description doesn't contain a full recipe, do your best to infer reasonable ingredients and instructions from the title and description.
+
+Return ONLY valid JSON:
+{
+  "title": "Recipe title",
+  "ingredients": ["ingredient 1", "ingredient 2", ...],
+  "instructions": "Step-by-step instructions",
+  "cooking_time": 30,
+  "servings": 4,
+  "category": "Main Course",
+  "difficulty": "easy",
+  "story": "Saved from @username on TikTok/Instagram",
+  "source_url": "original URL",
+  "source_author": "creator name"
+}
 
 Rules:
-- Clean up filler words (um, uh, like, you know) from instructions
-- Organize rambling narration into clear step-by-step instructions
-- Extract ingredient quantities even if stated informally ("about two cups of flour" → "2 cups flour")
-- cooking_time in minutes, servings as integer
 - category: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, or Beverage
 - difficulty: easy, medium, or hard
-- If the speaker shares personal stories or memories, capture them in "story"
+- If you can't determine full ingredients/instructions from the metadata, provide your best educated guess based on the recipe title and mark instructions with "(Adapted from video — adjust to taste)"
+- Return ONLY JSON"""
+
+
+# Query parameters that only track where a link was shared from
+TRACKING_QUERY_PARAMS = {
+    "fbclid", "gclid", "igshid", "igsh", "mibextid", "si", "feature", "ref", "ref_src",
+    "_r", "_t", "is_from_webapp", "sender_device", "sender_web_id", "share_app_id",
+    "share_item_id", "share_link_id", "social_sharing", "embed_source", "web_id", "tt_from",
+}
+
+# Hosts that only redirect to the real post; resolved before building the cache key
+SHORT_LINK_HOSTS = {
+    "vm.tiktok.com", "vt.tiktok.com", "bit.ly", "t.co", "tinyurl.com", "pin.it",
+    "fb.watch", "instagr.am", "goo.gl", "ow.ly", "spoti.fi", "amzn.to",
+}
+
+# ---- Page fetching ----
+
+# Pasted links are fetched server-side, so every fetch is bounded in size, time and
+# redirects, and may only reach public addresses
+LINK_FETCH_MAX_BYTES = int(os.environ.get("LINK_FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+LINK_FETCH_TIMEOUT_SECONDS = float(os.environ.get("LINK_FETCH_TIMEOUT_SECONDS", "8"))
+LINK_FETCH_MAX_REDIRECTS = 5
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+BROWSER_HEADERS = {"User-Agent": "Mozilla/5.0", "Accept": "text/html,application/xhtml+xml"}
+
+
+class PageFetchError(Exception):
+    pass
+
+
+async def assert_public_host(host: Optional[str]) -> str:
+    """
+    Refuse hosts that resolve to private, loopback, link-local or otherwise non-public
+    addresses. Returns the checked address to connect to.
+    """
+    if not host:
+        raise PageFetchError("URL has no host")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None)
+    except OSError as e:
+        raise PageFetchError(f"Could not resolve {host}: {e}")
+    addresses = [ipaddress.ip_address(info[4][0].split("%", 1)[0]) for info in infos]
+    if not addresses:
+        raise PageFetchError(f"Could not resolve {host}")
+    for address in addresses:
+        if not address.is_global or address.is_multicast:
+            raise PageFetchError(f"Refusing to fetch non-public address for {host}")
+    return str(addresses[0])
+
+
+class PinnedAddressTransport(httpx.AsyncBaseTransport):
+    """
+    Connects to the address assert_public_host checked (the request's "pinned_address"
+    extension) instead of resolving the host again, so a DNS answer that changes between
+    the check and the connect cannot reach a private address. The Host header and TLS
+    (SNI and certificate) still use the host name. Requests without a pinned address are refused.
+    """
+
+    def __init__(self):
+        self.transport = httpx.AsyncHTTPTransport(trust_env=False)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        address = request.extensions.get("pinned_address")
+        if not address:
+            raise httpx.ConnectError(f"No checked address for {request.url.host}", request=request)
+        pinned = httpx.Request(
+            request.method,
+            request.url.copy_with(host=address),
+            headers=request.headers,
+            stream=request.stream,
+            extensions={**request.extensions, "sni_hostname": request.url.host},
+        )
+        return await self.transport.handle_async_request(pinned)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def public_http_client(timeout: float) -> httpx.AsyncClient:
+    """Client for open_public_url: pinned addresses and no proxies from the environment."""
+    return httpx.AsyncClient(transport=PinnedAddressTransport(), timeout=timeout, trust_env=False)
+
+
+async def open_public_url(http_client: httpx.AsyncClient, url: str, method: str = "GET") -> httpx.Response:
+    """
+    Send a streaming request, following redirects by hand so every hop is checked
+    against assert_public_host and connects to the address it checked. http_client
+    comes from public_http_client. The caller must close the returned response.
+    """
+    for _ in range(LINK_FETCH_MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise PageFetchError(f"Unsupported URL scheme: {parts.scheme}")
+        address = await assert_public_host(parts.hostname)
+
+        request = http_client.build_request(
+            method, url, headers=BROWSER_HEADERS, extensions={"pinned_address": address}
+        )
+        resp = await http_client.send(request, stream=True)
+        if not resp.is_redirect:
+            return resp
+        await resp.aclose()
+        url = urljoin(str(resp.url), resp.headers.get("location", ""))
+    raise PageFetchError("Too many redirects")
+
+
+async def fetch_html(url: str, enough=None) -> str:
+    """
+    Stream an HTML page and return its decoded text. Reading stops at LINK_FETCH_MAX_BYTES,
+    at the LINK_FETCH_TIMEOUT_SECONDS deadline (returning what arrived), or as soon as
+    enough(text) is true. Raises PageFetchError for non-HTML or unreachable pages.
+    """
+    text_parts = []
+
+    async def read():
+        async with public_http_client(LINK_FETCH_TIMEOUT_SECONDS) as http_client:
+            resp = await open_public_url(http_client, url)
+            try:
+                if resp.status_code >= 400:
+                    raise PageFetchError(f"HTTP {resp.status_code}")
+                content_type = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+                if content_type and content_type not in HTML_CONTENT_TYPES:
+                    raise PageFetchError(f"Not an HTML page: {content_type}")
+                try:
+                    decoder = codecs.getincrementaldecoder(resp.charset_encoding or "utf-8")(errors="replace")
+                except LookupError:
+                    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+                received = 0
+                # aiter_bytes counts decompressed bytes, so a compression bomb hits the cap too
+                async for chunk in resp.aiter_bytes(64 * 1024):
+                    chunk = chunk[:LINK_FETCH_MAX_BYTES - received]
+                    received += len(chunk)
+                    text_parts.append(decoder.decode(chunk))
+                    if received >= LINK_FETCH_MAX_BYTES or (enough and enough("".join(text_parts))):
+                        break
+            finally:
+                await resp.aclose()
+
+    try:
+        await asyncio.wait_for(read(), timeout=LINK_FETCH_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        if not text_parts:
+            raise PageFetchError("Timed out")
+        logger.info("Page fetch deadline reached url=%s, using partial page", url)
+    except httpx.HTTPError as e:
+        raise PageFetchError(str(e))
+    return "".join(text_parts)
+
+
+def page_metadata_seen(text: str) -> bool:
+    """Stop reading a page once the head is closed and any recipe markup we need has arrived."""
+    lower = text.lower()
+    head_end = lower.find("</head")
+    if head_end < 0:
+        return False
+    if "recipe" not in lower[:head_end]:
+        return True  # Not a recipe page; the Open Graph tags are all we use
+    if "</body" in lower:
+        return True
+    return "ld+json" in lower and is_complete(recipe_from_json_ld(text))
+
+
+_short_link_cache = {}
+SHORT_LINK_CACHE_MAX = 2048
+
+
+async def resolve_short_link(url: str) -> str:
+    """Follow a short link's redirects and return the final URL (or the input on failure)."""
+    if url in _short_link_cache:
+        return _short_link_cache[url]
+    try:
+        async with public_http_client(5) as http_client:
+            resp = await open_public_url(http_client, url, method="HEAD")
+            await resp.aclose()
+            if resp.status_code >= 400:
+                # Some shorteners reject HEAD; the redirect chain is the same for GET
+                resp = await open_public_url(http_client, url)
+                await resp.aclose()
+            resolved = str(resp.url)
+    except (httpx.HTTPError, PageFetchError) as e:
+        logger.warning("Short link resolution failed url=%s: %s", url, e)
+        return url
+
+    if len(_short_link_cache) >= SHORT_LINK_CACHE_MAX:
+        _short_link_cache.clear()
+    _short_link_cache[url] = resolved
+    return resolved
+
+
+def normalize_url(url: str) -> str:
+    """Lowercase scheme/host, drop fragments and tracking params, and sort the remaining query."""
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parts.hostname or "").lower()
+    if host.startswith("m.") and host.split(".", 1)[1] in ("youtube.com", "tiktok.com", "facebook.com"):
+        host = "www." + host.split(".", 1)[1]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=False)
+        if k.lower() not in TRACKING_QUERY_PARAMS and not k.lower().startswith("utm_")
+    ]
+
+    # youtu.be/<id> and youtube.com/watch?v=<id> are the same video
+    if host == "youtu.be" and path.strip("/"):
+        query = [("v", path.strip("/"))] + [(k, v) for k, v in query if k != "v"]
+        host, path = "www.youtube.com", "/watch"
+    if host == "youtube.com":
+        host = "www.youtube.com"
+
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+
+async def canonicalize_url(url: str) -> str:
+    """Return the canonical form of a pasted link, resolving known short-link hosts."""
+    if "://" not in url:
+        url = "https://" + url
+    host = (urlsplit(url).hostname or "").lower()
+    if host in SHORT_LINK_HOSTS:
+        url = await resolve_short_link(url)
+    return normalize_url(url)
+
+
+async def fetch_link_metadata(url: str) -> dict:
+    """Fetch oEmbed metadata (or Open Graph tags) for a link, using the short-TTL metadata cache."""
+    cached = await ai_cache_get(LINK_META_CACHE_COLLECTION, url)
+    if cached is not None:
+        return cached
+
+    # Determine platform and fetch oEmbed metadata
+    metadata = {"url": url, "title": "", "description": "", "author": "", "thumbnail": "", "structured_recipe": None}
+
+    try:
+        async with httpx.AsyncClient(timeout=15) as client:
+            # Try oEmbed endpoints
+            oembed_url = None
+            encoded_url = quote(url, safe="")
+            if "tiktok.com" in url:
+                oembed_url = f"https://www.tiktok.com/oembed?url={encoded_url}"
+            elif "instagram.com" in url:
+                oembed_url = f"https://api.instagram.com/oembed?url={encoded_url}"
+            elif "youtube.com" in url or "youtu.be" in url:
+                oembed_url = f"https://www.youtube.com/oembed?url={encoded_url}&format=json"
+
+            if oembed_url:
+                resp = await client.get(oembed_url)
+                if resp.status_code == 200:
+                    data = resp.json()
+                    metadata["title"] = data.get("title", "")
+                    metadata["author"] = data.get("author_name", "")
+                    metadata["thumbnail"] = data.get("thumbnail_url", "")
+                    metadata["description"] = data.get("title", "")  # oEmbed often puts description in title
+
+            # Fallback: read the page itself, stopping once its metadata has arrived
+            if not metadata["title"]:
+                page = await fetch_html(url, enough=page_metadata_seen)
+                # Recipe sites embed the whole recipe as schema.org markup, often in the body
+                metadata["structured_recipe"] = extract_markup_recipe(page)
+                head_end = page.lower().find("</head")
+                text = page[:head_end] if head_end >= 0 else page[:65536]  # Open Graph tags live in the head
+                og_title = re.search(r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']+)', text)
+                og_desc = re.search(r'<meta[^>]+property=["\']og:description["\'][^>]+content=["\']([^"\']+)', text)
+                og_image = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)', text)
+                if og_title:
+                    metadata["title"] = og_title.group(1)
+                if og_desc:
+                    metadata["description"] = og_desc.group(1)
+                if og_image:
+                    metadata["thumbnail"] = og_image.group(1)
+
+    except Exception as e:
+        logger.warning("Failed to fetch social media metadata: %s", e)
+        # Continue with whatever we have — AI can work with just the URL
+
+    # Only cache successful fetches so a transient failure is retried next time
+    if metadata["title"] or metadata["structured_recipe"]:
+        try:
+            await ai_cache_put(
+                LINK_META_CACHE_COLLECTION, url, metadata,
+                ttl_seconds=LINK_META_CACHE_TTL_SECONDS, max_entries=LINK_CACHE_MAX_ENTRIES,
+            )
+        except PyMongoError as e:
+            logger.warning("Link metadata cache write failed: %s", e)
+    return metadata
+
+
+def public_link_metadata(metadata: dict) -> dict:
+    return {k: v for k, v in metadata.items() if k != "structured_recipe"}
+
+
+def local_link_recipe(url: str, metadata: dict) -> Optional[dict]:
+    """
+    Answer a link import without the LLM when the page's schema.org markup, or a
+    caption listing ingredients and steps, already holds a complete recipe.
+    """
+    candidates = (
+        ("schema_org", lambda: metadata.get("structured_recipe")),
+        ("caption", lambda: recipe_from_caption(metadata.get("description", ""), metadata.get("title", ""))),
+    )
+    for tier, parse in candidates:
+        recipe = parse()
+        if is_complete(recipe):
+            recipe = dict(recipe)
+            recipe["source_url"] = url
+            recipe["source_author"] = recipe.get("source_author") or metadata.get("author", "")
+            return {"recipe": recipe, "metadata": public_link_metadata(metadata), "tier": tier}
+    return None
+
+
+async def extract_link_recipe(url: str, metadata: dict, emit=None) -> dict:
+    """Build a structured recipe for a canonical URL with GPT-4o. Returns {"recipe", "metadata", "tier"}."""
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="AI features are not configured")
+
+    # Use GPT-4o to structure into a recipe
+    try:
+        meta_text = f"URL: {url}\nTitle: {metadata['title']}\nAuthor: {metadata['author']}\nDescription: {metadata['description']}"
+        if metadata.get("structured_recipe"):
+            # Incomplete page markup is still a better starting point than the title alone
+            meta_text += f"\nPartial recipe data from the page: {json.dumps(metadata['structured_recipe'])}"
+
+        recipe_data = await complete_ai_json(
+            "link_structure",
+            [
+                {"role": "system", "content": SOCIAL_RECIPE_PROMPT},
+                {"role": "user", "content": meta_text},
+            ],
+            temperature=0.2,
+            validate=lambda data: require_recipe_fields(data, ("title", "ingredients")),
+            emit=emit,
+        )
+        recipe_data.setdefault("cooking_time", 30)
+        recipe_data.setdefault("servings", 4)
+        recipe_data.setdefault("category", "Main Course")
+        recipe_data.setdefault("difficulty", "easy")
+        recipe_data["source_url"] = url
+        recipe_data["source_author"] = metadata.get("author", "")
+
+    except (json.JSONDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Could not extract a recipe from this link. Try a different video.")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Save from link error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to process link: {str(e)}")
+
+    result = {"recipe": recipe_data, "metadata": public_link_metadata(metadata), "tier": "ai"}
+    try:
+        await ai_cache_put(
+            LINK_RECIPE_CACHE_COLLECTION, url, result,
+            ttl_seconds=LINK_RECIPE_CACHE_TTL_SECONDS, max_entries=LINK_CACHE_MAX_ENTRIES,
+        )
+    except PyMongoError as e:
+        logger.warning("Link recipe cache write failed: %s", e)
+    return result
+
+
+async def run_save_from_link(user: dict, body: dict, charge, emit=None) -> dict:
+    """
+    Link import pipeline shared by the endpoint and the AI job queue.
+    charge(feature) is awaited right before paid work and returns the updated user.
+    """
+    url = body.get("url", "").strip()
+    if not url:
+        raise HTTPException(status_code=400, detail="No URL provided")
+
+    started = datetime.now(timezone.utc)
+    url = await canonicalize_url(url)
+    result = await ai_cache_get(LINK_RECIPE_CACHE_COLLECTION, url)
+    cached = result is not None
+    charged = False
+
+    if not cached:
+        metadata = await coalesced(f"link-meta:{url}", lambda: fetch_link_metadata(url))
+        result = local_link_recipe(url, metadata)
+        if result is not None:
+            try:
+                await ai_cache_put(
+                    LINK_RECIPE_CACHE_COLLECTION, url, result,
+                    ttl_seconds=LINK_RECIPE_CACHE_TTL_SECONDS, max_entries=LINK_CACHE_MAX_ENTRIES,
+                )
+            except PyMongoError as e:
+                logger.warning("Link recipe cache write failed: %s", e)
+        else:
+            starter = False
+
+            async def paid_extraction():
+                # Runs only for the request that starts the extraction, and charges it
+                # inside the shared task, so no concurrent request can start a second one
+                nonlocal user, charged, starter
+                starter = True
+                user = await charge("recipe_scan")  # 1 credit
+                charged = True
+                return await extract_link_recipe(url, metadata, emit)
+
+            # Joining an extraction another request already paid for is free, like a cache hit.
+            # Only the request that starts it streams fields; joiners get the final result.
+            for attempt in range(2):
+                try:
+                    result = await coalesced(f"link-recipe:{url}", paid_extraction)
+                    break
+                except HTTPException as e:
+                    # The request we joined could not pay for the extraction; start our own
+                    if starter or e.status_code != 403 or attempt:
+                        raise
+            cached = not charged
+
+    if not charged:
+        user = await refresh_credits_if_needed(user)
+    tier = result.get("tier", "ai")
+    logger.info("Link import: url=%s tier=%s cached=%s elapsed_ms=%.0f",
+                url, tier, cached, (datetime.now(timezone.utc) - started).total_seconds() * 1000)
+    return {
+        "success": True,
+        "recipe": result["recipe"],
+        "metadata": result["metadata"],
+        "tier": tier,
+        "cached": cached,
+        "credits_remaining": user.get("credits_balance", 0),
+    }
+
+
+@api_router.post("/ai/save-from-link")
+async def save_from_link(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Extract a recipe from a link. Recipe pages with schema.org markup and captions that
+    list the full recipe are parsed locally for free; otherwise oEmbed metadata + AI.
+    """
+    user = await get_current_user(credentials)
+    body = await request.json()
+    charge = partial(consume_credit, user)
+    pipeline = guarded_ai_pipeline("save_from_link", run_save_from_link)
+    if wants_event_stream(request):
+        return stream_ai_pipeline(pipeline, user, body, charge)
+    return await pipeline(user, body, charge)
+
+
+# ===================== COOKBOOK PDF IMPORT =====================
+
+# A whole cookbook PDF is imported as one AI job: pages with a text layer are
+# read directly, pages without one are rasterized for the vision model (each by
+# the worker extracting it, so only a few page images are in memory at a time),
+# pages are grouped into recipes and extracted by a bounded pool of workers. Progress
+# is saved per unit in pdf_imports, so an interrupted import resumes where it stopped.
+PDF_IMPORT_MAX_BYTES = int(os.environ.get("PDF_IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+PDF_IMPORT_CONCURRENCY = int(os.environ.get("PDF_IMPORT_CONCURRENCY", "4"))
+
+pdf_import_files = AsyncIOMotorGridFSBucket(db, bucket_name="pdf_import_files")
+
+PDF_TEXT_RECIPE_PROMPT = """You are a recipe extraction assistant for Legacy Table, a family recipe app.
+Below is text extracted from one or more consecutive pages of a family cookbook PDF. Extract every complete recipe in it.
+
+Return ONLY valid JSON:
+{
+  "recipes": [
+    {
+      "title": "Recipe title",
+      "ingredients": ["ingredient 1 with quantity", "ingredient 2 with quantity", ...],
+      "instructions": "Full cooking instructions as a single string with paragraph breaks",
+      "cooking_time": 30,
+      "servings": 4,
+      "category": "Main Course",
+      "difficulty": "easy",
+      "story": "Personal notes, memories or dedication for this recipe (or null)"
+    }
+  ]
+}
+
+Rules:
+- Return {"recipes": []} if the text is front matter (cover, table of contents, index) or has no recipe
+- Keep ingredient quantities exactly as written
+- cooking_time in minutes, servings as integer (estimate if not stated)
+- category: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, or Beverage
+- difficulty: easy, medium, or hard
+- A story or memory printed after a recipe belongs in that recipe's "story"
 - Return ONLY the JSON object"""
 
 
-@api_router.post("/ai/voice-to-recipe")
-async def voice_to_recipe(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Transcribe audio of a spoken recipe and extract structured data."""
+async def ensure_pdf_import_indexes():
+    await db.pdf_imports.create_index("id", unique=True)
+    await db.pdf_imports.create_index([("user_id", 1), ("created_at", -1)])
+
+
+def pdf_import_response(imp: dict) -> dict:
+    units = imp.get("units") or []
+    done = sum(1 for u in units if u["status"] in ("done", "skipped"))
+    failed = sum(1 for u in units if u["status"] == "failed")
+    return {
+        "import_id": imp["id"],
+        "filename": imp.get("filename"),
+        "status": imp["status"],
+        "stage": imp.get("stage"),
+        "page_count": imp.get("page_count"),
+        "units_total": len(units),
+        "units_done": done,
+        "units_failed": failed,
+        "progress": round((done + failed) / len(units), 3) if units else 0.0,
+        "recipes_created": imp.get("recipes_created", 0),
+        "error": imp.get("error"),
+        "job_id": imp.get("job_id"),
+        "created_at": imp.get("created_at"),
+        "finished_at": imp.get("finished_at"),
+    }
+
+
+async def extract_recipes_from_text(text: str) -> list:
+    """Structure cookbook text into zero or more recipes."""
+    def validate(data):
+        if not isinstance(data, dict) or not isinstance(data.get("recipes", []), list):
+            raise ValueError("Expected {\"recipes\": [...]}")
+
+    try:
+        data = await complete_ai_json(
+            "pdf_text",
+            [
+                {"role": "system", "content": PDF_TEXT_RECIPE_PROMPT},
+                {"role": "user", "content": text},
+            ],
+            temperature=0.1,
+            validate=validate,
+        )
+    except (json.JSONDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="AI could not structure these pages into recipes")
+    recipes = data.get("recipes", []) if isinstance(data, dict) else []
+    return [
+        r for r in recipes
+        if isinstance(r, dict) and r.get("title") and r.get("ingredients") and r.get("instructions")
+    ]
+
+
+def collect_pdf_import_recipes(units: list) -> list:
+    """
+    Return [(key, recipe)] in page order. Consecutive scanned pages are merged like a
+    batch scan; key is stable across resumes and seeds the recipe ID.
+    """
+    collected = []
+    scan_run = []
+
+    def flush_scans():
+        for recipe in merge_batch_pages(scan_run):
+            collected.append((f"scan-{recipe['pages'][0]}", recipe))
+        scan_run.clear()
+
+    for unit in units:
+        if unit["kind"] == "scan":
+            page = {"index": unit["pages"][0], "status": "ok" if unit["status"] == "done" else "failed"}
+            if unit["status"] == "done":
+                page.update(recipe=unit["recipes"][0], continues_previous=unit.get("continues_previous", False))
+            scan_run.append(page)
+            continue
+        flush_scans()
+        if unit["status"] == "done":
+            for n, recipe in enumerate(unit["recipes"]):
+                collected.append((f"text-{unit['unit']}-{n}", dict(recipe, pages=unit["pages"])))
+    flush_scans()
+    return collected
+
+
+def imported_recipe_doc(user: dict, import_id: str, key: str, recipe: dict) -> dict:
+    def as_int(value, default: int) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return default
+
+    return {
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"pdf-import:{import_id}:{key}")),
+        "family_id": user.get("family_id"),
+        "title": str(recipe.get("title") or "Untitled Recipe"),
+        "ingredients": [str(item) for item in recipe.get("ingredients") or []],
+        "instructions": str(recipe.get("instructions") or ""),
+        "story": recipe.get("story"),
+        "photos": [],
+        "cooking_time": as_int(recipe.get("cooking_time"), 30),
+        "servings": as_int(recipe.get("servings"), 4),
+        "category": recipe.get("category") or "Main Course",
+        "difficulty": recipe.get("difficulty") or "easy",
+        "author_id": user["id"],
+        "author_name": user.get("nickname") or user["name"],
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc),
+        "import_id": import_id,
+        "import_pages": [page + 1 for page in recipe.get("pages", [])],
+    }
+
+
+async def _update_pdf_import(import_id: str, **fields):
+    await db.pdf_imports.update_one({"id": import_id}, {"$set": fields})
+
+
+async def run_pdf_import(user: dict, body: dict, charge) -> dict:
+    """
+    AI job pipeline for a cookbook PDF. Each unit reserves its credit as it starts
+    instead of going through charge, because recipes already extracted are kept even
+    if the import stops part-way (for example when the balance runs out).
+    """
+    imp = await db.pdf_imports.find_one({"id": body.get("import_id"), "user_id": user["id"]}, {"_id": 0})
+    if not imp:
+        raise HTTPException(status_code=404, detail="Import not found")
+    if imp["status"] == "completed" and not any(u["status"] == "failed" for u in imp.get("units") or []):
+        return pdf_import_response(imp)
+
+    import_id = imp["id"]
+    loop = asyncio.get_running_loop()
+    try:
+        await _update_pdf_import(import_id, status="running", error=None)
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            await pdf_import_files.download_to_stream(imp["file_id"], pdf_file)
+            pdf_file.flush()
+
+            if imp.get("units") is None:
+                await _update_pdf_import(import_id, stage="reading")
+                pages = await loop.run_in_executor(get_image_pool(), read_text_layer, pdf_file.name)
+                units = segment_pages(pages)
+                for unit in units:
+                    unit["status"] = "pending"
+                imp.update(units=units, page_count=len(pages))
+                await _update_pdf_import(
+                    import_id, units=units, page_count=len(pages),
+                    pages_with_text=sum(1 for p in pages if p["has_text"]),
+                )
+
+            # Failed units are retried when an import is resumed
+            pending = [u for u in imp["units"] if u["status"] not in ("done", "skipped")]
+
+            await _update_pdf_import(import_id, stage="extracting")
+            queue = asyncio.Queue()
+            for unit in pending:
+                queue.put_nowait(unit)
+            paused = []
+
+            async def extract_worker():
+                while not queue.empty() and not paused:
+                    unit = queue.get_nowait()
+                    try:
+                        await reserve_credits(user, "recipe_scan", 1)
+                    except HTTPException as e:
+                        if e.status_code != 403:
+                            raise
+                        paused.append(e.detail)
+                        return
+
+                    charged = True
+                    try:
+                        if unit["kind"] == "text":
+                            update = {"status": "done", "recipes": await extract_recipes_from_text(unit["text"])}
+                        else:
+                            async def paid(feature: str) -> dict:
+                                return user  # Reserved above
+
+                            # Rendered one page at a time, so memory holds at most one image per worker
+                            rendered = await loop.run_in_executor(
+                                get_image_pool(), render_pages, pdf_file.name, unit["pages"]
+                            )
+                            result = await scan_recipe_image(
+                                user, rendered[0][1], "image/jpeg", paid, batch_page=True,
+                            )
+                            recipe = dict(result["recipe"])
+                            update = {
+                                "status": "done",
+                                "recipes": [recipe],
+                                "continues_previous": bool(recipe.pop("continues_previous", False)),
+                            }
+                            charged = not result["cached"]
+                    except HTTPException as e:
+                        charged = False
+                        if isinstance(e.detail, dict) and e.detail.get("error") == "image_quality":
+                            # Blank separator pages and the like; retrying them would not help
+                            update = {"status": "skipped", "error": e.detail["issues"]}
+                        else:
+                            logger.warning("PDF import unit failed: import=%s unit=%s: %s", import_id, unit["unit"], e.detail)
+                            update = {"status": "failed", "error": e.detail}
+                    except Exception as e:
+                        logger.warning("PDF import unit failed: import=%s unit=%s: %s", import_id, unit["unit"], e)
+                        charged = False
+                        update = {"status": "failed", "error": str(e)}
+                    if not charged:
+                        await refund_credits(user, CREDIT_COSTS["recipe_scan"], "pdf import: cached or failed unit")
+
+                    unit.update(update)
+                    await db.pdf_imports.update_one(
+                        {"id": import_id},
+                        {"$set": {f"units.{unit['unit']}.{field}": value for field, value in update.items()}},
+                    )
+
+            await asyncio.gather(*(extract_worker() for _ in range(PDF_IMPORT_CONCURRENCY)))
+
+        if paused:
+            await _update_pdf_import(import_id, status="paused", stage="extracting", error=paused[0])
+            logger.info("PDF import paused for credits: import=%s", import_id)
+            return pdf_import_response(await db.pdf_imports.find_one({"id": import_id}, {"_id": 0}))
+
+        # Recipe IDs are derived from the import, so a re-run never inserts duplicates
+        await _update_pdf_import(import_id, stage="saving")
+        docs = [imported_recipe_doc(user, import_id, key, recipe) for key, recipe in collect_pdf_import_recipes(imp["units"])]
+        existing = {
+            doc["id"] async for doc in db.recipes.find({"id": {"$in": [d["id"] for d in docs]}}, {"_id": 0, "id": 1})
+        }
+        new_docs = [d for d in docs if d["id"] not in existing]
+        if new_docs:
+            await db.recipes.insert_many(new_docs)
+            await bump_family_revisions(user.get("family_id"), "recipes_revision")
+            await count_categories([(d["family_id"], d["category"], 1) for d in new_docs])
+            await create_notification_v1(
+                family_id=user.get("family_id"),
+                notification_type="recipes_imported",
+                payload={
+                    "import_id": import_id,
+                    "author_name": user.get("nickname") or user["name"],
+                    "recipe_count": len(new_docs),
+                },
+                exclude_user_id=user["id"],
+            )
+
+        failed = any(u["status"] == "failed" for u in imp["units"])
+        await _update_pdf_import(
+            import_id, status="completed", stage="done", recipes_created=len(docs),
+            finished_at=datetime.now(timezone.utc).isoformat(),
+        )
+        if not failed:
+            # Keep the PDF while some units can still be retried
+            await pdf_import_files.delete(imp["file_id"])
+        logger.info("PDF import completed: import=%s recipes=%d new=%d", import_id, len(docs), len(new_docs))
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else f"Import failed: {str(e)}"
+        await _update_pdf_import(import_id, status="failed", error=detail)
+        raise
+
+    return pdf_import_response(await db.pdf_imports.find_one({"id": import_id}, {"_id": 0}))
+
+
+async def _get_owned_pdf_import(import_id: str, user: dict) -> dict:
+    imp = await db.pdf_imports.find_one({"id": import_id, "user_id": user["id"]}, {"_id": 0})
+    if not imp:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return imp
+
+
+@api_router.post("/imports/pdf", status_code=202)
+async def import_cookbook_pdf(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Upload a cookbook PDF (multipart field "file", or a raw application/pdf body) and
+    queue it for import. Poll GET /imports/pdf/{import_id} for progress.
+    """
     if not openai_client:
         raise HTTPException(status_code=503, detail="AI features are not configured")
-
     user = await get_current_user(credentials)
 
-    # Consume credit (voice costs 2)
-    user = await consume_credit(user, "voice_to_recipe")
+    too_large = f"PDF too large. Maximum size is {PDF_IMPORT_MAX_BYTES // (1024 * 1024)}MB."
+    content_type = request.headers.get("content-type", "").lower()
+    form = None
+    if content_type.startswith("multipart/form-data"):
+        form = await parse_capped_multipart(request, PDF_IMPORT_MAX_BYTES, too_large, max_files=1)
+        upload = form.get("file")
+        if not isinstance(upload, StarletteUploadFile):
+            await form.close()
+            raise HTTPException(status_code=400, detail="No PDF provided")
+        source, filename = upload.file, upload.filename or "cookbook.pdf"
+    elif content_type.startswith(("application/pdf", "application/octet-stream")):
+        source = await spool_request_body(request, PDF_IMPORT_MAX_BYTES, too_large)
+        filename = request.query_params.get("filename") or "cookbook.pdf"
+    else:
+        raise HTTPException(status_code=415, detail="Upload the PDF as multipart/form-data or application/pdf")
 
-    body = await request.json()
-    audio_data = body.get("audio")  # Base64 encoded audio
-    audio_format = body.get("format", "webm")  # webm, mp4, wav, etc.
+    try:
+        if source.read(5) != b"%PDF-":
+            raise HTTPException(status_code=400, detail="This file is not a PDF")
+        source.seek(0)
+        file_id = await pdf_import_files.upload_from_stream(filename, source)
+    finally:
+        if form is not None:
+            await form.close()
+        else:
+            source.close()
 
-    if not audio_data:
-        raise HTTPException(status_code=400, detail="No audio provided")
+    import_id = str(uuid.uuid4())
+    await db.pdf_imports.insert_one({
+        "id": import_id,
+        "user_id": user["id"],
+        "family_id": user.get("family_id"),
+        "filename": filename,
+        "file_id": file_id,
+        "status": "queued",
+        "stage": "queued",
+        "units": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    })
+    try:
+        job_id = await enqueue_ai_job(user, "pdf_import", {"import_id": import_id})
+    except HTTPException:
+        await db.pdf_imports.delete_one({"id": import_id})
+        await pdf_import_files.delete(file_id)
+        raise
+    await _update_pdf_import(import_id, job_id=job_id)
+    logger.info("PDF import queued: import=%s user=%s file=%s", import_id, user["id"], filename)
+    return {"import_id": import_id, "job_id": job_id, "status": "queued"}
+
+
+@api_router.get("/imports/pdf")
+async def list_pdf_imports(user: dict = Depends(get_current_user)):
+    """The user's recent cookbook imports, newest first."""
+    imports = await db.pdf_imports.find({"user_id": user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(20)
+    return {"imports": [pdf_import_response(imp) for imp in imports]}
+
+
+@api_router.get("/imports/pdf/{import_id}")
+async def get_pdf_import(import_id: str, user: dict = Depends(get_current_user)):
+    """Progress of a cookbook import."""
+    return pdf_import_response(await _get_owned_pdf_import(import_id, user))
+
+
+@api_router.post("/imports/pdf/{import_id}/resume", status_code=202)
+async def resume_pdf_import(import_id: str, user: dict = Depends(get_current_user)):
+    """Continue a paused or failed import, retrying units that did not finish."""
+    imp = await _get_owned_pdf_import(import_id, user)
+    if imp["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail="This import is already in progress")
+    if imp["status"] == "completed" and not any(u["status"] == "failed" for u in imp.get("units") or []):
+        raise HTTPException(status_code=409, detail="This import has already finished")
+
+    job_id = await enqueue_ai_job(user, "pdf_import", {"import_id": import_id})
+    await _update_pdf_import(import_id, status="queued", job_id=job_id, error=None)
+    return {"import_id": import_id, "job_id": job_id, "status": "queued"}
+
+
+# ===================== RECIPE IMPORT =====================
+
+# Restores a family export (any format /export/recipes or /export/jobs produce) into
+# the user's family. The upload is spooled to disk and read in the background in
+# batches: each batch is validated, checked against the family's recipes by content
+# hash and written with one unordered insert_many, so re-uploading an export after an
+# interruption only adds what is missing. Family members get one notification at the end.
+RECIPE_IMPORT_MAX_BYTES = int(os.environ.get("RECIPE_IMPORT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+RECIPE_IMPORT_BATCH_SIZE = 200
+RECIPE_IMPORT_BATCH_BYTES = 8 * 1024 * 1024  # Photos travel inline, so batches are capped by size too
+RECIPE_IMPORT_MAX_ERRORS = 20  # Invalid entries past this are counted but not described
+RECIPE_IMPORT_STALE_SECONDS = 300
+
+_recipe_import_tasks = set()
+
+
+async def ensure_recipe_import_indexes():
+    await db.recipe_imports.create_index("id", unique=True)
+    await db.recipe_imports.create_index([("user_id", 1), ("created_at", -1)])
 
-    # Strip data URL prefix if present
-    if audio_data.startswith("data:"):
-        audio_data = audio_data.split(",", 1)[1] if "," in audio_data else audio_data
 
+def recipe_import_response(imp: dict) -> dict:
+    status, error = imp["status"], imp.get("error")
+    if status == "running" and heartbeat_is_stale(imp.get("updated_at"), RECIPE_IMPORT_STALE_SECONDS):
+        status, error = "failed", "The import stopped unexpectedly. Upload the file again to add what is missing."
+    return {
+        "import_id": imp["id"],
+        "status": status,
+        "format": imp.get("format"),
+        "progress": imp.get("progress", 0.0),
+        "processed": imp.get("processed", 0),
+        "recipes_created": imp.get("recipes_created", 0),
+        "comments_created": imp.get("comments_created", 0),
+        "duplicates": imp.get("duplicates", 0),
+        "invalid": imp.get("invalid", 0),
+        "errors": imp.get("errors", []),
+        "error": error,
+        "created_at": imp["created_at"].isoformat() if imp.get("created_at") else None,
+        "finished_at": imp["finished_at"].isoformat() if imp.get("finished_at") else None,
+    }
+
+
+async def insert_unordered(collection, docs: list) -> list:
+    """insert_many(ordered=False); returns the documents that went in, even when some failed."""
+    if not docs:
+        return []
     try:
-        # Step 1: Transcribe with Whisper
-        import tempfile
-        audio_bytes = base64.b64decode(audio_data)
+        await collection.insert_many(docs, ordered=False)
+        return docs
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details.get("writeErrors", [])}
+        logger.warning("Bulk insert into %s partly failed: %d errors", collection.name, len(failed))
+        return [doc for index, doc in enumerate(docs) if index not in failed]
 
-        with tempfile.NamedTemporaryFile(suffix=f".{audio_format}", delete=True) as tmp:
-            tmp.write(audio_bytes)
-            tmp.flush()
 
-            with open(tmp.name, "rb") as audio_file:
-                transcript = await openai_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="en",
-                )
+async def family_recipe_hashes(family_id: str) -> set:
+    hashes = set()
+    cursor = db.recipes.find(
+        {"family_id": family_id},
+        {"_id": 0, "content_hash": 1, "title": 1, "ingredients": 1, "instructions": 1},
+    )
+    async for recipe in cursor:
+        hashes.add(recipe.get("content_hash") or recipe_content_hash(recipe))
+    return hashes
 
-        transcription_text = transcript.text
-        if not transcription_text or len(transcription_text.strip()) < 10:
-            raise HTTPException(status_code=422, detail="Could not transcribe audio. Please speak clearly and try again.")
 
-        # Step 2: Structure with GPT-4o
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": VOICE_RECIPE_PROMPT},
-                {"role": "user", "content": f"Here is the transcription of a spoken recipe:\n\n{transcription_text}"},
-            ],
-            max_tokens=2000,
-            temperature=0.1,
-        )
+def imported_comment_doc(recipe_id: str, position: int, family_id: str, comment: dict, members: set, user: dict) -> Optional[dict]:
+    if not isinstance(comment, dict) or not isinstance(comment.get("text"), str) or not comment["text"].strip():
+        return None
+    known_author = comment.get("user_id") in members
+    return {
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"recipe-import:{recipe_id}:comment:{position}")),
+        "recipe_id": recipe_id,
+        "user_id": comment["user_id"] if known_author else user["id"],
+        "user_name": str(comment.get("user_name") or "Family member"),
+        "text": comment["text"],
+        "family_id": family_id,
+        "created_at": str(comment.get("created_at") or datetime.now(timezone.utc).isoformat()),
+        "updated_at": datetime.now(timezone.utc),
+    }
 
-        result_text = response.choices[0].message.content.strip()
 
-        # Parse JSON
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1] if "\n" in result_text else result_text[3:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            result_text = result_text.strip()
+async def run_recipe_import(imp: dict, user: dict, upload, size: int, close_upload):
+    import_id, family_id = imp["id"], user["family_id"]
+    display_name = user.get("nickname") or user["name"]
+    counts = {"processed": 0, "recipes_created": 0, "comments_created": 0, "duplicates": 0, "invalid": 0}
+    errors = []
+    entries = iter_export_entries(upload, size)
+
+    def next_batch():
+        batch, batch_bytes, fraction = [], 0, 1.0
+        for entry, fraction in entries:
+            batch.append(entry)
+            recipe = entry.get("recipe") if isinstance(entry.get("recipe"), dict) else {}
+            batch_bytes += sum(len(p) for p in recipe.get("photos") or [] if isinstance(p, str))
+            if len(batch) >= RECIPE_IMPORT_BATCH_SIZE or batch_bytes >= RECIPE_IMPORT_BATCH_BYTES:
+                break
+        return batch, fraction
 
-        recipe_data = json.loads(result_text)
+    def invalid(reason: str):
+        counts["invalid"] += 1
+        if len(errors) < RECIPE_IMPORT_MAX_ERRORS:
+            errors.append(f"Recipe {counts['processed']}: {reason}")
 
-        # Validate
-        required = ["title", "ingredients", "instructions"]
-        for field in required:
-            if field not in recipe_data or not recipe_data[field]:
-                raise ValueError(f"Missing required field: {field}")
+    try:
+        known = await family_recipe_hashes(family_id)
+        members = {m["id"] async for m in db.users.find({"family_id": family_id}, {"_id": 0, "id": 1})}
+        while True:
+            batch, fraction = await asyncio.to_thread(next_batch)
+            if not batch:
+                break
+            recipe_docs, comment_docs = [], []
+            for entry in batch:
+                counts["processed"] += 1
+                if "error" in entry:
+                    invalid(entry["error"])
+                    continue
+                original = entry.get("recipe")
+                try:
+                    fields = normalize_export_recipe(original)
+                except ValueError as e:
+                    invalid(str(e))
+                    continue
+                digest = recipe_content_hash(fields)
+                if digest in known:
+                    counts["duplicates"] += 1
+                    continue
+                known.add(digest)
+
+                # From the content, not the exported ID: merged backups can reuse an ID for
+                # different recipes, while identical content was skipped as a duplicate above
+                recipe_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"recipe-import:{import_id}:{digest}"))
+                known_author = original.get("author_id") in members
+                recipe_docs.append({
+                    "id": recipe_id,
+                    "family_id": family_id,
+                    **fields,
+                    "photo_ids": new_photo_ids(len(fields["photos"])),
+                    "author_id": original["author_id"] if known_author else user["id"],
+                    "author_name": str(original.get("author_name") or display_name),
+                    "created_at": str(original.get("created_at") or datetime.now(timezone.utc).isoformat()),
+                    "updated_at": datetime.now(timezone.utc),
+                    "content_hash": digest,
+                    "import_id": import_id,
+                })
+                for position, comment in enumerate(entry.get("comments") or []):
+                    doc = imported_comment_doc(recipe_id, position, family_id, comment, members, user)
+                    if doc:
+                        comment_docs.append(doc)
+
+            inserted = await insert_unordered(db.recipes, recipe_docs)
+            counts["recipes_created"] += len(inserted)
+            # Only comments whose recipe went in; their recipes' comments_revision moves past
+            # any empty list a client fetched between the two inserts
+            inserted_ids = {d["id"] for d in inserted}
+            comments = await insert_unordered(db.comments, [d for d in comment_docs if d["recipe_id"] in inserted_ids])
+            counts["comments_created"] += len(comments)
+            if comments:
+                await db.recipes.update_many(
+                    {"id": {"$in": list({d["recipe_id"] for d in comments})}}, {"$inc": {"comments_revision": 1}}
+                )
+            if inserted:
+                await bump_family_revisions(family_id, "recipes_revision")
+                await count_categories([(family_id, d["category"], 1) for d in inserted])
+            await db.recipe_imports.update_one({"id": import_id}, {"$set": {
+                **counts, "errors": errors, "progress": round(fraction, 3), "updated_at": datetime.now(timezone.utc),
+            }})
+    except ExportFormatError as e:
+        await _finish_recipe_import(import_id, counts, errors, status="failed", error=str(e))
+        return
+    except Exception:
+        logger.exception("Recipe import failed: import=%s", import_id)
+        await _finish_recipe_import(import_id, counts, errors, status="failed",
+                                    error="The import failed. Upload the file again to add what is missing.")
+        return
+    finally:
+        await close_upload()
 
-        recipe_data.setdefault("cooking_time", 30)
-        recipe_data.setdefault("servings", 4)
-        recipe_data.setdefault("category", "Main Course")
-        recipe_data.setdefault("difficulty", "easy")
-        recipe_data.setdefault("story", None)
+    await _finish_recipe_import(import_id, counts, errors, status="completed")
+    if counts["recipes_created"]:
+        await create_notification_v1(
+            family_id=family_id,
+            notification_type="recipes_imported",
+            payload={"import_id": import_id, "author_name": display_name, "recipe_count": counts["recipes_created"]},
+            exclude_user_id=user["id"],
+        )
+    logger.info("Recipe import completed: import=%s processed=%d created=%d duplicates=%d invalid=%d",
+                import_id, counts["processed"], counts["recipes_created"], counts["duplicates"], counts["invalid"])
 
-        return {
-            "success": True,
-            "transcription": transcription_text,
-            "recipe": recipe_data,
-            "credits_remaining": user.get("credits_balance", 0),
-        }
 
-    except json.JSONDecodeError as e:
-        logger.error("Voice recipe JSON parse error: %s", e)
-        raise HTTPException(status_code=422, detail="AI could not structure the transcription into a recipe. Try speaking more clearly.")
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error("Voice-to-recipe error: %s", e)
-        raise HTTPException(status_code=500, detail=f"AI processing failed: {str(e)}")
+async def _finish_recipe_import(import_id: str, counts: dict, errors: list, **fields):
+    now = datetime.now(timezone.utc)
+    await db.recipe_imports.update_one({"id": import_id}, {"$set": {
+        **counts, "errors": errors, "updated_at": now, "finished_at": now,
+        **({"progress": 1.0} if fields.get("status") == "completed" else {}), **fields,
+    }})
 
 
-# ===================== SAVE FROM SOCIAL MEDIA (Milestone 3.2) =====================
+@api_router.post("/imports/recipes", status_code=202)
+async def import_recipes(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Restore an export into the user's family: upload the file (NDJSON, gzipped NDJSON,
+    ZIP or the original JSON) as the raw body or multipart field "file". Recipes the
+    family already has are skipped. Poll GET /imports/recipes/{import_id} for progress.
+    """
+    user = await get_current_user(credentials)
+    if not user.get("family_id"):
+        raise HTTPException(status_code=400, detail="You need to be in a family to import recipes")
+
+    too_large = f"Export too large. Maximum size is {RECIPE_IMPORT_MAX_BYTES // (1024 * 1024)}MB."
+    form = None
+    if request.headers.get("content-type", "").lower().startswith("multipart/form-data"):
+        form = await parse_capped_multipart(request, RECIPE_IMPORT_MAX_BYTES, too_large, max_files=1)
+        upload = form.get("file")
+        if not isinstance(upload, StarletteUploadFile):
+            await form.close()
+            raise HTTPException(status_code=400, detail="No export file provided")
+        source = upload.file
+    else:
+        source = await spool_request_body(request, RECIPE_IMPORT_MAX_BYTES, too_large)
 
-SOCIAL_RECIPE_PROMPT = """You are a recipe extraction assistant for Legacy Table, a family recipe app.
-The user pasted a link to a cooking video or post from social media. Below is the metadata we extracted from the page (title, description, author, thumbnail).
+    async def close_upload():
+        if form is not None:
+            await form.close()
+        else:
+            source.close()
 
-Using this metadata, create a structured recipe. If the description doesn't contain a full recipe, do your best to infer reasonable ingredients and instructions from the title and description.
+    try:
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+        fmt = detect_format(source)
+    except ExportFormatError as e:
+        await close_upload()
+        raise HTTPException(status_code=400, detail=str(e))
 
-Return ONLY valid JSON:
-{
-  "title": "Recipe title",
-  "ingredients": ["ingredient 1", "ingredient 2", ...],
-  "instructions": "Step-by-step instructions",
-  "cooking_time": 30,
-  "servings": 4,
-  "category": "Main Course",
-  "difficulty": "easy",
-  "story": "Saved from @username on TikTok/Instagram",
-  "source_url": "original URL",
-  "source_author": "creator name"
+    now = datetime.now(timezone.utc)
+    imp = {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "family_id": user["family_id"],
+        "format": fmt,
+        "size": size,
+        "status": "running",
+        "progress": 0.0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await db.recipe_imports.insert_one(dict(imp))
+    task = asyncio.create_task(run_recipe_import(imp, user, source, size, close_upload))
+    _recipe_import_tasks.add(task)
+    task.add_done_callback(_recipe_import_tasks.discard)
+    logger.info("Recipe import started: import=%s user=%s format=%s bytes=%d", imp["id"], user["id"], fmt, size)
+    return recipe_import_response(imp)
+
+
+@api_router.get("/imports/recipes/{import_id}")
+async def get_recipe_import(import_id: str, user: dict = Depends(get_current_user)):
+    """Progress of a recipe import."""
+    imp = await db.recipe_imports.find_one({"id": import_id, "user_id": user["id"]}, {"_id": 0})
+    if not imp:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return recipe_import_response(imp)
+
+
+# ===================== AI JOB QUEUE =====================
+
+# Long-running AI work can be submitted as a job: the request returns a job ID
+# immediately and a worker runs the same pipeline as the synchronous endpoint.
+# Jobs live in MongoDB (payloads in GridFS), so they survive a worker restart.
+AI_JOB_WORKERS = int(os.environ.get("AI_JOB_WORKERS", "4"))
+AI_JOB_PER_USER_CONCURRENCY = int(os.environ.get("AI_JOB_PER_USER_CONCURRENCY", "2"))
+AI_JOB_LEASE_SECONDS = 60
+AI_JOB_MAX_ATTEMPTS = 3
+AI_JOB_RETENTION_SECONDS = 7 * 24 * 3600  # Finished jobs are kept for a week
+AI_JOB_POLL_SECONDS = 2
+
+# Higher tiers are dequeued first; ties are served oldest first
+TIER_JOB_PRIORITY = {None: 0, "heritage": 1, "legacy": 2}
+
+AI_JOB_KINDS = {
+    "recipe_scan": {"pipeline": run_recipe_scan, "feature": "recipe_scan"},
+    "voice_to_recipe": {"pipeline": run_voice_to_recipe, "feature": "voice_to_recipe"},
+    "save_from_link": {"pipeline": run_save_from_link, "feature": "recipe_scan"},
+    "pdf_import": {"pipeline": run_pdf_import, "feature": "recipe_scan"},
 }
 
-Rules:
-- category: Main Course, Appetizer, Dessert, Soup, Salad, Breakfast, Snack, or Beverage
-- difficulty: easy, medium, or hard
-- If you can't determine full ingredients/instructions from the metadata, provide your best educated guess based on the recipe title and mark instructions with "(Adapted from video — adjust to taste)"
-- Return ONLY JSON"""
+ai_job_payloads = AsyncIOMotorGridFSBucket(db, bucket_name="ai_job_payloads")
 
+_ai_job_worker_tasks = []
+_ai_job_wakeup = asyncio.Event()
+_ai_job_events = {}  # job_id -> asyncio.Event, set whenever the job changes state in this process
+_ai_jobs_running_by_user = {}
 
-@api_router.post("/ai/save-from-link")
-async def save_from_link(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Extract recipe from a TikTok/Instagram/YouTube link using oEmbed + AI."""
-    if not openai_client:
-        raise HTTPException(status_code=503, detail="AI features are not configured")
 
-    user = await get_current_user(credentials)
-    user = await consume_credit(user, "recipe_scan")  # 1 credit
+class SubmitAIJobRequest(BaseModel):
+    kind: str  # "recipe_scan" | "voice_to_recipe" | "save_from_link" ("pdf_import" is queued by /imports/pdf)
+    input: dict  # Same body the synchronous endpoint accepts
 
-    body = await request.json()
-    url = body.get("url", "").strip()
-    if not url:
-        raise HTTPException(status_code=400, detail="No URL provided")
 
-    # Determine platform and fetch oEmbed metadata
-    metadata = {"url": url, "title": "", "description": "", "author": "", "thumbnail": ""}
+async def ensure_ai_job_indexes():
+    await db.ai_jobs.create_index("id", unique=True)
+    await db.ai_jobs.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
+    await db.ai_jobs.create_index("user_id")
+    await db.ai_jobs.create_index("expires_at", expireAfterSeconds=0)
 
-    try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            # Try oEmbed endpoints
-            oembed_url = None
-            if "tiktok.com" in url:
-                oembed_url = f"https://www.tiktok.com/oembed?url={url}"
-            elif "instagram.com" in url:
-                oembed_url = f"https://api.instagram.com/oembed?url={url}"
-            elif "youtube.com" in url or "youtu.be" in url:
-                oembed_url = f"https://www.youtube.com/oembed?url={url}&format=json"
 
-            if oembed_url:
-                resp = await client.get(oembed_url)
-                if resp.status_code == 200:
-                    data = resp.json()
-                    metadata["title"] = data.get("title", "")
-                    metadata["author"] = data.get("author_name", "")
-                    metadata["thumbnail"] = data.get("thumbnail_url", "")
-                    metadata["description"] = data.get("title", "")  # oEmbed often puts description in title
+async def requeue_stale_ai_jobs():
+    """Return jobs whose worker died (lease expired) to the queue, or fail them after too many attempts."""
+    now = datetime.now(timezone.utc)
+    stale = {"status": "running", "lease_expires_at": {"$lt": now}}
+    failed = await db.ai_jobs.update_many(
+        {**stale, "attempts": {"$gte": AI_JOB_MAX_ATTEMPTS}},
+        {"$set": {
+            "status": "failed",
+            "error": {"status_code": 500, "detail": "AI job was interrupted too many times"},
+            "finished_at": now,
+            "expires_at": now + timedelta(seconds=AI_JOB_RETENTION_SECONDS),
+        }},
+    )
+    requeued = await db.ai_jobs.update_many(stale, {"$set": {"status": "queued"}, "$unset": {"worker": ""}})
+    if requeued.modified_count or failed.modified_count:
+        logger.info("AI jobs recovered: requeued=%d failed=%d", requeued.modified_count, failed.modified_count)
 
-            # Fallback: try to get Open Graph tags via a HEAD-like request
-            if not metadata["title"]:
-                resp = await client.get(url, follow_redirects=True, headers={"User-Agent": "Mozilla/5.0"})
-                text = resp.text[:5000]  # Only scan first 5k chars
-                import re
-                og_title = re.search(r'<meta[^>]+property=["\']og:title["\'][^>]+content=["\']([^"\']+)', text)
-                og_desc = re.search(r'<meta[^>]+property=["\']og:description["\'][^>]+content=["\']([^"\']+)', text)
-                og_image = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)', text)
-                if og_title:
-                    metadata["title"] = og_title.group(1)
-                if og_desc:
-                    metadata["description"] = og_desc.group(1)
-                if og_image:
-                    metadata["thumbnail"] = og_image.group(1)
 
+async def recover_stale_ai_jobs():
+    """Requeue jobs left by a dead worker on any instance, not only at this instance's startup."""
+    while True:
+        try:
+            await requeue_stale_ai_jobs()
+        except PyMongoError as e:
+            logger.error("AI job recovery failed: %s", e)
+        await asyncio.sleep(AI_JOB_LEASE_SECONDS / 2)
+
+
+def _notify_ai_job(job_id: str):
+    event = _ai_job_events.get(job_id)
+    if event:
+        event.set()
+
+
+async def claim_next_ai_job(worker_id: str) -> Optional[dict]:
+    """Atomically take the highest-priority queued job whose owner is below the per-user limit."""
+    saturated = [uid for uid, n in _ai_jobs_running_by_user.items() if n >= AI_JOB_PER_USER_CONCURRENCY]
+    now = datetime.now(timezone.utc)
+    return await db.ai_jobs.find_one_and_update(
+        {"status": "queued", "user_id": {"$nin": saturated}},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker_id,
+                "started_at": now,
+                "lease_expires_at": now + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("priority", -1), ("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _renew_ai_job_lease(job_id: str, worker_id: str):
+    while True:
+        await asyncio.sleep(AI_JOB_LEASE_SECONDS / 3)
+        try:
+            await db.ai_jobs.update_one(
+                {"id": job_id, "worker": worker_id, "status": "running"},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=AI_JOB_LEASE_SECONDS)}},
+            )
+        except PyMongoError as e:
+            # Keep renewing: the lease has room for a missed renewal or two
+            logger.warning("AI job lease renewal failed job=%s: %s", job_id, e)
+
+
+async def run_ai_job(job: dict, worker_id: str):
+    """
+    Run one claimed job to completion and record its result. Credits are reserved
+    atomically as paid work starts and refunded if the job fails or is cancelled,
+    so a finished result is never discarded for lack of credits.
+    """
+    job_id, user_id = job["id"], job["user_id"]
+    _ai_jobs_running_by_user[user_id] = _ai_jobs_running_by_user.get(user_id, 0) + 1
+    lease_task = asyncio.create_task(_renew_ai_job_lease(job_id, worker_id))
+    update = {}
+    charge = None
+    try:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        stream = await ai_job_payloads.open_download_stream(job["payload_file_id"])
+        payload = json.loads(await stream.read())
+
+        charge = RefundableCharge(user, partial(consume_credit, user))
+        with ai_usage_scope(f"job:{job['kind']}", user):
+            result = await AI_JOB_KINDS[job["kind"]]["pipeline"](user, payload, charge)
+        result["credits_remaining"] = charge.user.get("credits_balance", 0)
+        update = {"status": "succeeded", "result": result}
+    except HTTPException as e:
+        if charge:
+            await charge.refund(f"job {job['kind']} failed: {e.detail}")
+        update = {"status": "failed", "error": {"status_code": e.status_code, "detail": e.detail}}
+    except asyncio.CancelledError:
+        # Shutting down: hand the job straight back to the queue instead of leaving it
+        # running until the lease expires. The retry reserves its credits again.
+        if charge:
+            await charge.refund(f"job {job['kind']} interrupted")
+        try:
+            await db.ai_jobs.update_one(
+                {"id": job_id, "worker": worker_id, "status": "running"},
+                {"$set": {"status": "queued"}, "$unset": {"worker": "", "lease_expires_at": ""},
+                 "$inc": {"attempts": -1}},
+            )
+        except PyMongoError as e:
+            logger.warning("Could not requeue interrupted AI job job=%s: %s", job_id, e)
+        raise
     except Exception as e:
-        logger.warning("Failed to fetch social media metadata: %s", e)
-        # Continue with whatever we have — AI can work with just the URL
+        logger.exception("AI job failed job=%s kind=%s", job_id, job["kind"])
+        if charge:
+            await charge.refund(f"job {job['kind']} failed: {type(e).__name__}")
+        update = {"status": "failed", "error": {"status_code": 500, "detail": f"AI processing failed: {str(e)}"}}
+    finally:
+        lease_task.cancel()
+        _ai_jobs_running_by_user[user_id] -= 1
+        if _ai_jobs_running_by_user[user_id] <= 0:
+            del _ai_jobs_running_by_user[user_id]
 
-    # Use GPT-4o to structure into a recipe
+    now = datetime.now(timezone.utc)
+    update.update({"finished_at": now, "expires_at": now + timedelta(seconds=AI_JOB_RETENTION_SECONDS)})
+    await db.ai_jobs.update_one({"id": job_id, "worker": worker_id}, {"$set": update, "$unset": {"lease_expires_at": ""}})
     try:
-        meta_text = f"URL: {url}\nTitle: {metadata['title']}\nAuthor: {metadata['author']}\nDescription: {metadata['description']}"
+        await ai_job_payloads.delete(job["payload_file_id"])
+    except Exception as e:
+        logger.warning("Could not delete AI job payload job=%s: %s", job_id, e)
+    logger.info("AI job finished job=%s kind=%s status=%s", job_id, job["kind"], update["status"])
+    _notify_ai_job(job_id)
+    _ai_job_wakeup.set()  # A per-user slot freed up
 
-        response = await openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SOCIAL_RECIPE_PROMPT},
-                {"role": "user", "content": meta_text},
-            ],
-            max_tokens=2000,
-            temperature=0.2,
-        )
 
-        result_text = response.choices[0].message.content.strip()
-        if result_text.startswith("```"):
-            result_text = result_text.split("\n", 1)[1] if "\n" in result_text else result_text[3:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            result_text = result_text.strip()
+async def ai_job_worker(worker_id: str):
+    while True:
+        try:
+            job = await claim_next_ai_job(worker_id)
+        except PyMongoError as e:
+            logger.error("AI job claim failed worker=%s: %s", worker_id, e)
+            await asyncio.sleep(5)
+            continue
+
+        if job is None:
+            _ai_job_wakeup.clear()
+            try:
+                await asyncio.wait_for(_ai_job_wakeup.wait(), timeout=AI_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
 
-        recipe_data = json.loads(result_text)
-        recipe_data.setdefault("cooking_time", 30)
-        recipe_data.setdefault("servings", 4)
-        recipe_data.setdefault("category", "Main Course")
-        recipe_data.setdefault("difficulty", "easy")
-        recipe_data["source_url"] = url
-        recipe_data["source_author"] = metadata.get("author", "")
+        _notify_ai_job(job["id"])
+        try:
+            await run_ai_job(job, worker_id)
+        except PyMongoError as e:
+            # The lease will expire and another worker will pick the job up again
+            logger.error("AI job bookkeeping failed job=%s: %s", job["id"], e)
 
-        return {
-            "success": True,
-            "recipe": recipe_data,
-            "metadata": metadata,
-            "credits_remaining": user.get("credits_balance", 0),
-        }
 
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=422, detail="Could not extract a recipe from this link. Try a different video.")
-    except Exception as e:
-        logger.error("Save from link error: %s", e)
-        raise HTTPException(status_code=500, detail=f"Failed to process link: {str(e)}")
+def start_ai_job_workers():
+    if not openai_client:
+        return
+    host_id = uuid.uuid4().hex[:8]
+    for i in range(AI_JOB_WORKERS):
+        _ai_job_worker_tasks.append(asyncio.create_task(ai_job_worker(f"{host_id}-{i}")))
+    _ai_job_worker_tasks.append(asyncio.create_task(recover_stale_ai_jobs()))
+    logger.info("Started %d AI job workers", AI_JOB_WORKERS)
+
+
+async def stop_ai_job_workers():
+    for task in _ai_job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_ai_job_worker_tasks, return_exceptions=True)
+    _ai_job_worker_tasks.clear()
+
+
+def _ai_job_response(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat() if job.get("created_at") else None,
+        "finished_at": job["finished_at"].isoformat() if job.get("finished_at") else None,
+    }
+
+
+@api_router.post("/ai/jobs", status_code=202)
+async def submit_ai_job(body: SubmitAIJobRequest, user: dict = Depends(get_current_user)):
+    """Queue an AI recipe job and return its ID immediately. Credits are refunded if it fails."""
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="AI features are not configured")
+    if body.kind not in AI_JOB_KINDS or body.kind == "pdf_import":
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {body.kind}")
+
+    job_id = await enqueue_ai_job(user, body.kind, body.input)
+    return {"job_id": job_id, "status": "queued"}
+
+
+async def enqueue_ai_job(user: dict, kind: str, payload: dict) -> str:
+    """Queue a job of a known kind and return its ID."""
+    # Fail fast on an empty balance instead of queueing work that cannot be paid for
+    user = await refresh_credits_if_needed(user)
+    cost = CREDIT_COSTS.get(AI_JOB_KINDS[kind]["feature"], 1)
+    if user.get("credits_balance", 0) < cost:
+        raise insufficient_credits_error(user.get("credits_balance", 0), cost, user.get("subscription_tier"))
+
+    job_id = str(uuid.uuid4())
+    payload_file_id = await ai_job_payloads.upload_from_stream(
+        f"{job_id}.json", json.dumps(payload).encode("utf-8")
+    )
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": job_id,
+        "user_id": user["id"],
+        "kind": kind,
+        "status": "queued",
+        "priority": TIER_JOB_PRIORITY.get(user.get("subscription_tier"), 0),
+        "payload_file_id": payload_file_id,
+        "attempts": 0,
+        "created_at": now,
+    }
+    await db.ai_jobs.insert_one(job)
+    _ai_job_wakeup.set()
+    logger.info("AI job queued job=%s kind=%s user=%s", job_id, kind, user["id"])
+    return job_id
+
+
+async def _get_owned_ai_job(job_id: str, user: dict) -> dict:
+    job = await db.ai_jobs.find_one({"id": job_id}, {"_id": 0, "payload_file_id": 0})
+    if not job or job["user_id"] != user["id"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@api_router.get("/ai/jobs/{job_id}")
+async def get_ai_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Poll an AI job's status and, once finished, its result or error."""
+    return _ai_job_response(await _get_owned_ai_job(job_id, user))
+
+
+@api_router.get("/ai/jobs/{job_id}/events")
+async def stream_ai_job_events(job_id: str, user: dict = Depends(get_current_user)):
+    """Server-Sent Events stream of an AI job's status changes, ending when it finishes."""
+    job = await _get_owned_ai_job(job_id, user)
+
+    async def event_stream():
+        last_status = None
+        current = job
+        event = _ai_job_events.setdefault(job_id, asyncio.Event())
+        try:
+            while True:
+                if current["status"] != last_status:
+                    last_status = current["status"]
+                    yield f"event: status\ndata: {json.dumps(_ai_job_response(current))}\n\n"
+                if current["status"] in ("succeeded", "failed"):
+                    return
+                # Wake on a local state change, or poll in case another instance runs the job
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=AI_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                current = await db.ai_jobs.find_one({"id": job_id}, {"_id": 0, "payload_file_id": 0}) or current
+        finally:
+            _ai_job_events.pop(job_id, None)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ===================== LEGACY CLIPS (Milestone 3.3) =====================
@@ -2613,7 +7015,7 @@ async def add_legacy_clip(recipe_id: str, request: Request, credentials: HTTPAut
 
     await db.recipes.update_one(
         {"_id": recipe_id},
-        {"$push": {"legacy_clips": clip}}
+        {"$push": {"legacy_clips": clip}, "$set": {"updated_at": datetime.now(timezone.utc)}, "$inc": {"revision": 1}}
     )
 
     return {"success": True, "clip": {k: v for k, v in clip.items() if k != "video"}}
@@ -2671,7 +7073,7 @@ async def delete_legacy_clip(recipe_id: str, clip_id: str, credentials: HTTPAuth
 
     await db.recipes.update_one(
         {"_id": recipe_id},
-        {"$pull": {"legacy_clips": {"id": clip_id}}}
+        {"$pull": {"legacy_clips": {"id": clip_id}}, "$set": {"updated_at": datetime.now(timezone.utc)}, "$inc": {"revision": 1}}
     )
 
     return {"success": True}
@@ -2828,10 +7230,8 @@ async def update_holiday_tags(recipe_id: str, request: Request, credentials: HTT
     if recipe.get("family_id") != user.get("family_id"):
         raise HTTPException(status_code=403, detail="You can only tag recipes in your family")
 
-    await db.recipes.update_one(
-        {"_id": recipe_id},
-        {"$set": {"holiday_tags": tags}}
-    )
+    await db.recipes.update_one({"_id": recipe_id}, recipe_revision_update({"holiday_tags": tags}))
+    await bump_family_revisions(recipe.get("family_id"), "recipes_revision")
 
     return {"recipe_id": recipe_id, "holiday_tags": tags}
 
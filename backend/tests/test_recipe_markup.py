@@ -0,0 +1,161 @@
+import json
+
+import pytest
+
+from recipe_markup import (
+    extract_markup_recipe,
+    is_complete,
+    normalize_category,
+    parse_duration_minutes,
+    parse_servings,
+    recipe_from_caption,
+    recipe_from_json_ld,
+    recipe_from_microdata,
+)
+
+
+def json_ld_page(data) -> str:
+    return f'<html><head><script type="application/ld+json">{json.dumps(data)}</script></head></html>'
+
+
+RECIPE_NODE = {
+    "@type": "Recipe",
+    "name": "Grandma's Apple Pie",
+    "recipeIngredient": ["6 apples", "1 cup sugar", "2 pie crusts"],
+    "recipeInstructions": [
+        {"@type": "HowToStep", "text": "Slice the apples."},
+        {"@type": "HowToSection", "itemListElement": [{"@type": "HowToStep", "text": "Bake for 45 minutes."}]},
+    ],
+    "totalTime": "PT1H15M",
+    "recipeYield": ["8 servings"],
+    "recipeCategory": "Dessert",
+    "author": {"@type": "Person", "name": "Ruth"},
+}
+
+
+@pytest.mark.parametrize("value, minutes", [
+    ("PT1H30M", 90),
+    ("PT45M", 45),
+    ("P1DT2H", 1560),
+    ("PT0.5H", 30),
+    ("pt20m", 20),
+    ("PT30S", None),
+    ("P", None),
+    ("45 minutes", None),
+    (None, None),
+    (["PT10M"], 10),
+])
+def test_parse_duration_minutes(value, minutes):
+    assert parse_duration_minutes(value) == minutes
+
+
+@pytest.mark.parametrize("value, servings", [
+    ("8 servings", 8),
+    (["", "Serves 6"], 6),
+    (4, 4),
+    ("a crowd", None),
+    (None, None),
+])
+def test_parse_servings(value, servings):
+    assert parse_servings(value) == servings
+
+
+@pytest.mark.parametrize("values, category", [
+    (("Chicken Pot Pie",), "Main Course"),
+    (("Apple Pie",), "Dessert"),
+    (("Chocolate Chip Cookies",), "Dessert"),
+    (("Inside-out burger",), "Main Course"),
+    (("Remaining veggie stir fry",), "Main Course"),
+    ((None, "Inside-out burger", "side dish"), "Appetizer"),
+    ((["Dinner"], "Chocolate Cake"), "Main Course"),
+    (("", "Chocolate Cake", "dinner, easy"), "Dessert"),
+    (("Hors d'oeuvres",), "Appetizer"),
+    (("Tomato Soup",), "Soup"),
+    (("", None), "Main Course"),
+])
+def test_normalize_category(values, category):
+    assert normalize_category(*values) == category
+
+
+def test_json_ld_recipe():
+    recipe = recipe_from_json_ld(json_ld_page(RECIPE_NODE))
+    assert recipe["title"] == "Grandma's Apple Pie"
+    assert recipe["ingredients"] == ["6 apples", "1 cup sugar", "2 pie crusts"]
+    assert recipe["instructions"] == "Slice the apples.\n\nBake for 45 minutes."
+    assert recipe["cooking_time"] == 75
+    assert recipe["servings"] == 8
+    assert recipe["category"] == "Dessert"
+    assert recipe["source_author"] == "Ruth"
+    assert is_complete(recipe)
+
+
+def test_json_ld_recipe_in_graph_with_prep_and_cook_time():
+    node = {**RECIPE_NODE, "@type": ["Recipe", "NewsArticle"], "prepTime": "PT15M", "cookTime": "PT45M"}
+    del node["totalTime"]
+    recipe = recipe_from_json_ld(json_ld_page({"@context": "https://schema.org", "@graph": [{"@type": "WebPage"}, node]}))
+    assert recipe["cooking_time"] == 60
+
+
+def test_json_ld_ingredients_as_one_string():
+    node = {**RECIPE_NODE, "recipeIngredient": "2 cups water\n1 tsp salt"}
+    recipe = recipe_from_json_ld(json_ld_page(node))
+    assert recipe["ingredients"] == ["2 cups water", "1 tsp salt"]
+
+    node = {**RECIPE_NODE, "recipeIngredient": "2 cups water"}
+    assert recipe_from_json_ld(json_ld_page(node))["ingredients"] == ["2 cups water"]
+
+
+def test_json_ld_skips_invalid_blocks():
+    page = '<script type="application/ld+json">{not json</script>' + json_ld_page(RECIPE_NODE)
+    assert recipe_from_json_ld(page)["title"] == "Grandma's Apple Pie"
+    assert recipe_from_json_ld(json_ld_page({"@type": "WebPage"})) is None
+
+
+def test_microdata_recipe():
+    page = """
+    <div itemscope itemtype="https://schema.org/Recipe">
+      <h1 itemprop="name">Tomato Soup</h1>
+      <meta itemprop="totalTime" content="PT40M">
+      <span itemprop="recipeYield">4 bowls</span>
+      <ul>
+        <li itemprop="recipeIngredient">6 tomatoes</li>
+        <li itemprop="recipeIngredient">1 onion</li>
+      </ul>
+      <div itemprop="recipeInstructions">Roast the tomatoes.<br>Blend with the onion.</div>
+    </div>
+    <p itemprop="recipeIngredient">not part of the recipe</p>
+    """
+    recipe = recipe_from_microdata(page)
+    assert recipe["title"] == "Tomato Soup"
+    assert recipe["ingredients"] == ["6 tomatoes", "1 onion"]
+    assert recipe["instructions"] == "Roast the tomatoes.\n\nBlend with the onion."
+    assert recipe["cooking_time"] == 40
+    assert recipe["servings"] == 4
+    assert recipe["category"] == "Soup"
+
+
+def test_extract_markup_recipe_prefers_complete_json_ld():
+    assert extract_markup_recipe(json_ld_page(RECIPE_NODE))["title"] == "Grandma's Apple Pie"
+    assert extract_markup_recipe("<html><body>No recipe here</body></html>") is None
+
+
+def test_recipe_from_caption():
+    caption = """Easy weeknight chili 🌶️ #dinner
+Ingredients:
+- 1 lb ground beef
+- 1 can beans
+- 2 tbsp chili powder
+Method:
+1. Brown the beef.
+2. Add everything else and simmer.
+#chili #easyrecipes"""
+    recipe = recipe_from_caption(caption)
+    assert recipe["title"] == "Easy weeknight chili 🌶️"
+    assert recipe["ingredients"] == ["1 lb ground beef", "1 can beans", "2 tbsp chili powder"]
+    assert recipe["instructions"] == "Brown the beef.\n\nAdd everything else and simmer."
+    assert recipe["category"] == "Soup"
+
+
+def test_recipe_from_caption_needs_both_sections():
+    assert recipe_from_caption("Ingredients:\n- 1 egg\n- 1 cup milk") is None
+    assert recipe_from_caption("") is None
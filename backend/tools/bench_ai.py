@@ -0,0 +1,187 @@
+"""
+Load-test the AI endpoints (scan, voice, link import) and report throughput and
+p50/p95/p99 latency. Run the backend against tools/fake_openai.py to measure the
+AI pipeline's own overhead without spending credits or money:
+
+    python tools/fake_openai.py --latency-ms 1000 &
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=fake uvicorn server:app --port 8001 &
+    python tools/bench_ai.py --requests 200 --concurrency 20
+    python tools/bench_ai.py --endpoints scan --stream     # also reports time to first event
+
+Every request is made unique (a fresh image, recording or URL) so the AI result
+caches do not answer it. The bench user is registered on first use; with MONGO_URL
+and DB_NAME set (as for the backend) its credit balance is topped up before the run.
+Link imports use an unresolvable .invalid URL, so the page fetch fails fast and
+only the model call is measured.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import math
+import os
+import random
+import statistics
+import time
+import uuid
+import wave
+
+import httpx
+from PIL import Image, ImageDraw
+
+BENCH_EMAIL = "ai-bench@legacytable.invalid"
+BENCH_PASSWORD = "ai-bench-password"
+
+
+def unique_card_image(rng: random.Random) -> str:
+    """A small recipe-card-like JPEG data URL, different on every call, that passes the quality gate."""
+    img = Image.new("RGB", (1200, 900), (246, 240, 226))
+    draw = ImageDraw.Draw(img)
+    for row in range(10):
+        y = 100 + row * 70
+        draw.line([(80, y), (rng.randint(600, 1100), y + rng.randint(-5, 5))], fill=(40, 40, 90), width=5)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def unique_recording(rng: random.Random, seconds: float = 5.0) -> bytes:
+    """A short 16kHz WAV of tones and pauses, different on every call."""
+    rate = 16000
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        speaking = (i // 4000) % 3 != 2
+        sample = int(8000 * math.sin(2 * math.pi * 220 * i / rate)) if speaking else rng.randint(-50, 50)
+        frames += sample.to_bytes(2, "little", signed=True)
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return out.getvalue()
+
+
+def build_request(endpoint: str, rng: random.Random, stream: bool) -> dict:
+    params = {"stream": "1"} if stream else {}
+    if endpoint == "scan":
+        return {"path": "/ai/scan-recipe", "params": params, "json": {"image": unique_card_image(rng)}}
+    if endpoint == "voice":
+        return {
+            "path": "/ai/voice-to-recipe",
+            "params": {**params, "format": "wav"},
+            "content": unique_recording(rng),
+            "headers": {"Content-Type": "audio/wav"},
+        }
+    return {"path": "/ai/save-from-link", "params": params,
+            "json": {"url": f"https://recipes.invalid/bench/{uuid.uuid4().hex}"}}
+
+
+async def bench_token(client: httpx.AsyncClient) -> str:
+    resp = await client.post("/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    if resp.status_code != 200:
+        resp = await client.post(
+            "/auth/register", json={"name": "AI Bench", "email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+        )
+    resp.raise_for_status()
+    return resp.json()["token"]
+
+
+def top_up_credits(credits: int):
+    mongo_url, db_name = os.environ.get("MONGO_URL"), os.environ.get("DB_NAME")
+    if not mongo_url or not db_name:
+        print("MONGO_URL/DB_NAME not set; the run is limited by the bench user's credits")
+        return
+    from pymongo import MongoClient
+
+    with MongoClient(mongo_url) as mongo:
+        mongo[db_name].users.update_one({"email": BENCH_EMAIL}, {"$set": {"credits_balance": credits}})
+
+
+async def timed_request(client: httpx.AsyncClient, spec: dict, stream: bool) -> dict:
+    started = time.perf_counter()
+    first_event = None
+    status = None
+    try:
+        async with client.stream(
+            "POST", spec["path"], params=spec["params"], json=spec.get("json"),
+            content=spec.get("content"), headers=spec.get("headers"),
+        ) as resp:
+            status = resp.status_code
+            async for line in resp.aiter_lines():
+                if stream and first_event is None and line.startswith("event:"):
+                    first_event = time.perf_counter() - started
+                if stream and line.startswith("event: error"):
+                    status = "stream-error"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return {"status": status, "elapsed": time.perf_counter() - started, "first_event": first_event}
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def report(endpoint: str, results: list, wall: float):
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    print(f"\n{endpoint}: {len(results)} requests in {wall:.1f}s, {len(ok) / wall:.2f} ok/s, statuses {statuses}")
+    if endpoint == "scan" and statuses.get("422"):
+        # The quality gate answers 422 before any model call, so these would measure the rejection path
+        print("  422s are photos the quality gate rejected (or the model could not parse); "
+              "check the card with tools/check_scan_quality.py")
+    if not ok:
+        return
+    latencies = [r["elapsed"] * 1000 for r in ok]
+    print(f"  latency ms     p50 {percentile(latencies, 50):>8.0f}  p95 {percentile(latencies, 95):>8.0f}  "
+          f"p99 {percentile(latencies, 99):>8.0f}  mean {statistics.mean(latencies):>8.0f}")
+    firsts = [r["first_event"] * 1000 for r in ok if r["first_event"] is not None]
+    if firsts:
+        print(f"  first event ms p50 {percentile(firsts, 50):>8.0f}  p95 {percentile(firsts, 95):>8.0f}  "
+              f"p99 {percentile(firsts, 99):>8.0f}")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as client:
+        token = await bench_token(client)
+        top_up_credits(args.requests * 2 * len(args.endpoints) + 100)
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        for endpoint in args.endpoints:
+            # Payloads are built up front so generating them is not part of the measurement
+            specs = [build_request(endpoint, rng, args.stream) for _ in range(args.requests)]
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one(spec):
+                async with semaphore:
+                    return await timed_request(client, spec, args.stream)
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one(spec) for spec in specs))
+            report(endpoint, results, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001/api")
+    parser.add_argument("--endpoints", default="scan,voice,link", help="Comma-separated: scan, voice, link")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="Use the Server-Sent Events variant")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    args.endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(args.endpoints) - {"scan", "voice", "link"}
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark scan image preprocessing: upload size, estimated GPT-4o image tokens
+and estimated upload time for the original photo versus the preprocessed one.
+
+Usage:
+    python tools/bench_scan_preprocess.py                   # synthetic 12MP recipe-card photos
+    python tools/bench_scan_preprocess.py card1.jpg card2.heic
+    python tools/bench_scan_preprocess.py --uplink-mbps 5 photos/*.jpg
+"""
+import argparse
+import base64
+import io
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import estimate_vision_tokens, preprocess_scan_image  # noqa: E402
+
+
+def synthetic_card_photo(seed: int) -> bytes:
+    """A 4032x3024 phone photo of a handwritten-style card on a wooden table, stored rotated with EXIF."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (4032, 3024), (120, 84, 52))
+    draw = ImageDraw.Draw(img)
+    for y in range(0, 3024, 12):  # Wood grain
+        shade = rng.randint(-12, 12)
+        draw.line([(0, y), (4032, y + rng.randint(-20, 20))], fill=(120 + shade, 84 + shade, 52 + shade), width=6)
+
+    left, top = rng.randint(500, 800), rng.randint(400, 600)
+    right, bottom = left + 2700, top + 1800
+    draw.rectangle([left, top, right, bottom], fill=(246, 240, 226))
+    for row in range(14):  # Ink strokes standing in for handwriting
+        y = top + 150 + row * 115
+        x = left + 120
+        while x < right - 300:
+            w = rng.randint(60, 220)
+            draw.line([(x, y), (x + w, y + rng.randint(-8, 8))], fill=(40, 40, 90), width=7)
+            x += w + rng.randint(25, 60)
+
+    # Phones store the sensor image sideways and record the rotation in EXIF
+    img = img.rotate(90, expand=True)
+    exif = Image.Exif()
+    exif[274] = 6
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92, exif=exif)
+    return out.getvalue()
+
+
+def measure(image_bytes: bytes, profile: str, uplink_mbps: float) -> dict:
+    img = Image.open(io.BytesIO(image_bytes))
+    before_b64 = len(base64.b64encode(image_bytes))
+
+    started = time.perf_counter()
+    prepared = preprocess_scan_image(image_bytes, profile)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    after_b64 = len(base64.b64encode(prepared["data"]))
+
+    bytes_per_second = uplink_mbps * 1_000_000 / 8
+    return {
+        "before_b64": before_b64,
+        "after_b64": after_b64,
+        "before_tokens": estimate_vision_tokens(img.width, img.height, "high"),
+        "after_tokens": estimate_vision_tokens(prepared["width"], prepared["height"], prepared["detail"]),
+        "before_upload_ms": before_b64 / bytes_per_second * 1000,
+        "after_upload_ms": after_b64 / bytes_per_second * 1000 + elapsed_ms,
+        "preprocess_ms": elapsed_ms,
+        "size": f"{img.width}x{img.height}->{prepared['width']}x{prepared['height']}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Photos to benchmark (default: synthetic card photos)")
+    parser.add_argument("--profile", default="standard", help="Preprocessing profile (standard or detail)")
+    parser.add_argument("--synthetic", type=int, default=3, help="Number of synthetic photos when no paths are given")
+    parser.add_argument("--uplink-mbps", type=float, default=20.0, help="Server-to-OpenAI upload bandwidth to model")
+    args = parser.parse_args()
+
+    if args.images:
+        samples = [(p, Path(p).read_bytes()) for p in args.images]
+    else:
+        samples = [(f"synthetic-{i}", synthetic_card_photo(i)) for i in range(args.synthetic)]
+
+    rows = []
+    print(f"{'image':<24} {'size':<22} {'b64 KB before':>13} {'after':>8} {'tokens':>7} {'after':>6} {'prep ms':>8}")
+    for name, data in samples:
+        r = measure(data, args.profile, args.uplink_mbps)
+        rows.append(r)
+        print(
+            f"{Path(name).name[:24]:<24} {r['size']:<22} {r['before_b64'] / 1024:>13.0f} {r['after_b64'] / 1024:>8.0f} "
+            f"{r['before_tokens']:>7} {r['after_tokens']:>6} {r['preprocess_ms']:>8.1f}"
+        )
+
+    def total(key):
+        return sum(r[key] for r in rows)
+
+    print()
+    print(f"upload bytes:   {total('before_b64') / 1024:.0f} KB -> {total('after_b64') / 1024:.0f} KB "
+          f"({100 * (1 - total('after_b64') / total('before_b64')):.0f}% less)")
+    print(f"image tokens:   {total('before_tokens')} -> {total('after_tokens')} "
+          f"({100 * (1 - total('after_tokens') / total('before_tokens')):.0f}% less)")
+    print(f"upload latency: median {statistics.median(r['before_upload_ms'] for r in rows):.0f} ms -> "
+          f"{statistics.median(r['after_upload_ms'] for r in rows):.0f} ms at {args.uplink_mbps:g} Mbit/s "
+          f"(after includes preprocessing)")
+
+
+if __name__ == "__main__":
+    main()
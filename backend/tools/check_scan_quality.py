@@ -0,0 +1,80 @@
+"""
+Run the pre-scan quality gate (imaging.assess_scan_image) over photos and print
+each verdict with its metrics, to check threshold changes against real cards.
+Without paths it uses a built-in set of synthetic cases whose expected verdict is
+known, and exits non-zero if any disagrees:
+
+    python tools/check_scan_quality.py
+    python tools/check_scan_quality.py card1.jpg card2.jpg
+"""
+import argparse
+import io
+import sys
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import assess_scan_image  # noqa: E402
+
+CREAM = (246, 240, 226)
+INK = (40, 40, 90)
+
+
+def card(lines: int, size=(4000, 3000), background=CREAM, blur: float = 0, brightness: float = 1.0) -> bytes:
+    """A card filling the frame with the given number of handwritten-style lines."""
+    width, height = size
+    img = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(img)
+    for row in range(lines):
+        y = int(height * 0.12) + row * int(height * 0.07)
+        draw.line([(int(width * 0.08), y), (int(width * 0.8), y + 6)], fill=INK, width=max(2, width // 570))
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    if brightness != 1.0:
+        img = img.point(lambda p: int(p * brightness))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+# (name, image bytes, expected verdict)
+SYNTHETIC_CASES = [
+    ("sparse card, 3 lines", lambda: card(3), "not reject"),
+    ("sparse card, 6 lines", lambda: card(6), "not reject"),
+    ("card, 10 lines", lambda: card(10), "not reject"),
+    ("small card, 10 lines", lambda: card(10, size=(1200, 900)), "not reject"),
+    ("blank card", lambda: card(0), "reject"),
+    ("dark card", lambda: card(10, brightness=0.1), "reject"),
+    ("blurred card", lambda: card(10, blur=12), "reject"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Photos to check (default: the synthetic cases)")
+    args = parser.parse_args()
+
+    if args.images:
+        samples = [(Path(p).name, Path(p).read_bytes(), None) for p in args.images]
+    else:
+        samples = [(name, make(), expected) for name, make, expected in SYNTHETIC_CASES]
+
+    mismatches = 0
+    for name, data, expected in samples:
+        result = assess_scan_image(data)
+        verdict = result["verdict"]
+        issues = ",".join(result["rejected"] + result["warnings"]) or "-"
+        flag = ""
+        if expected and (verdict == "reject") != (expected == "reject"):
+            flag = f"  << expected {expected}"
+            mismatches += 1
+        m = result["metrics"]
+        print(f"{name[:28]:<28} {verdict:<7} {issues:<22} brightness {m['brightness']:>5} contrast {m['contrast']:>5} "
+              f"sharpness {m['sharpness']:>8} text {m['text_density']:.4f}{flag}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
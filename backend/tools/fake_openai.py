@@ -0,0 +1,221 @@
+"""
+Offline stand-in for the OpenAI endpoints the backend uses, for load tests that
+should not spend money or hit rate limits.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/audio/transcriptions
+with configurable latency, injected errors and canned recipe JSON, including
+fenced and malformed variants. AsyncOpenAI reads OPENAI_BASE_URL, so point the
+backend at it with:
+
+    python tools/fake_openai.py --port 9100 --latency-ms 1500 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=fake uvicorn server:app --port 8001
+
+Latency is log-normal around --latency-ms (--latency-sigma sets the spread), so
+the tail looks like a real provider's rather than a fixed delay.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+CANNED_RECIPE = {
+    "title": "Grandma's Sunday Pot Roast",
+    "ingredients": [
+        "3 lb chuck roast",
+        "1 tbsp vegetable oil",
+        "4 carrots, cut in chunks",
+        "1 onion, quartered",
+        "3 cloves garlic",
+        "2 cups beef broth",
+        "1 tsp dried thyme",
+        "Salt and pepper",
+    ],
+    "instructions": "Season the roast and brown it in oil on all sides.\n\n"
+                    "Add the vegetables, garlic, broth and thyme, cover and braise at 325F for 3 hours.\n\n"
+                    "Rest for 10 minutes before slicing.",
+    "cooking_time": 200,
+    "servings": 6,
+    "category": "Main Course",
+    "difficulty": "medium",
+    "story": "Made every Sunday after church.",
+}
+
+CANNED_TRANSCRIPT = (
+    "This is my grandmother's pot roast. You need a three pound chuck roast, a tablespoon of oil, "
+    "four carrots, an onion, three cloves of garlic, two cups of beef broth and some thyme. "
+    "Brown the roast, add everything else and braise it for three hours at three twenty five."
+)
+
+STREAM_CHUNK_CHARS = 24
+
+
+def recipe_content(prompt_text: str, variant: str) -> str:
+    """The assistant message for a prompt, shaped the way the matching backend prompt asks for."""
+    recipe = dict(CANNED_RECIPE)
+    if "continues_previous" in prompt_text:
+        recipe["continues_previous"] = False
+    if '"recipes"' in prompt_text:
+        body = json.dumps({"recipes": [recipe]}, indent=2)
+    else:
+        body = json.dumps(recipe, indent=2)
+
+    if variant == "fenced":
+        return f"```json\n{body}\n```"
+    if variant == "malformed":
+        return body[: len(body) // 2]  # Truncated mid-object, like a max_tokens cut-off
+    return body
+
+
+def prompt_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if isinstance(item, dict))
+    return "\n".join(parts)
+
+
+class FakeOpenAI:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.counts = {"requests": 0, "errors": 0}
+
+    def latency(self) -> float:
+        return self.rng.lognormvariate(0, self.args.latency_sigma) * self.args.latency_ms / 1000
+
+    def variant(self) -> str:
+        roll = self.rng.random()
+        if roll < self.args.malformed_rate:
+            return "malformed"
+        if roll < self.args.malformed_rate + self.args.fenced_rate:
+            return "fenced"
+        return "clean"
+
+    async def injected_error(self):
+        """Return an error response (or hang) for a share of requests, else None."""
+        self.counts["requests"] += 1
+        if self.rng.random() >= self.args.error_rate:
+            return None
+        self.counts["errors"] += 1
+        kind = self.rng.choice(self.args.error_kinds)
+        if kind == "timeout":
+            await asyncio.sleep(self.args.hang_seconds)
+            kind = "500"
+        if kind == "429":
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after": "1"},
+            )
+        return JSONResponse(
+            {"error": {"message": "The server had an error processing your request", "type": "server_error"}},
+            status_code=int(kind),
+        )
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        error = await self.injected_error()
+        if error is not None:
+            return error
+
+        content = recipe_content(prompt_text(body.get("messages", [])), self.variant())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o")
+        delay = self.latency()
+        usage = {"prompt_tokens": 1200, "completion_tokens": len(content) // 4, "total_tokens": 1200 + len(content) // 4}
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        # A third of the latency before the first token, the rest spread over the chunks
+        chunks = [content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+        per_chunk = delay * 2 / 3 / max(1, len(chunks))
+
+        def chunk_event(delta: dict, finish_reason=None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(delay / 3)
+            yield chunk_event({"role": "assistant", "content": ""})
+            for piece in chunks:
+                await asyncio.sleep(per_chunk)
+                yield chunk_event({"content": piece})
+            yield chunk_event({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield "data: " + json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": model, "choices": [], "usage": usage,
+                }) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def transcriptions(self, request: Request):
+        form = await request.form()  # Read the whole upload, as the real API does
+        await form.close()
+        error = await self.injected_error()
+        if error is not None:
+            return error
+        await asyncio.sleep(self.latency())
+        return JSONResponse({"text": CANNED_TRANSCRIPT})
+
+    async def stats(self, request: Request):
+        return JSONResponse(self.counts)
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/v1/audio/transcriptions", self.transcriptions, methods=["POST"]),
+            Route("/stats", self.stats),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=1200.0, help="Median response time")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread (0 for a fixed delay)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail")
+    parser.add_argument("--error-kinds", default="500,503,429,timeout",
+                        help="Comma-separated failures to choose from: HTTP status codes and/or timeout")
+    parser.add_argument("--hang-seconds", type=float, default=120.0, help="How long a timeout error hangs")
+    parser.add_argument("--fenced-rate", type=float, default=0.2, help="Share of answers wrapped in a code fence")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of answers cut off mid-JSON")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    args.error_kinds = [kind.strip() for kind in args.error_kinds.split(",") if kind.strip()]
+
+    import uvicorn
+
+    uvicorn.run(FakeOpenAI(args).app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -3410,7 +3410,7 @@ const ScanRecipePage = () => {
       toast.success("Recipe extracted!");
     } catch (err) {
       const detail = err.response?.data?.detail;
-      if (typeof detail === "object" && detail.error === "insufficient_credits") {
+      if (typeof detail === "object" && (detail.error === "insufficient_credits" || detail.error === "image_quality")) {
         toast.error(detail.message);
       } else {
         toast.error(typeof detail === "string" ? detail : "Failed to scan recipe. Try a clearer photo.");